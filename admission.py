@@ -0,0 +1,216 @@
+"""
+===============================================
+ADMISSION CONTROL - RUN MANY JOBS AT ONCE WITHOUT RUNNING OUT OF MEMORY
+===============================================
+
+A 12 MB JPEG can be a 100-megapixel photo. Decoded, that's 300 MB of
+pixels - and encrypting it holds a few copies at once (the pixels, the
+PNG bytes, the XORed bytes). Run eight of those at the same time and
+the computer runs out of memory, and the system kills the program.
+
+Using fewer workers would fix that, but then a batch of small images
+crawls. ADMISSION CONTROL fixes it properly:
+
+1. ESTIMATE each job's peak memory BEFORE starting it, from the image
+   header alone (width x height x bytes per pixel) - opening the header
+   is quick, decoding the pixels is not.
+2. Keep a MEMORY BUDGET (e.g. 4 GB). A job only starts while the
+   estimates of all running jobs, plus its own, fit in the budget.
+   A job bigger than the whole budget runs when nothing else does.
+3. BACKFILL: while a big job waits for room, small jobs behind it that
+   DO fit may go first, so the workers don't sit idle. After `backfill`
+   jobs have passed it, the big job gets its turn - it can't be starved.
+
+    budget = MemoryBudget(4 * 1024**3)
+    with budget.reserve(estimate_memory("huge.tiff", "encrypt")):
+        encryptor.encrypt_image("huge.tiff", "secret")
+
+pipeline.py and daemon.py use it with --memory-budget MB.
+"""
+
+import contextlib
+import os
+import threading
+
+from PIL import Image
+
+import metrics
+from image_encryption import ImageEncryption
+
+
+DEFAULT_BACKFILL = 64  # Jobs that may pass a waiting big one before it gets its turn
+
+# Copies of the decoded pixels that exist at the same time at the worst moment:
+# encrypt: the pixels, the encoded PNG (up to the same size for noisy
+#          images) and its XORed copy
+# decrypt: the decoded pixels and the encoded output
+_ENCRYPT_COPIES = 3
+_DECRYPT_COPIES = 2
+
+_END = object()  # Marks the end of the items in schedule()
+
+_BYTES_PER_BAND = {"I": 4, "F": 4, "I;16": 2, "I;16B": 2, "I;16L": 2, "I;16N": 2}
+
+
+def bytes_per_pixel(mode: str) -> int:
+    """How much memory one decoded pixel takes in this color mode."""
+    try:
+        bands = Image.getmodebands(mode)
+    except (KeyError, ValueError):
+        return 4  # An unusual mode - assume the biggest common size
+    return bands * _BYTES_PER_BAND.get(mode, 1)
+
+
+def estimate_memory(path: str, op: str, password: str = None, stream: bool = False) -> int:
+    """
+    Guess the peak memory (in bytes) of encrypting or decrypting one file,
+    reading only its header.
+
+    - op: "encrypt" or "decrypt"
+    - password: Needed to read an encrypted file's header (without it,
+                or if the header can't be read, we guess from the file size)
+    - stream: The bytes go through as they are (encrypt_stream): no pixels at all
+    """
+    file_bytes = os.path.getsize(path)
+    if stream:
+        return 2 * file_bytes  # What was read + its XORed copy (at most)
+
+    try:
+        if op == "encrypt":
+            with Image.open(path) as img:
+                size, mode = img.size, img.mode
+        else:
+            if password is None:
+                raise ValueError("can't read the header without the password")
+            # A frame pack is decoded one frame at a time, so one frame is what counts.
+            # _probe(), not probe_image(): this peek shouldn't count as a probe in the metrics
+            info, _ = ImageEncryption(verbose=False)._probe(path, password)
+            size, mode = info["size"], info["mode"]
+    except Exception:
+        # Not an image we can read (or a wrong password): it will fail fast,
+        # or go through as plain bytes
+        return 2 * file_bytes
+
+    pixels = size[0] * size[1] * bytes_per_pixel(mode)
+    if op == "encrypt":
+        return file_bytes + _ENCRYPT_COPIES * pixels
+    return 2 * file_bytes + _DECRYPT_COPIES * pixels
+
+
+class MemoryBudget:
+    """
+    Admits jobs while their estimated memory fits in max_bytes.
+    Safe to share between threads.
+    """
+
+    def __init__(self, max_bytes: int, backfill: int = DEFAULT_BACKFILL):
+        """
+        Parameters:
+        - max_bytes: The budget (leave room for Python itself and the page cache!)
+        - backfill: How many smaller jobs may go ahead of a waiting big job
+        """
+        if max_bytes <= 0:
+            raise ValueError("The memory budget must be more than 0 bytes")
+        self.max_bytes = max_bytes
+        self.backfill = backfill
+        self.in_use = 0
+        self.running = 0
+        self.peak = 0
+        self.backfilled = 0  # Jobs that went ahead of a bigger one
+        self._changed = threading.Condition()
+        self._waiting = []   # [bytes, times passed] for each thread in acquire(), oldest first
+
+    def _fits(self, nbytes: int) -> bool:
+        """Call with the lock held. A job bigger than the budget fits only when nothing runs."""
+        return self.in_use + nbytes <= self.max_bytes or self.running == 0
+
+    def _take(self, nbytes: int):
+        self.in_use += nbytes
+        self.running += 1
+        self.peak = max(self.peak, self.in_use)
+        metrics.MEMORY_RESERVED.set(self.in_use)
+
+    def acquire(self, nbytes: int):
+        """
+        Wait until a job of nbytes may start, then count it as running.
+        Threads get their turn in arrival order - except that a job that
+        fits may pass older ones that don't (up to `backfill` times each).
+        """
+        with self._changed:
+            ticket = [nbytes, 0]
+            self._waiting.append(ticket)
+            try:
+                while True:
+                    ahead = self._waiting[:self._waiting.index(ticket)]
+                    # Older jobs go first if they fit; the ones that don't may be passed (a few times)
+                    if self._fits(nbytes) and all(passed < self.backfill and not self._fits(size)
+                                                  for size, passed in ahead):
+                        break
+                    self._changed.wait()
+                for other in ahead:
+                    other[1] += 1
+                self.backfilled += bool(ahead)
+                self._take(nbytes)
+            finally:
+                self._waiting.remove(ticket)
+
+    def release(self, nbytes: int):
+        """A job of nbytes finished (or failed): make its room available again."""
+        with self._changed:
+            self.in_use -= nbytes
+            self.running -= 1
+            metrics.MEMORY_RESERVED.set(self.in_use)
+            self._changed.notify_all()
+
+    @contextlib.contextmanager
+    def reserve(self, nbytes: int):
+        """with budget.reserve(n): ... - acquire() before the block, release() after it."""
+        self.acquire(nbytes)
+        try:
+            yield
+        finally:
+            self.release(nbytes)
+
+    def schedule(self, items, size_of):
+        """
+        For a single feeder (like pipeline.py's): go through items, and
+        yield each one once it has been admitted - in order, except that
+        items that fit may jump ahead of a waiting big one (backfill).
+        size_of(item) gives an item's estimate; it's only called as the
+        items are reached. Call release() with its estimate when each one is done.
+        """
+        items = iter(items)
+        window = []  # [item, estimate] looked at so far, not yet admitted
+        passed = 0   # How many items went ahead of window[0]
+        while True:
+            # Look up to `backfill` items past the first one for something that fits
+            while len(window) <= self.backfill:
+                item = next(items, _END)
+                if item is _END:
+                    break
+                window.append([item, size_of(item)])
+            if not window:
+                return
+            with self._changed:
+                while True:
+                    if self._fits(window[0][1]):
+                        pick = 0
+                        break
+                    if passed < self.backfill:
+                        pick = next((i for i, (_, nbytes) in enumerate(window) if self._fits(nbytes)), None)
+                        if pick is not None:
+                            break
+                    self._changed.wait()
+                item, nbytes = window.pop(pick)
+                self._take(nbytes)
+            if pick:
+                passed += 1
+                self.backfilled += 1
+            else:
+                passed = 0
+            yield item
+
+    def stats(self) -> dict:
+        with self._changed:
+            return {"budget": self.max_bytes, "in_use": self.in_use, "running": self.running,
+                    "peak": self.peak, "backfilled": self.backfilled}
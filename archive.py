@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+"""
+===============================================
+PACKED ARCHIVE - MANY ENCRYPTED IMAGES IN ONE BIG FILE
+===============================================
+
+A million tiny photo_encrypted.png files are hard on a file system:
+every file costs an "inode" (its entry on disk), listing the folder
+takes ages, and opening each file is a trip to the disk's bookkeeping.
+
+An ARCHIVE packs them all into ONE file, a bit like a .zip:
+
+    PACK_MAGIC | image 1 | image 2 | ... | index (JSON) | footer
+
+- Each image is stored exactly as its own _encrypted.png file would be
+  (encrypted from offset 0), so taking one out is just: seek to it, read
+  its bytes, XOR them. Nothing else in the archive is touched.
+- The INDEX lists every member: name, offset, length, and details like
+  size and color mode. Opening the archive reads only the index, and
+  finding a member is a dictionary lookup - just as fast with a million.
+- The FOOTER (last 24 bytes) says where the index starts.
+
+APPENDING never overwrites anything: new images go after the old footer,
+then a new index and footer are written at the very end. If that gets
+interrupted, the old footer is still in the file, and opening the
+archive falls back to it - you lose the half-added images, never the
+old ones.
+
+The index is NOT encrypted (names and image sizes can be listed without
+the password), just like the names of _encrypted.png files on disk.
+
+    python3 archive.py pack photos.pack photos/ -p secret
+    python3 archive.py pack photos.pack encrypted/ --encrypted   # already encrypted files
+    python3 archive.py ls photos.pack
+    python3 archive.py extract photos.pack -o out/ -p secret --threads 8
+    python3 archive.py extract photos.pack photos/cat.jpg -o out/ -p secret
+"""
+
+import argparse
+import json
+import os
+import struct
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from client import read_password
+from image_encryption import (DEFAULT_PROFILE, ENCODING_PROFILES, FRAME_FORMATS, FRAMES_MAGIC,
+                              ImageEncryption, atomic_output, decrypted_name, make_key, open_payload,
+                              save_image, xor_bytes)
+from pipeline import expand_inputs
+
+
+PACK_MAGIC = b"IMGPACK1"
+_FOOTER = struct.Struct(">8sQQ")  # Magic, index offset, index length
+_FOOTER_MAGIC = b"IMGPKEND"
+_SCAN_CHUNK = 1024 * 1024
+_BATCH = 64  # Images encoded ahead of the writer when packing with threads
+
+
+class PackArchive:
+    """
+    One archive file. Open with mode "r" to read, or "a" to add members
+    (the file is created if it doesn't exist). Reading is safe from many
+    threads at once.
+    """
+
+    def __init__(self, path: str, mode: str = "r"):
+        if mode not in ("r", "a"):
+            raise ValueError(f"mode must be 'r' or 'a', not {mode!r}")
+        self.path = path
+        self.mode = mode
+        self._lock = threading.Lock()
+        self._dirty = False
+
+        if mode == "a" and not os.path.exists(path):
+            with open(path, 'xb') as f:
+                f.write(PACK_MAGIC)
+            self.f = open(path, 'r+b')
+            self.members = {}
+            self.end = len(PACK_MAGIC)
+            self._dirty = True  # Write an (empty) index even if nothing is added
+        else:
+            self.f = open(path, 'r+b' if mode == "a" else 'rb')
+            if self.f.read(len(PACK_MAGIC)) != PACK_MAGIC:
+                self.f.close()
+                raise ValueError(f"{path} is not an image archive")
+            self.members, self.end = self._load_index()
+
+    # ========== FINDING THE INDEX ==========
+
+    def _footer_at(self, position: int):
+        """The index (offset, length) if a valid footer starts at position, else None."""
+        self.f.seek(position)
+        magic, index_offset, index_length = _FOOTER.unpack(self.f.read(_FOOTER.size))
+        if magic != _FOOTER_MAGIC or index_offset + index_length != position:
+            return None
+        return index_offset, index_length
+
+    def _load_index(self) -> tuple:
+        """
+        Read the index. Returns (members, where the valid part of the file ends).
+        Normally the footer is the last 24 bytes; after an interrupted append
+        we search backwards for the newest complete one.
+        """
+        size = os.fstat(self.f.fileno()).st_size
+        candidates = [size - _FOOTER.size] if size >= len(PACK_MAGIC) + _FOOTER.size else []
+        position = size
+        while True:
+            for footer in candidates:
+                found = self._footer_at(footer) if footer >= len(PACK_MAGIC) else None
+                if found is not None:
+                    self.f.seek(found[0])
+                    try:
+                        index = json.loads(self.f.read(found[1]))
+                    except ValueError:
+                        continue
+                    return index["members"], footer + _FOOTER.size
+            if position <= len(PACK_MAGIC):
+                raise ValueError(f"{self.path} has no readable index")
+            # Look for the footer's magic bytes in the previous chunk
+            start = max(len(PACK_MAGIC), position - _SCAN_CHUNK)
+            self.f.seek(start)
+            chunk = self.f.read(position - start + len(_FOOTER_MAGIC) - 1)
+            candidates, at = [], chunk.rfind(_FOOTER_MAGIC)
+            while at != -1:
+                if start + at + _FOOTER.size <= size:
+                    candidates.append(start + at)
+                at = chunk.rfind(_FOOTER_MAGIC, 0, at)
+            position = start
+
+    # ========== READING MEMBERS ==========
+
+    def names(self) -> list:
+        return sorted(self.members)
+
+    def read(self, name: str) -> bytes:
+        """A member's bytes, still encrypted (the same bytes as its _encrypted.png file)."""
+        try:
+            entry = self.members[name]
+        except KeyError:
+            raise FileNotFoundError(f"No member named {name} in {self.path}")
+        if hasattr(os, "pread"):
+            # pread reads at an offset without moving the shared file position,
+            # so many threads can read at once without getting in each other's way
+            return os.pread(self.f.fileno(), entry["length"], entry["offset"])
+        with self._lock:
+            self.f.seek(entry["offset"])
+            return self.f.read(entry["length"])
+
+    def open_image(self, name: str, password: str, threads: int = None):
+        """Decrypt one (single-frame) member into a PIL image, without writing any file."""
+        decrypted = xor_bytes(self.read(name), make_key(password))
+        if decrypted.startswith(FRAMES_MAGIC):
+            raise ValueError(f"{name} has several frames - use extract() instead")
+        try:
+            img = open_payload(decrypted, threads)
+            img.load()
+        except Exception:
+            raise ValueError("❌ Decryption failed! Wrong password or corrupted file.")
+        return img
+
+    def output_name(self, name: str, output_dir: str, profile: str = DEFAULT_PROFILE) -> str:
+        """Where extract() saves a member: "photos/cat.jpg" -> "out/photos/cat_decrypted.png"."""
+        # Drop "..", so a member can never be saved outside output_dir
+        parts = [part for part in name.split("/") if part not in ("", ".", "..")]
+        path = decrypted_name(os.path.join(output_dir, *parts), profile)
+        entry = self.members.get(name, {})
+        if entry.get("frames", 1) > 1 and entry.get("format") in FRAME_FORMATS:
+            path = os.path.splitext(path)[0] + FRAME_FORMATS[entry["format"]]
+        return path
+
+    def extract(self, name: str, password: str, output_path: str = None,
+                encryptor: ImageEncryption = None) -> str:
+        """Decrypt one member to a file. Returns where it was saved."""
+        encryptor = encryptor or ImageEncryption(verbose=False)
+        output_path = output_path or self.output_name(name, ".", encryptor.profile)
+        folder = os.path.dirname(output_path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+        data = self.read(name)
+        key = make_key(password)
+        if xor_bytes(data[:len(FRAMES_MAGIC)], key) == FRAMES_MAGIC:
+            # Frame packs are rebuilt by decrypt_image(), which needs a file
+            with tempfile.NamedTemporaryFile(dir=folder or ".", suffix=".part") as temp:
+                temp.write(data)
+                temp.flush()
+                return encryptor.decrypt_image(temp.name, password, output_path)
+
+        try:
+            img = open_payload(xor_bytes(data, key), encryptor.threads)
+        except Exception:
+            raise ValueError("❌ Decryption failed! Wrong password or corrupted file.")
+        with atomic_output(output_path) as out:
+            save_image(img, out, encryptor.profile)
+        return output_path
+
+    def extract_all(self, password: str, output_dir: str, names: list = None,
+                    encryptor: ImageEncryption = None, threads: int = 4) -> dict:
+        """
+        Decrypt many members at once, several threads in parallel.
+        Returns {name: saved path, or the error if it failed}.
+        """
+        encryptor = encryptor or ImageEncryption(verbose=False)
+
+        def one(name):
+            try:
+                return self.extract(name, password, self.output_name(name, output_dir, encryptor.profile),
+                                    encryptor)
+            except (OSError, ValueError) as e:
+                return e
+
+        names = self.names() if names is None else names
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            return dict(zip(names, pool.map(one, names)))
+
+    # ========== ADDING MEMBERS ==========
+
+    def add_bytes(self, name: str, data: bytes, details: dict = None):
+        """Add already-encrypted bytes as a member. A member with the same name is replaced."""
+        if self.mode != "a":
+            raise ValueError("Open the archive with mode 'a' to add members")
+        with self._lock:
+            self.f.seek(self.end)
+            self.f.write(data)
+            self.members[name] = dict(details or {}, offset=self.end, length=len(data))
+            self.end += len(data)
+            self._dirty = True
+
+    def add_encrypted(self, path: str, name: str = None, details: dict = None):
+        """Add an existing _encrypted.png file as it is (no password needed)."""
+        with open(path, 'rb') as f:
+            self.add_bytes(name or _member_name(path), f.read(), details)
+
+    def add_image(self, path: str, password: str, name: str = None,
+                  encryptor: ImageEncryption = None):
+        """Encrypt an image file straight into the archive."""
+        self.add_bytes(name or _member_name(path), *_encrypt_member(path, password, encryptor))
+
+    def add_images(self, paths: list, password: str, encryptor: ImageEncryption = None,
+                   threads: int = 4) -> dict:
+        """
+        Encrypt many images into the archive. Several threads encode at
+        once; the members are written in order, one batch at a time.
+        Returns {path: error} for the images that failed.
+        """
+        encryptor = encryptor or ImageEncryption(verbose=False)
+        failed = {}
+
+        def one(path):
+            try:
+                return _encrypt_member(path, password, encryptor)
+            except (OSError, ValueError) as e:
+                return e
+
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            for start in range(0, len(paths), _BATCH):
+                batch = paths[start:start + _BATCH]
+                for path, result in zip(batch, pool.map(one, batch)):
+                    if isinstance(result, Exception):
+                        failed[path] = result
+                    else:
+                        self.add_bytes(_member_name(path), *result)
+        return failed
+
+    def _write_index(self):
+        """Write the index and footer after the last member, then sync them to disk."""
+        index = json.dumps({"members": self.members}, sort_keys=True).encode()
+        self.f.seek(self.end)
+        self.f.write(index + _FOOTER.pack(_FOOTER_MAGIC, self.end, len(index)))
+        self.f.truncate()
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.end += len(index) + _FOOTER.size
+        self._dirty = False
+
+    def close(self):
+        """Finish: in mode "a", this is when the new index is written."""
+        if self.f.closed:
+            return
+        try:
+            if self._dirty:
+                with self._lock:
+                    self._write_index()
+        finally:
+            self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _member_name(path: str) -> str:
+    """Members are named by their path, always with "/"."""
+    return os.path.normpath(path).replace(os.sep, "/").lstrip("/")
+
+
+def _encrypt_member(path: str, password: str, encryptor: ImageEncryption = None) -> tuple:
+    """
+    Encrypt one image in memory, like encrypt_image() would.
+    Returns (encrypted bytes, details for the index).
+    """
+    encryptor = encryptor or ImageEncryption(verbose=False)
+    key = make_key(password)
+    with Image.open(path) as img:
+        details = {"format": img.format, "size": list(img.size), "mode": img.mode,
+                   "frames": getattr(img, "n_frames", 1), "source_bytes": os.path.getsize(path)}
+        if details["frames"] == 1:
+            return xor_bytes(encryptor.encode_payload(img), key), details
+
+    # Frame packs are built by encrypt_image(), which writes a file
+    with tempfile.TemporaryDirectory() as folder:
+        temp = os.path.join(folder, "frames.png")
+        encryptor.encrypt_image(path, password, temp)
+        with open(temp, 'rb') as f:
+            return f.read(), details
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pack many encrypted images into one archive file.")
+    parser.add_argument("command", choices=("pack", "ls", "extract"))
+    parser.add_argument("archive", help="The archive file")
+    parser.add_argument("paths", nargs="*", help="pack: images or folders / extract: member names (default: all)")
+    parser.add_argument("-p", "--password", help="Password (or set IMAGE_ENCRYPTION_PASSWORD)")
+    parser.add_argument("-o", "--output-dir", default=".", help="Where extract saves the images")
+    parser.add_argument("--encrypted", action="store_true",
+                        help="pack: the files are already encrypted, add them as they are")
+    parser.add_argument("--profile", choices=list(ENCODING_PROFILES), default=DEFAULT_PROFILE)
+    parser.add_argument("--compress", choices=("zlib", "lzma"), help="Compress before encrypting")
+    parser.add_argument("--threads", type=int, default=4, help="Images handled at once")
+    args = parser.parse_args(argv)
+
+    encryptor = ImageEncryption(verbose=False, profile=args.profile, compression=args.compress)
+    try:
+        if args.command == "ls":
+            with PackArchive(args.archive) as archive:
+                for name in archive.names():
+                    entry = archive.members[name]
+                    size = "x".join(map(str, entry["size"])) if "size" in entry else "?"
+                    print(f"{entry['length']:>12,}  {size:>11}  {entry.get('mode', '?'):5}  {name}")
+            return 0
+
+        if args.command == "pack":
+            if args.encrypted:
+                paths, failed = expand_inputs(args.paths, [".png"]), {}
+                with PackArchive(args.archive, "a") as archive:
+                    for path in paths:
+                        archive.add_encrypted(path)
+            else:
+                paths = expand_inputs(args.paths, encryptor.supported_formats)
+                with PackArchive(args.archive, "a") as archive:
+                    failed = archive.add_images(paths, read_password(args.password), encryptor, args.threads)
+            for path, error in failed.items():
+                print(f"❌ {path}: {error}", file=sys.stderr)
+            print(f"📦 Packed {len(paths) - len(failed)} images into {args.archive}")
+            return 1 if failed else 0
+
+        with PackArchive(args.archive) as archive:
+            results = archive.extract_all(read_password(args.password), args.output_dir,
+                                          args.paths or None, encryptor, args.threads)
+        failed = {name: result for name, result in results.items() if isinstance(result, Exception)}
+        for name, error in failed.items():
+            print(f"❌ {name}: {error}", file=sys.stderr)
+        print(f"✅ Extracted {len(results) - len(failed)} images to {args.output_dir}")
+        return 1 if failed else 0
+    except (OSError, ValueError) as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
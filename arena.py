@@ -0,0 +1,160 @@
+"""
+===============================================
+BUFFER ARENA - REUSE MEMORY INSTEAD OF ASKING FOR MORE
+===============================================
+
+Reading a file with f.read() asks the computer for a brand new block of
+memory every time, and hands it back when we're done. For one file
+that's nothing. For a million files in a batch run, all that asking and
+handing back keeps the memory allocator busy, and the program's memory
+use creeps up as the free space gets chopped into odd-sized pieces.
+
+An ARENA keeps the buffers instead of throwing them away:
+- borrow(n) gives you a buffer that holds n bytes (an old one if possible)
+- give_back(buffer) puts it back on the shelf for the next file
+
+SIZE CLASSES: the shelf has one pile per size - 64 KB, 128 KB, 256 KB...
+(each double the last). A 100 KB file gets a 128 KB buffer, so buffers
+fit many different files and get reused a lot.
+
+stats() tells you how often a buffer was reused, and the "high-water
+mark": the most memory that was ever borrowed at the same time.
+"""
+
+import io
+import threading
+
+
+SMALLEST_CLASS = 64 * 1024
+LARGEST_CLASS = 64 * 1024 * 1024   # Bigger buffers are made just for one use
+DEFAULT_MAX_CACHED = 256 * 1024 * 1024  # Never keep more than this on the shelf
+
+
+def size_class(nbytes: int) -> int:
+    """The buffer size used for nbytes: the next power of two, at least SMALLEST_CLASS."""
+    size = SMALLEST_CLASS
+    while size < nbytes:
+        size *= 2
+    return size
+
+
+class BufferArena:
+    """
+    A shelf of reusable bytearrays, sorted by size class.
+    Safe to share between threads.
+    """
+
+    def __init__(self, max_cached: int = DEFAULT_MAX_CACHED):
+        """
+        Parameters:
+        - max_cached: Most bytes of free buffers to keep around
+        """
+        self.max_cached = max_cached
+        self._free = {}  # size class -> list of free bytearrays
+        self._lock = threading.Lock()
+        self._stats = {"borrowed": 0, "reused": 0, "allocated": 0, "in_use_bytes": 0,
+                       "high_water_bytes": 0, "cached_bytes": 0}
+
+    def borrow(self, nbytes: int) -> memoryview:
+        """
+        Get a buffer for nbytes. It is a memoryview exactly nbytes long;
+        pass it (or any slice of it) to give_back() when you're done.
+        The old contents are NOT cleared - write before you read!
+        """
+        size = size_class(nbytes) if nbytes <= LARGEST_CLASS else nbytes
+        with self._lock:
+            pile = self._free.get(size)
+            buffer = pile.pop() if pile else None
+            stats = self._stats
+            stats["borrowed"] += 1
+            if buffer is not None:
+                stats["reused"] += 1
+                stats["cached_bytes"] -= size
+            stats["in_use_bytes"] += size
+            stats["high_water_bytes"] = max(stats["high_water_bytes"], stats["in_use_bytes"])
+        if buffer is None:
+            buffer = bytearray(size)
+            with self._lock:
+                self._stats["allocated"] += 1
+        return memoryview(buffer)[:nbytes]
+
+    def give_back(self, view):
+        """Put a borrowed buffer back on the shelf (or let it go if the shelf is full)."""
+        buffer = view.obj if isinstance(view, memoryview) else view
+        size = len(buffer)
+        with self._lock:
+            self._stats["in_use_bytes"] -= size
+            if size <= LARGEST_CLASS and self._stats["cached_bytes"] + size <= self.max_cached:
+                self._free.setdefault(size, []).append(buffer)
+                self._stats["cached_bytes"] += size
+
+    def read_file(self, path: str, hints=None) -> memoryview:
+        """
+        Read a whole file into a borrowed buffer. give_back() the result when done.
+        hints: an iohints.IOHints for the page cache (optional)
+        """
+        with open(path, 'rb', buffering=0) as f:
+            if hints is not None:
+                hints.reading(f)
+            size = f.seek(0, 2)
+            f.seek(0)
+            view = self.borrow(size)
+            got = 0
+            while got < size:
+                count = f.readinto(view[got:])
+                if not count:
+                    break
+                got += count
+            if hints is not None:
+                hints.done_reading(f)
+        return view[:got]
+
+    def stats(self) -> dict:
+        """borrowed, reused, allocated, in_use_bytes, high_water_bytes, cached_bytes"""
+        with self._lock:
+            return dict(self._stats)
+
+    def clear(self):
+        """Let go of every free buffer."""
+        with self._lock:
+            self._free.clear()
+            self._stats["cached_bytes"] = 0
+
+
+class ViewFile(io.RawIOBase):
+    """
+    A read-only "file" over a buffer, so PIL can read a borrowed buffer
+    directly (io.BytesIO would copy it first).
+    """
+
+    def __init__(self, view):
+        self.view = memoryview(view)
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer) -> int:
+        count = max(0, min(len(buffer), len(self.view) - self.position))
+        buffer[:count] = self.view[self.position:self.position + count]
+        self.position += count
+        return count
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        base = {0: 0, 1: self.position, 2: len(self.view)}[whence]
+        self.position = max(0, base + offset)
+        return self.position
+
+    def tell(self) -> int:
+        return self.position
+
+    def close(self):
+        self.view.release()  # Shared memory can't be closed while a view of it is still out
+        super().close()
+
+
+# One arena shared by everything in this process
+DEFAULT_ARENA = BufferArena()
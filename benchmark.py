@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+===============================================
+BENCHMARK - SPEED VS. SIZE FOR EACH ENCODING PROFILE
+===============================================
+
+Before an image is encrypted it is turned into bytes using an
+"encoding profile" (see ENCODING_PROFILES in image_encryption.py).
+Squeezing the bytes smaller costs CPU time - this script shows you
+exactly how much, on YOUR images:
+
+    python3 benchmark.py                      # the sample images
+    python3 benchmark.py photo.jpg scan.tiff  # your own images
+
+For every profile it reports:
+- encode ms: CPU time to turn the image into bytes
+- decode ms: CPU time to turn the bytes back into an image
+- bytes:     how big the encoded image is (= how much gets encrypted
+             and written to disk)
+"""
+
+import argparse
+import os
+import sys
+import time
+
+from PIL import Image
+
+from image_encryption import ENCODING_PROFILES, encode_image, open_payload, png_compatible
+
+
+# Images used when none are given on the command line
+SAMPLE_IMAGES = ("sample_image_1.png", "sample_logo.png", "note.jpg")
+
+
+def cpu_time(function, repeat: int = 3) -> float:
+    """
+    Run function() a few times and return the FASTEST CPU time in seconds.
+    CPU time only counts work done by this program, so other programs
+    running at the same time don't spoil the result.
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.process_time()
+        function()
+        spent = time.process_time() - start
+        best = spent if best is None else min(best, spent)
+    return best
+
+
+def benchmark_image(path: str, repeat: int = 3) -> list:
+    """Measure every profile on one image. Returns one dict per profile."""
+    with Image.open(path) as img:
+        img = png_compatible(img)
+        img.load()
+
+    rows = []
+    for profile in ENCODING_PROFILES:
+        data = encode_image(img, profile)
+        encode = cpu_time(lambda: encode_image(img, profile), repeat)
+        # open_payload() also knows the "raw" profile's bytes (they aren't an image file)
+        decode = cpu_time(lambda: open_payload(data).load(), repeat)
+        rows.append({"image": os.path.basename(path), "profile": profile, "bytes": len(data),
+                     "encode_ms": encode * 1000, "decode_ms": decode * 1000})
+    return rows
+
+
+def print_table(rows: list):
+    print(f"{'image':24} {'profile':10} {'encode ms':>10} {'decode ms':>10} {'bytes':>12}")
+    print("-" * 70)
+    for row in rows:
+        print(f"{row['image'][:24]:24} {row['profile']:10} {row['encode_ms']:>10.1f} "
+              f"{row['decode_ms']:>10.1f} {row['bytes']:>12,}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare encoding profiles on your images.")
+    parser.add_argument("images", nargs="*", help="Images to test (default: the samples)")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per measurement")
+    args = parser.parse_args(argv)
+
+    images = args.images or [path for path in SAMPLE_IMAGES if os.path.exists(path)]
+    if not images:
+        parser.error("No images to test - pass some on the command line")
+
+    rows = []
+    for path in images:
+        print(f"⏱️  Benchmarking {path}...")
+        rows.extend(benchmark_image(path, args.repeat))
+
+    print()
+    print_table(rows)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
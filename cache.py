@@ -0,0 +1,257 @@
+"""
+===============================================
+DECRYPT CACHE - HOT IMAGES COME STRAIGHT FROM MEMORY
+===============================================
+
+A viewer asks for the same few popular images again and again. Without
+a cache, every request reads the file, XORs it and decodes it all over
+again - for exactly the same result.
+
+A CACHE keeps recent results in memory:
+- The KEY says exactly which result it is: (path, modification time,
+  file size, key fingerprint). If the file changes, its time or size
+  changes too, so we never hand out an old picture. A different
+  password gives a different key, so nobody gets a picture decrypted
+  with someone else's password.
+- The MEMORY BUDGET (e.g. 256 MB) caps how much is kept. When it's full,
+  the LEAST RECENTLY USED result is thrown out ("LRU"): pictures nobody
+  asked for in a while make room for the ones people want now.
+- An optional DISK TIER keeps more results in a folder - put it on a
+  tmpfs like /dev/shm (RAM that looks like a folder) so it's still fast.
+  Results thrown out of memory are still found there.
+
+⚠️ The cache holds DECRYPTED pictures. The disk tier's folder is only
+readable by you, but anything in it is no longer secret - use a tmpfs,
+so it disappears when the computer turns off.
+
+stats() shows hits and misses, and metrics.py counts every lookup.
+
+    cache = DecryptCache(max_bytes=256 * 1024 * 1024, disk_dir="/dev/shm/image-cache")
+    data = cache.decrypted_bytes("photo_encrypted.png", "secret")  # PNG bytes, ready to send
+"""
+
+import collections  # OrderedDict remembers the order things were used in
+import hashlib
+import io
+import os
+import tempfile
+import threading
+
+from PIL import Image
+
+import metrics
+from image_encryption import (FRAMES_MAGIC, ImageEncryption, key_fingerprint, make_key, open_payload,
+                              save_image, xor_bytes)
+
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_DISK_MAX_BYTES = 1024 * 1024 * 1024
+
+
+class LRUCache:
+    """
+    Keeps values in memory up to a total size, throwing out the least
+    recently used ones first. Safe to share between threads.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES, name: str = "memory"):
+        """
+        Parameters:
+        - max_bytes: The memory budget
+        - name: The "cache" label in metrics.py
+        """
+        self.max_bytes = max_bytes
+        self.name = name
+        self._entries = collections.OrderedDict()  # key -> (value, size), oldest first
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "bytes": 0}
+
+    def get(self, key):
+        """The value for key, or None. A hit moves it to the "recently used" end."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+            else:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+        metrics.CACHE_LOOKUPS.inc(cache=self.name, result="miss" if entry is None else "hit")
+        return None if entry is None else entry[0]
+
+    def put(self, key, value, size: int):
+        """Keep a value (size = how many bytes it takes). Too-big values aren't kept."""
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._stats["bytes"] -= old[1]
+            self._entries[key] = (value, size)
+            self._stats["bytes"] += size
+            # Throw out the oldest entries until we're within budget again
+            while self._stats["bytes"] > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._stats["bytes"] -= evicted_size
+                self._stats["evictions"] += 1
+
+    def stats(self) -> dict:
+        """hits, misses, evictions, bytes, entries"""
+        with self._lock:
+            return dict(self._stats, entries=len(self._entries))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._stats["bytes"] = 0
+
+
+class DiskTier:
+    """
+    The same idea as LRUCache, but every value is a file in a folder.
+    Files left over from an earlier run are reused (oldest first to go).
+    """
+
+    def __init__(self, folder: str, max_bytes: int = DEFAULT_DISK_MAX_BYTES, name: str = "disk"):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.name = name
+        os.makedirs(folder, mode=0o700, exist_ok=True)
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "bytes": 0}
+        self._files = collections.OrderedDict()  # file name -> size, oldest first
+        leftovers = [entry for entry in os.scandir(folder) if entry.name.endswith(".bin")]
+        for entry in sorted(leftovers, key=lambda entry: entry.stat().st_mtime):
+            self._files[entry.name] = entry.stat().st_size
+            self._stats["bytes"] += entry.stat().st_size
+
+    @staticmethod
+    def _file_name(key) -> str:
+        return hashlib.sha256(repr(key).encode("utf-8", "surrogateescape")).hexdigest() + ".bin"
+
+    def get(self, key) -> bytes:
+        name = self._file_name(key)
+        data = None
+        with self._lock:
+            known = name in self._files
+        if known:
+            # Read outside the lock, so a big file doesn't hold up everyone else
+            try:
+                with open(os.path.join(self.folder, name), 'rb') as f:
+                    data = f.read()
+            except OSError:
+                pass  # Evicted (or deleted) in the meantime
+        with self._lock:
+            if data is not None and name in self._files:
+                self._files.move_to_end(name)
+            elif known and data is None:
+                self._stats["bytes"] -= self._files.pop(name, 0)
+            self._stats["hits" if data is not None else "misses"] += 1
+        metrics.CACHE_LOOKUPS.inc(cache=self.name, result="miss" if data is None else "hit")
+        return data
+
+    def put(self, key, data: bytes):
+        if len(data) > self.max_bytes:
+            return
+        name = self._file_name(key)
+        path = os.path.join(self.folder, name)
+        # Write to a temp name, then rename: readers never see half a file
+        fd, temp = tempfile.mkstemp(dir=self.folder, suffix=".part")
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(temp, path)
+        with self._lock:
+            self._stats["bytes"] += len(data) - self._files.pop(name, 0)
+            self._files[name] = len(data)
+            while self._stats["bytes"] > self.max_bytes:
+                evicted, size = self._files.popitem(last=False)
+                self._stats["bytes"] -= size
+                self._stats["evictions"] += 1
+                try:
+                    os.remove(os.path.join(self.folder, evicted))
+                except OSError:
+                    pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats, entries=len(self._files))
+
+
+class DecryptCache:
+    """
+    Decrypted images, ready to use, keyed by (path, mtime, size, key fingerprint).
+    Memory first, then the disk tier (if there is one), then real work.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES, disk_dir: str = None,
+                 disk_max_bytes: int = DEFAULT_DISK_MAX_BYTES, encryptor: ImageEncryption = None):
+        """
+        Parameters:
+        - max_bytes: Memory budget
+        - disk_dir: Folder for the disk tier (best on a tmpfs like /dev/shm), or None
+        - disk_max_bytes: Budget for the disk tier
+        - encryptor: Its profile decides the format of the cached images
+        """
+        self.memory = LRUCache(max_bytes)
+        self.disk = DiskTier(disk_dir, disk_max_bytes) if disk_dir else None
+        self.encryptor = encryptor or ImageEncryption(verbose=False)
+
+    def key(self, path: str, password: str) -> tuple:
+        """The cache key for an encrypted file. Raises FileNotFoundError if it's gone."""
+        st = os.stat(path)
+        return (os.path.abspath(path), st.st_mtime_ns, st.st_size, key_fingerprint(make_key(password)))
+
+    def get(self, key) -> bytes:
+        """Cached bytes for key (memory, then disk), or None."""
+        data = self.memory.get(key)
+        if data is None and self.disk is not None:
+            data = self.disk.get(key)
+            if data is not None:
+                self.memory.put(key, data, len(data))  # Popular again - back into memory
+        return data
+
+    def put(self, key, data: bytes):
+        self.memory.put(key, data, len(data))
+        if self.disk is not None:
+            self.disk.put(key, data)
+
+    def decrypted_bytes(self, path: str, password: str) -> bytes:
+        """
+        The decrypted image, saved in the encryptor's profile format (the
+        same bytes decrypt_image() would write to a file).
+        """
+        key = self.key(path, password)
+        data = self.get(key)
+        if data is None:
+            data = self._decrypt(path, password)
+            self.put(key, data)
+        return data
+
+    def open_image(self, path: str, password: str):
+        """The decrypted image as a PIL image (each call gets its own copy)."""
+        return Image.open(io.BytesIO(self.decrypted_bytes(path, password)))
+
+    def _decrypt(self, path: str, password: str) -> bytes:
+        key = make_key(password)
+        with open(path, 'rb') as f:
+            decrypted = xor_bytes(f.read(), key)
+        if decrypted.startswith(FRAMES_MAGIC):
+            # Frame packs are rebuilt by decrypt_image(), which writes a file
+            with tempfile.TemporaryDirectory() as folder:
+                output = self.encryptor.decrypt_image(path, password, os.path.join(folder, "image"))
+                with open(output, 'rb') as f:
+                    return f.read()
+        try:
+            img = open_payload(decrypted, self.encryptor.threads)
+            img.load()
+        except Exception:
+            raise ValueError("❌ Decryption failed! Wrong password or corrupted file.")
+        buffer = io.BytesIO()
+        save_image(img, buffer, self.encryptor.profile)
+        return buffer.getvalue()
+
+    def stats(self) -> dict:
+        """{"memory": {...}, "disk": {...}} with hits, misses, evictions, bytes and entries."""
+        stats = {"memory": self.memory.stats()}
+        if self.disk is not None:
+            stats["disk"] = self.disk.stats()
+        return stats
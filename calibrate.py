@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""
+===============================================
+CALIBRATE - FIND THE FASTEST SETTINGS FOR THIS COMPUTER
+===============================================
+
+A few settings change speed a LOT, and their best values depend on the
+computer - its CPU cache, how many cores it has, how fast its disk is:
+
+- XOR KERNEL: how xor_bytes() does its work. "whole" XORs everything as
+  one giant number, "chunked" goes a piece at a time (and keeps the
+  pieces in the CPU's fast cache), "numpy" uses NumPy if it's installed.
+- STREAM CHUNK: how many bytes encrypt_stream()/decrypt_stream() read,
+  XOR and write at a time. Too small = too many trips to the disk;
+  too big = the data falls out of the CPU cache.
+- WORKERS: how many images to encode at the same time. More than the
+  CPU can really run in parallel just adds waiting.
+
+It also times a test photo saved as each image format, giving the
+"per-format throughput model" that plan.py uses to predict how long a
+batch will take.
+
+Guessing is hard, so this script MEASURES each one here, on this disk,
+and saves the winners as a tuning profile (see tuning.py). After that,
+encrypt/decrypt, pipeline.py and daemon.py use them automatically:
+
+    python3 calibrate.py                 # measure everything (about a minute)
+    python3 calibrate.py --quick         # a rougher, faster measurement
+    python3 calibrate.py --dir /data     # test the disk you'll really use
+    python3 calibrate.py --show          # what's saved right now
+    python3 calibrate.py --reset         # forget it, use the built-in defaults
+"""
+
+import argparse
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from PIL import Image
+
+import image_encryption
+import tuning
+from image_encryption import (DEFAULT_PROFILE, ImageEncryption, available_xor_kernels, make_key, open_payload,
+                              save_image, use_xor_kernel, xor_bytes)
+
+
+XOR_CHUNKS = (64 * 1024, 256 * 1024, 1024 * 1024, 4 * 1024 * 1024)
+STREAM_CHUNKS = (256 * 1024, 1024 * 1024, 4 * 1024 * 1024, 16 * 1024 * 1024)
+GOOD_ENOUGH = 0.95  # Fewer workers win if they're at least this close to the best
+MODEL_FORMATS = ("JPEG", "PNG", "BMP", "TIFF", "GIF", "WEBP")
+
+_worker_image = None
+
+
+def best_seconds(function, repeat: int = 3) -> float:
+    """Run function() a few times and return the FASTEST wall-clock time."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        spent = time.perf_counter() - start
+        best = spent if best is None else min(best, spent)
+    return best
+
+
+def _test_image(size: int = 512):
+    """A noisy RGB photo-like image - noise doesn't compress, like real photos."""
+    return Image.merge("RGB", [Image.effect_noise((size, size), 64 + 32 * band) for band in range(3)])
+
+
+# ========== 1. XOR KERNELS ==========
+
+def measure_xor(size: int, repeat: int = 3) -> dict:
+    """MB/s of xor_bytes() with every kernel (and chunk size) that can run here."""
+    data = os.urandom(size)
+    key = make_key("calibrate")
+    candidates = [("whole", None)] + [("chunked", chunk) for chunk in XOR_CHUNKS if chunk < size]
+    if "numpy" in available_xor_kernels():
+        candidates.append(("numpy", None))
+
+    results = {}
+    try:
+        for kernel, chunk in candidates:
+            use_xor_kernel(kernel, chunk)
+            name = kernel if chunk is None else f"{kernel}:{chunk}"
+            results[name] = size / best_seconds(lambda: xor_bytes(data, key, 7), repeat) / 1e6
+    finally:
+        use_xor_kernel(tuning.setting("xor_kernel", "whole"), tuning.setting("xor_chunk"))
+    return results
+
+
+# ========== 2. STREAM CHUNK SIZE ==========
+
+def measure_stream_chunks(folder: str, size: int, repeat: int = 2) -> dict:
+    """MB/s of encrypt_stream() from one file to another in folder, for each chunk size."""
+    encryptor = ImageEncryption(verbose=False)
+    with tempfile.TemporaryDirectory(dir=folder, prefix=".calibrate-") as temp:
+        source, target = os.path.join(temp, "in.bin"), os.path.join(temp, "out.bin")
+        with open(source, 'wb') as f:
+            f.write(b"\x89PNG\r\n\x1a\n")  # encrypt_stream() wants to see an image's magic bytes
+            f.write(os.urandom(size))
+
+        def run(chunk):
+            with open(source, 'rb') as src, open(target, 'wb') as dst:
+                encryptor.encrypt_stream(src, dst, "calibrate", chunk)
+                os.fsync(dst.fileno())  # Count the time to really reach the disk
+
+        return {chunk: size / best_seconds(lambda: run(chunk), repeat) / 1e6 for chunk in STREAM_CHUNKS}
+
+
+# ========== 3. WORKERS ==========
+
+def _worker_counts() -> list:
+    counts, count = [], 1
+    while count < tuning.usable_cpus():
+        counts.append(count)
+        count *= 2
+    return counts + [tuning.usable_cpus()]
+
+
+def _encrypt_test_image(_=None) -> int:
+    """What a worker does all day: encode an image and XOR it."""
+    return len(xor_bytes(ImageEncryption(verbose=False).encode_payload(_worker_image), make_key("x")))
+
+
+def _init_worker():
+    global _worker_image
+    _worker_image = _test_image()
+
+
+def measure_workers(processes: bool = False, per_worker: int = 4) -> dict:
+    """Images per second with each worker count (threads, or processes)."""
+    results = {}
+    for count in _worker_counts():
+        if processes:
+            pool = ProcessPoolExecutor(count, initializer=_init_worker)
+            list(pool.map(_encrypt_test_image, range(count)))  # Start every process first
+        else:
+            _init_worker()
+            pool = ThreadPoolExecutor(count)
+        with pool:
+            jobs = count * per_worker
+            start = time.perf_counter()
+            list(pool.map(_encrypt_test_image, range(jobs)))
+            results[count] = jobs / (time.perf_counter() - start)
+    return results
+
+
+def _fewest_good_enough(results: dict) -> int:
+    best = max(results.values())
+    return min(count for count, speed in results.items() if speed >= GOOD_ENOUGH * best)
+
+
+# ========== 4. THE PER-FORMAT MODEL ==========
+
+def _photo_like(size: tuple = (1024, 768)):
+    """Smooth shading plus some grain - compresses about like a real photo."""
+    shade = Image.linear_gradient("L").resize(size)
+    return Image.merge("RGB", [Image.blend(shade, Image.effect_noise(size, 24 + 16 * band), 0.5)
+                               for band in range(3)])
+
+
+def model_key(profile: str = DEFAULT_PROFILE, compression: str = None) -> str:
+    """Models are kept per profile (and compression), e.g. "balanced" or "raw+zlib"."""
+    return profile if not compression else f"{profile}+{compression}"
+
+
+def measure_formats(profile: str = DEFAULT_PROFILE, compression: str = None, repeat: int = 2) -> dict:
+    """
+    For each format in MODEL_FORMATS, one thread's seconds per megapixel
+    to encrypt and to decrypt, and the bytes per megapixel of the
+    original and of the encrypted file.
+    """
+    encryptor = ImageEncryption(verbose=False, profile=profile, compression=compression)
+    key = make_key("calibrate")
+    photo = _photo_like()
+    megapixels = photo.width * photo.height / 1e6
+    model = {}
+    for image_format in MODEL_FORMATS:
+        source = io.BytesIO()
+        (photo.convert("P") if image_format == "GIF" else photo).save(source, format=image_format)
+        source = source.getvalue()
+
+        def encrypt():
+            with Image.open(io.BytesIO(source)) as img:
+                return xor_bytes(encryptor.encode_payload(img), key)
+
+        def decrypt():
+            img = open_payload(xor_bytes(encrypted, key), encryptor.threads)
+            save_image(img, io.BytesIO(), profile)
+
+        encrypted = encrypt()
+        model[image_format] = {
+            "encrypt_s_per_mpix": best_seconds(encrypt, repeat) / megapixels,
+            "decrypt_s_per_mpix": best_seconds(decrypt, repeat) / megapixels,
+            "source_bytes_per_mpix": len(source) / megapixels,
+            "bytes_per_mpix": len(encrypted) / megapixels,
+        }
+    return model
+
+
+# ========== PUTTING IT TOGETHER ==========
+
+def calibrate(folder: str = ".", quick: bool = False, save: bool = True, say=print) -> dict:
+    """
+    Measure everything, print the results, and (unless save=False) save
+    the best settings as this computer's tuning profile. Returns the settings.
+    """
+    repeat = 2 if quick else 3
+    measurements = {}
+
+    say(f"⏱️  XOR kernels ({', '.join(available_xor_kernels())})...")
+    xor = measure_xor((8 if quick else 32) * 1024 * 1024, repeat)
+    measurements["xor_mb_s"] = xor
+    winner = max(xor, key=xor.get)
+    kernel, _, chunk = winner.partition(":")
+    settings = {"xor_kernel": kernel}
+    if chunk:
+        settings["xor_chunk"] = int(chunk)
+    for name, speed in xor.items():
+        say(f"   {name:18} {speed:8.0f} MB/s{'   ⭐' if name == winner else ''}")
+
+    say(f"⏱️  Stream chunk sizes (disk: {os.path.abspath(folder)})...")
+    use_xor_kernel(kernel, settings.get("xor_chunk"))  # Measure the rest with the winning kernel
+    stream = measure_stream_chunks(folder, (16 if quick else 64) * 1024 * 1024, repeat)
+    measurements["stream_mb_s"] = {str(chunk): speed for chunk, speed in stream.items()}
+    settings["stream_chunk"] = max(stream, key=stream.get)
+    for chunk, speed in stream.items():
+        say(f"   {chunk // 1024:>8} KB chunks {speed:8.0f} MB/s"
+            f"{'   ⭐' if chunk == settings['stream_chunk'] else ''}")
+
+    say(f"⏱️  Worker threads (up to {tuning.usable_cpus()})...")
+    threads = measure_workers(per_worker=2 if quick else 4)
+    measurements["thread_images_s"] = {str(count): speed for count, speed in threads.items()}
+    settings["codec_threads"] = settings["threads"] = _fewest_good_enough(threads)
+    for count, speed in threads.items():
+        say(f"   {count:>4} threads   {speed:8.1f} images/s{'   ⭐' if count == settings['threads'] else ''}")
+
+    if quick:
+        settings["workers"] = settings["threads"]
+    else:
+        say(f"⏱️  Worker processes (up to {tuning.usable_cpus()})...")
+        processes = measure_workers(processes=True)
+        measurements["process_images_s"] = {str(count): speed for count, speed in processes.items()}
+        settings["workers"] = _fewest_good_enough(processes)
+        for count, speed in processes.items():
+            say(f"   {count:>4} processes {speed:8.1f} images/s"
+                f"{'   ⭐' if count == settings['workers'] else ''}")
+
+    say(f"⏱️  Image formats ({DEFAULT_PROFILE} profile, for plan.py)...")
+    model = measure_formats(repeat=repeat)
+    measurements["models"] = {model_key(): model}
+    for image_format, row in model.items():
+        say(f"   {image_format:6} encrypt {row['encrypt_s_per_mpix'] * 1000:6.1f} ms/Mpixel, "
+            f"decrypt {row['decrypt_s_per_mpix'] * 1000:6.1f} ms/Mpixel")
+
+    if save:
+        path = tuning.save(settings, measurements)
+        say(f"💾 Saved to {path} - encrypt/decrypt will use it from now on")
+    return settings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure and save the fastest settings for this computer.")
+    parser.add_argument("--dir", default=".", help="Folder on the disk to test (default: here)")
+    parser.add_argument("--quick", action="store_true", help="Smaller, faster measurements")
+    parser.add_argument("--no-save", action="store_true", help="Only print the results")
+    parser.add_argument("--show", action="store_true", help="Print the saved profile and exit")
+    parser.add_argument("--reset", action="store_true", help="Delete the saved profile")
+    args = parser.parse_args(argv)
+
+    path = tuning.profile_path()
+    if args.show or args.reset:
+        profile = tuning.read_profile()
+        if profile is None:
+            print(f"No tuning profile at {path} - the built-in defaults are used")
+        elif args.reset:
+            os.remove(path)
+            print(f"🗑️  Removed {path}")
+        else:
+            current = "✅ matches this computer" if profile.get("host") == tuning.host() else \
+                "⚠️  made on a different computer - ignored here"
+            print(f"{path} ({current})")
+            print(json.dumps(profile["settings"], indent=2))
+        return 0
+
+    print(f"🔧 Calibrating on {tuning.usable_cpus()} CPUs (XOR kernel now: "
+          f"{tuning.setting('xor_kernel', 'whole')}, stream chunk: {image_encryption.STREAM_CHUNK // 1024} KB)")
+    try:
+        calibrate(args.dir, args.quick, not args.no_save)
+    except OSError as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+===============================================
+CONTENT-ADDRESSED STORE - EACH PICTURE IS ENCRYPTED ONLY ONCE
+===============================================
+
+Lots of collections hold the same picture many times under different
+names (cat.jpg, cat (1).jpg, backup/cat.jpg...). Encrypting and storing
+every copy wastes time and disk space.
+
+A CONTENT-ADDRESSED store names each encrypted file after its CONTENTS
+instead of its file name:
+1. Hash the picture's bytes -> a long "digest" like 3fa91c...
+2. If objects/3f/a9/3fa91c....enc already exists, we're done!
+   Otherwise encrypt the picture into it.
+3. Write down "cat.jpg -> 3fa91c..." in the names list.
+
+So adding a duplicate costs one hash and one line of text, not a whole
+encryption. Getting a picture back looks up its digest and decrypts
+that object.
+
+WHY objects/3f/a9/...? Millions of files in ONE folder make the file
+system slow. Using the first characters of the digest as sub-folders
+spreads them over 65,536 small folders instead.
+
+The digest is an HMAC: a hash mixed with the encryption key. A plain
+hash would let anyone holding a known picture check whether it's in the
+store just by looking at the file names.
+
+    python3 castore.py vault put photos/*.jpg
+    python3 castore.py vault get photos/cat.jpg -o cat.png
+    python3 castore.py vault ls
+    python3 castore.py vault rm photos/cat.jpg
+    python3 castore.py vault gc          # delete objects no name points to
+
+Several programs may use one store at the same time: put/rm take a
+shared lock on store.lock and gc takes it alone, so gc never deletes
+an object that a put has just found (or is still writing). On systems
+without file locks (Windows), run gc only while nothing else uses the store.
+"""
+
+import argparse
+import contextlib
+import hashlib
+import hmac        # For hashes that are mixed with a secret key
+import json
+import os
+import sys
+import threading
+
+try:
+    import fcntl   # File locks (not on Windows)
+except ImportError:
+    fcntl = None
+
+from client import read_password
+from image_encryption import (DEFAULT_PROFILE, ENCODING_PROFILES, ImageEncryption,
+                              atomic_output, key_fingerprint, make_key)
+
+
+CONFIG_NAME = "store.json"
+NAMES_NAME = "names.jsonl"
+LOCK_NAME = "store.lock"
+OBJECT_SUFFIX = ".enc"
+
+
+class ContentStore:
+    """
+    A folder of encrypted objects named by content, plus a list of names.
+
+    The settings (key, profile, compression) are fixed when the store is
+    created, so that one picture always maps to exactly one object.
+    """
+
+    def __init__(self, root: str, password: str, encryptor: ImageEncryption = None):
+        """
+        Parameters:
+        - root: The store's folder (created if it doesn't exist)
+        - password: Must be the store's password
+        - encryptor: Used for new stores' profile/compression (default: plain ImageEncryption)
+        """
+        self.root = root
+        self.password = password
+        self.key = make_key(password)
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(root, "objects"), exist_ok=True)
+
+        config_path = os.path.join(root, CONFIG_NAME)
+        if os.path.exists(config_path):
+            with open(config_path) as f:
+                self.config = json.load(f)
+            if self.config["key"] != key_fingerprint(self.key):
+                raise ValueError("Wrong password for this store.")
+        else:
+            encryptor = encryptor or ImageEncryption(verbose=False)
+            self.config = {"key": key_fingerprint(self.key), "profile": encryptor.profile,
+                           "compression": encryptor.compression}
+            with atomic_output(config_path) as f:
+                f.write(json.dumps(self.config, indent=1).encode())
+
+        self.encryptor = ImageEncryption(verbose=False, profile=self.config["profile"],
+                                         compression=self.config["compression"])
+        self.names = self._load_names()
+        self._names_file = open(os.path.join(root, NAMES_NAME), 'a')
+
+    # ========== DIGESTS AND OBJECTS ==========
+
+    def digest(self, path: str) -> str:
+        """The picture's content name: HMAC-SHA256 of its bytes with the key."""
+        mac = hmac.new(self.key, digestmod=hashlib.sha256)
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                mac.update(chunk)
+        return mac.hexdigest()
+
+    def object_path(self, digest: str) -> str:
+        """objects/ab/cd/abcd....enc"""
+        return os.path.join(self.root, "objects", digest[:2], digest[2:4], digest + OBJECT_SUFFIX)
+
+    # ========== THE NAMES LIST ==========
+    # names.jsonl only ever grows: {"name": ..., "object": ...} adds or
+    # replaces a name, {"name": ..., "object": null} removes it. The last
+    # line for a name wins. gc() rewrites it without the old lines.
+
+    def _load_names(self) -> dict:
+        names = {}
+        path = os.path.join(self.root, NAMES_NAME)
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # A line cut short by a crash
+                    if entry["object"] is None:
+                        names.pop(entry["name"], None)
+                    else:
+                        names[entry["name"]] = entry["object"]
+        return names
+
+    def _log(self, name: str, digest: str):
+        """Call with the store lock held (shared is enough)."""
+        with self._lock:
+            path = os.path.join(self.root, NAMES_NAME)
+            if os.fstat(self._names_file.fileno()).st_ino != os.stat(path).st_ino:
+                # Another program's gc() rewrote the list - append to the new one
+                self._names_file.close()
+                self._names_file = open(path, 'a')
+            self._names_file.write(json.dumps({"name": name, "object": digest}) + "\n")
+            self._names_file.flush()
+            if digest is None:
+                self.names.pop(name, None)
+            else:
+                self.names[name] = digest
+
+    @contextlib.contextmanager
+    def _store_lock(self, alone: bool = False):
+        """
+        Hold store.lock: shared for put/rm (many at once), alone for gc.
+        It works between threads as well as programs - each call opens the file anew.
+        """
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.root, LOCK_NAME), 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX if alone else fcntl.LOCK_SH)
+            yield  # Closing the file lets go of the lock
+
+    # ========== WHAT YOU CAN DO WITH A STORE ==========
+
+    def put(self, path: str, name: str = None) -> tuple:
+        """
+        Add a picture under a name (default: its path).
+        Returns (digest, True if it was new content / False if it was a duplicate).
+        """
+        digest = self.digest(path)
+        target = self.object_path(digest)
+        # Between finding the object and naming it, gc() must not delete it
+        with self._store_lock():
+            is_new = not os.path.exists(target)
+            if is_new:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                self.encryptor.encrypt_image(path, self.password, target)
+            self._log(name or path, digest)
+        return digest, is_new
+
+    def get(self, name: str, output_path: str = None, frame: int = None) -> str:
+        """Decrypt the picture stored under a name. Returns where it was saved."""
+        if name not in self.names:
+            raise FileNotFoundError(f"No picture named {name} in {self.root}")
+        source = self.object_path(self.names[name])
+        if output_path is None:
+            # No extension: decrypt_image() adds the right one - animations and
+            # multi-page images come back in their own format (.gif, .tiff...)
+            output_path = os.path.splitext(os.path.basename(name))[0]
+        return self.encryptor.decrypt_image(source, self.password, output_path, frame)
+
+    def remove(self, name: str):
+        """Forget a name. Its object stays until gc() (other names may share it)."""
+        if name not in self.names:
+            raise FileNotFoundError(f"No picture named {name} in {self.root}")
+        with self._store_lock():
+            self._log(name, None)
+
+    def gc(self) -> int:
+        """
+        Delete objects that no name points to, and squash the names list.
+        Returns how many objects were deleted. Waits until no put/rm is running.
+        """
+        with self._store_lock(alone=True), self._lock:
+            # Other programs may have added names since we read the list
+            self.names = self._load_names()
+            wanted = set(self.names.values())
+            removed = 0
+            for folder, _, files in os.walk(os.path.join(self.root, "objects")):
+                for filename in files:
+                    if filename.endswith(OBJECT_SUFFIX) and filename[:-len(OBJECT_SUFFIX)] not in wanted:
+                        os.remove(os.path.join(folder, filename))
+                        removed += 1
+
+            # Rewrite the names list with just the current names
+            self._names_file.close()
+            with atomic_output(os.path.join(self.root, NAMES_NAME)) as f:
+                for name, digest in sorted(self.names.items()):
+                    f.write((json.dumps({"name": name, "object": digest}) + "\n").encode())
+            self._names_file = open(os.path.join(self.root, NAMES_NAME), 'a')
+        return removed
+
+    def stats(self) -> dict:
+        """How many names, how many distinct objects, and their total size."""
+        objects = set(self.names.values())
+        size = sum(os.path.getsize(self.object_path(digest)) for digest in objects
+                   if os.path.exists(self.object_path(digest)))
+        return {"names": len(self.names), "objects": len(objects), "bytes": size}
+
+    def close(self):
+        self._names_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Store encrypted pictures once per unique content.")
+    parser.add_argument("store", help="The store's folder")
+    parser.add_argument("command", choices=("put", "get", "ls", "rm", "gc", "stats"))
+    parser.add_argument("names", nargs="*", help="Files to put, or names to get/rm")
+    parser.add_argument("-o", "--output", help="Where to save (get, one name only)")
+    parser.add_argument("--as", dest="as_name", help="Store under this name (put, one file only)")
+    parser.add_argument("-p", "--password", help="Password (or set IMAGE_ENCRYPTION_PASSWORD)")
+    parser.add_argument("--profile", choices=list(ENCODING_PROFILES), default=DEFAULT_PROFILE,
+                        help="Encoding profile (only used when creating a store)")
+    parser.add_argument("--compress", choices=("zlib", "lzma"),
+                        help="Compression (only used when creating a store)")
+    args = parser.parse_args(argv)
+
+    if (args.output or args.as_name) and len(args.names) != 1:
+        parser.error("-o / --as work with exactly one name")
+
+    try:
+        encryptor = ImageEncryption(verbose=False, profile=args.profile, compression=args.compress)
+        with ContentStore(args.store, read_password(args.password), encryptor) as store:
+            if args.command == "put":
+                for path in args.names:
+                    digest, is_new = store.put(path, args.as_name)
+                    print(f"{'➕ stored' if is_new else '🔗 duplicate'} {digest[:12]} {args.as_name or path}")
+            elif args.command == "get":
+                for name in args.names:
+                    print(store.get(name, args.output))
+            elif args.command == "rm":
+                for name in args.names:
+                    store.remove(name)
+            elif args.command == "gc":
+                print(f"🧹 Deleted {store.gc()} unused objects")
+            elif args.command == "ls":
+                for name, digest in sorted(store.names.items()):
+                    print(f"{digest[:12]}  {name}")
+            else:
+                stats = store.stats()
+                print(f"{stats['names']} names -> {stats['objects']} objects, {stats['bytes']:,} bytes")
+    except (OSError, ValueError, IndexError) as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""
+===============================================
+CATALOG - SEARCH YOUR ENCRYPTED IMAGES WITHOUT DECRYPTING THEM
+===============================================
+
+"Which encrypted images are wider than 4000 pixels?" Normally the only
+way to find out is to decrypt every single one. With terabytes of
+images, that takes days.
+
+A CATALOG writes down the details of every image as it is encrypted or
+decrypted, in a small SQLite database (a whole database in one file -
+it comes with Python):
+
+    size, color mode, original format, number of frames, file sizes,
+    key fingerprint, content hash, profile, compression, how long it took
+
+Then questions are answered from the database in milliseconds:
+
+    python3 catalog.py images.db find --min-width 4000
+    python3 catalog.py images.db find --key 3fa91c0d22e8b7a4 --mode RGBA
+    python3 catalog.py images.db summary
+    python3 catalog.py images.db sql "SELECT format, COUNT(*) FROM assets GROUP BY format"
+
+To fill it, pass a catalog to ImageEncryption, or --catalog to main.py
+or pipeline.py:
+
+    python3 pipeline.py encrypt photos/ --catalog images.db
+
+The KEY FINGERPRINT is a short id for the key (see key_fingerprint), not
+the key itself - it tells you which images share a password without
+giving the password away. The CONTENT HASH is the SHA256 of the
+original file, so duplicates are easy to spot.
+"""
+
+import argparse
+import json
+import os
+import sqlite3     # A database in a single file, built into Python
+import sys
+import threading
+import time
+
+from client import read_password
+from image_encryption import file_hash, key_fingerprint, make_key
+
+
+# One row per encrypted file. Decrypting it fills in the decrypt_* columns.
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS assets (
+    encrypted_path  TEXT PRIMARY KEY,
+    original_path   TEXT,
+    width           INTEGER,
+    height          INTEGER,
+    mode            TEXT,
+    format          TEXT,
+    frames          INTEGER,
+    original_bytes  INTEGER,
+    payload_bytes   INTEGER,
+    encrypted_bytes INTEGER,
+    key_fingerprint TEXT,
+    content_hash    TEXT,
+    profile         TEXT,
+    compression     TEXT,
+    encrypt_seconds REAL,
+    encrypted_at    REAL,
+    decrypted_path  TEXT,
+    decrypt_seconds REAL,
+    decrypted_at    REAL
+);
+CREATE INDEX IF NOT EXISTS assets_key ON assets (key_fingerprint);
+CREATE INDEX IF NOT EXISTS assets_hash ON assets (content_hash);
+CREATE INDEX IF NOT EXISTS assets_size ON assets (width, height);
+"""
+
+# Writing to disk after every single file would be slow, so changes are
+# saved in batches (and always when the catalog is closed)
+COMMIT_EVERY = 100
+
+
+class Catalog:
+    """
+    A SQLite catalog of encrypted files. Safe to share between threads.
+    Use it in a with-block, or call close() when done.
+    """
+
+    def __init__(self, path: str, hash_contents: bool = True):
+        """
+        Parameters:
+        - path: The database file (created if it doesn't exist)
+        - hash_contents: Store a SHA256 of each original image (reads it once more)
+        """
+        self.path = path
+        self.hash_contents = hash_contents
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        # WAL lets queries run while a batch is still writing
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(_SCHEMA)
+
+    # ========== WRITING DOWN WHAT HAPPENED ==========
+
+    def record(self, stats: dict):
+        """
+        Write down one finished encrypt or decrypt. stats is what
+        ImageEncryption.last_stats holds: op, source, output, size, mode,
+        format, frames, bytes, key, profile, compression, seconds.
+        """
+        if stats["op"] == "encrypt":
+            self._record_encrypt(stats)
+        elif stats["op"] == "decrypt":
+            self._record_decrypt(stats)
+
+    def _record_encrypt(self, stats: dict):
+        source, output = stats["source"], stats["output"]
+        width, height = stats.get("size") or (None, None)
+        row = (os.path.abspath(output), os.path.abspath(source), width, height, stats.get("mode"),
+               stats.get("format"), stats.get("frames"), _size_of(source), stats.get("bytes"),
+               _size_of(output), stats.get("key"),
+               file_hash(source) if self.hash_contents else None,
+               stats.get("profile"), stats.get("compression"), stats.get("seconds"), time.time())
+        # Encrypting again replaces the row: the old decrypt details no longer apply
+        self._write("INSERT OR REPLACE INTO assets (encrypted_path, original_path, width, height, mode, "
+                    "format, frames, original_bytes, payload_bytes, encrypted_bytes, key_fingerprint, "
+                    "content_hash, profile, compression, encrypt_seconds, encrypted_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", row)
+
+    def _record_decrypt(self, stats: dict):
+        encrypted = os.path.abspath(stats["source"])
+        width, height = stats.get("size") or (None, None)
+        with self._lock:
+            updated = self.db.execute(
+                "UPDATE assets SET decrypted_path = ?, decrypt_seconds = ?, decrypted_at = ? "
+                "WHERE encrypted_path = ?",
+                (os.path.abspath(stats["output"]), stats.get("seconds"), time.time(), encrypted)).rowcount
+            if not updated:
+                # Encrypted somewhere else: keep what decrypting told us
+                self.db.execute(
+                    "INSERT INTO assets (encrypted_path, width, height, mode, frames, encrypted_bytes, "
+                    "key_fingerprint, decrypted_path, decrypt_seconds, decrypted_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (encrypted, width, height, stats.get("mode"), stats.get("frames"), _size_of(encrypted),
+                     stats.get("key"), os.path.abspath(stats["output"]), stats.get("seconds"), time.time()))
+            self._saved_soon()
+
+    def _write(self, sql: str, row: tuple):
+        with self._lock:
+            self.db.execute(sql, row)
+            self._saved_soon()
+
+    def _saved_soon(self):
+        """Count a change, and commit once enough have piled up. Call with the lock held."""
+        self._pending += 1
+        if self._pending >= COMMIT_EVERY:
+            self.db.commit()
+            self._pending = 0
+
+    def recorder(self, op: str, password: str, profile: str, compression: str = None):
+        """
+        An on_done callback for pipeline.py, which doesn't go through
+        encrypt_image() / decrypt_image() for most files.
+        """
+        key = key_fingerprint(make_key(password))
+
+        def record(job):
+            if job.error is not None or job.finished:
+                return  # Failed - or encrypt_image()/decrypt_image() recorded it already
+            self.record({"op": op, "source": job.source, "output": job.output, "size": job.size,
+                         "mode": job.mode, "format": job.format, "frames": 1, "bytes": job.nbytes,
+                         "key": key, "profile": profile, "compression": compression,
+                         "seconds": job.seconds})
+        return record
+
+    # ========== ASKING QUESTIONS ==========
+
+    def find(self, min_width: int = None, min_height: int = None, mode: str = None,
+             image_format: str = None, key: str = None, content_hash: str = None,
+             limit: int = None) -> list:
+        """Rows matching every filter given (as dicts)."""
+        filters = [("width >= ?", min_width), ("height >= ?", min_height), ("mode = ?", mode),
+                   ("format = ?", image_format), ("key_fingerprint = ?", key),
+                   ("content_hash = ?", content_hash)]
+        used = [(sql, value) for sql, value in filters if value is not None]
+        where = " AND ".join(sql for sql, _ in used) or "1"
+        query = f"SELECT * FROM assets WHERE {where} ORDER BY encrypted_path"
+        if limit:
+            query += f" LIMIT {int(limit)}"
+        return self.query(query, [value for _, value in used])
+
+    def summary(self) -> list:
+        """Number of files and bytes per key fingerprint and color mode."""
+        return self.query("SELECT key_fingerprint, mode, COUNT(*) AS files, "
+                          "SUM(original_bytes) AS original_bytes, SUM(encrypted_bytes) AS encrypted_bytes "
+                          "FROM assets GROUP BY key_fingerprint, mode ORDER BY files DESC")
+
+    def query(self, sql: str, params=()) -> list:
+        with self._lock:
+            return [dict(row) for row in self.db.execute(sql, params)]
+
+    def close(self):
+        with self._lock:
+            self.db.commit()
+            self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _size_of(path: str):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return None
+
+
+def _print_rows(rows: list, as_json: bool):
+    if as_json:
+        for row in rows:
+            print(json.dumps(row))
+        return
+    if not rows:
+        print("(no matches)")
+        return
+    columns = list(rows[0])
+    widths = [max(len(column), *(len(str(row[column])) for row in rows)) for column in columns]
+    print("  ".join(column.ljust(width) for column, width in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(str(row[column]).ljust(width) for column, width in zip(columns, widths)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Search the catalog of encrypted images.")
+    parser.add_argument("database", help="The catalog file")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    find = commands.add_parser("find", help="List files matching filters")
+    find.add_argument("--min-width", type=int)
+    find.add_argument("--min-height", type=int)
+    find.add_argument("--mode", help="Color mode, e.g. RGB")
+    find.add_argument("--format", dest="image_format", help="Original format, e.g. JPEG")
+    find.add_argument("--key", help="Key fingerprint")
+    find.add_argument("--key-of", action="store_true",
+                      help="Filter by the key of the password (-p or IMAGE_ENCRYPTION_PASSWORD)")
+    find.add_argument("-p", "--password")
+    find.add_argument("--hash", dest="content_hash", help="SHA256 of the original file")
+    find.add_argument("--limit", type=int)
+    find.add_argument("--paths", action="store_true", help="Only print the encrypted file paths")
+
+    commands.add_parser("summary", help="Files and bytes per key and color mode")
+    sql = commands.add_parser("sql", help="Run your own (read-only) SQL query")
+    sql.add_argument("query")
+
+    for command in commands.choices.values():
+        command.add_argument("--json", action="store_true", help="One JSON object per line")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.database):
+        parser.error(f"No catalog at {args.database}")
+    try:
+        with Catalog(args.database) as catalog:
+            if args.command == "find":
+                key = key_fingerprint(make_key(read_password(args.password))) if args.key_of else args.key
+                rows = catalog.find(args.min_width, args.min_height, args.mode, args.image_format,
+                                    key, args.content_hash, args.limit)
+                if args.paths:
+                    for row in rows:
+                        print(row["encrypted_path"])
+                    return 0
+            elif args.command == "summary":
+                rows = catalog.summary()
+            else:
+                # Open a second, read-only connection, so a typo can't change anything
+                db = sqlite3.connect(f"file:{args.database}?mode=ro", uri=True)
+                db.row_factory = sqlite3.Row
+                try:
+                    rows = [dict(row) for row in db.execute(args.query)]
+                finally:
+                    db.close()
+    except sqlite3.Error as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
+    _print_rows(rows, args.json or False)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
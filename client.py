@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+===============================================
+DAEMON CLIENT - SEND JOBS TO THE RUNNING DAEMON
+===============================================
+
+A tiny program that asks daemon.py to do the real work.
+It doesn't import PIL at all, so it starts almost instantly!
+
+HOW TO USE:
+    python3 client.py encrypt photo.jpg
+    python3 client.py decrypt photo_encrypted.png -o photo.png
+    python3 client.py probe photo_encrypted.png
+    python3 client.py ping
+    python3 client.py shutdown
+
+The password is read from --password, the IMAGE_ENCRYPTION_PASSWORD
+environment variable, or typed in (hidden) when neither is given.
+
+A daemon started with --http only accepts jobs that carry its token
+(any program on the computer can connect to a localhost port). The
+client reads it from IMAGE_ENCRYPTION_TOKEN, or from the token file
+the daemon wrote for that port - which only your user can read.
+"""
+
+import argparse
+import getpass     # For typing the password without showing it
+import http.client  # For talking to a daemon started with --http
+import json
+import os
+import socket
+import sys
+import tempfile    # For the temp folder (where the socket lives)
+
+
+# Where the daemon listens by default - one socket per user
+DEFAULT_SOCKET = os.path.join(
+    tempfile.gettempdir(), f"image_encryption-{getpass.getuser()}.sock"
+)
+
+# The jobs a client can ask the daemon for
+OPERATIONS = ("encrypt", "decrypt", "probe")
+
+# Environment variable that can hold the password (handy for scripts)
+PASSWORD_ENV = "IMAGE_ENCRYPTION_PASSWORD"
+
+# Environment variable that can hold an HTTP daemon's token (instead of its token file)
+TOKEN_ENV = "IMAGE_ENCRYPTION_TOKEN"
+
+# Turn the daemon's error "kind" back into the matching Python exception
+_ERRORS = {"FileNotFoundError": FileNotFoundError, "ValueError": ValueError,
+           "IndexError": IndexError}
+
+
+class DaemonClient:
+    """
+    Talks to the daemon over one connection that is kept open,
+    so sending many jobs in a row is cheap.
+    """
+
+    def __init__(self, socket_path: str = DEFAULT_SOCKET, http_port: int = None, token: str = None):
+        """
+        Parameters:
+        - socket_path: The daemon's Unix socket
+        - http_port: Use http://127.0.0.1:<port> instead of the socket
+        - token: The HTTP daemon's token (default: read_token(http_port))
+        """
+        self.socket_path = socket_path
+        self.http_port = http_port
+        self.token = token
+        self._sock = None
+        self._file = None
+        self._http = None
+
+    def request(self, op: str, **fields) -> dict:
+        """
+        Send one request and return the daemon's answer as a dict.
+        Raises the same kind of error the daemon ran into.
+        """
+        message = json.dumps(dict(fields, op=op))
+
+        if self.http_port is not None:
+            response = self._request_http(message)
+        else:
+            response = self._request_socket(message)
+
+        if not response.get("ok"):
+            error = _ERRORS.get(response.get("kind"), RuntimeError)
+            raise error(response.get("error"))
+        return response
+
+    def _request_socket(self, message: str) -> dict:
+        if self._sock is None:
+            self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._sock.connect(self.socket_path)
+            self._file = self._sock.makefile("rwb")
+
+        self._file.write((message + "\n").encode())
+        self._file.flush()
+        line = self._file.readline()
+        if not line:
+            raise ConnectionError("The daemon closed the connection")
+        return json.loads(line)
+
+    def _request_http(self, message: str) -> dict:
+        if self._http is None:
+            if self.token is None:
+                self.token = read_token(self.http_port)
+            self._http = http.client.HTTPConnection("127.0.0.1", self.http_port)
+
+        self._http.request("POST", "/job", body=message,
+                           headers={"Content-Type": "application/json",
+                                    "Authorization": f"Bearer {self.token}"})
+        return json.loads(self._http.getresponse().read())
+
+    # ========== ONE SHORTCUT PER JOB ==========
+    # The daemon opens the files itself, so we always send full paths
+
+    def encrypt(self, path: str, password: str, output: str = None) -> str:
+        """Encrypt an image; returns the encrypted file's path."""
+        return self.request("encrypt", path=os.path.abspath(path), password=password,
+                            output=_absolute(output))["output"]
+
+    def decrypt(self, path: str, password: str, output: str = None, frame: int = None) -> str:
+        """Decrypt an image (or one frame of it); returns the decrypted file's path."""
+        return self.request("decrypt", path=os.path.abspath(path), password=password,
+                            output=_absolute(output), frame=frame)["output"]
+
+    def probe(self, path: str, password: str) -> dict:
+        """Read an encrypted image's format, size, mode and frame count."""
+        return self.request("probe", path=os.path.abspath(path), password=password)
+
+    def ping(self) -> dict:
+        return self.request("ping")
+
+    def shutdown(self):
+        self.request("shutdown")
+
+    def close(self):
+        """Close the connection to the daemon."""
+        if self._file is not None:
+            self._file.close()
+            self._sock.close()
+            self._file = self._sock = None
+        if self._http is not None:
+            self._http.close()
+            self._http = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _absolute(path: str) -> str:
+    """Make a path absolute (the daemon may be running in another folder)."""
+    return os.path.abspath(path) if path else None
+
+
+def token_path(http_port: int) -> str:
+    """Where a daemon serving HTTP on http_port keeps its token (a folder only we can open)."""
+    config = os.environ.get("XDG_CONFIG_HOME") or os.path.join(os.path.expanduser("~"), ".config")
+    return os.path.join(config, "image-encryption", f"daemon-{http_port}.token")
+
+
+def read_token(http_port: int) -> str:
+    """The HTTP daemon's token: from the environment, or from its token file."""
+    if os.environ.get(TOKEN_ENV):
+        return os.environ[TOKEN_ENV]
+    try:
+        with open(token_path(http_port)) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        raise ConnectionError(f"No token for port {http_port} - is the daemon running "
+                              f"(as this user)? Or set {TOKEN_ENV}") from None
+
+
+def read_password(given: str = None) -> str:
+    """
+    Get the password from (in order): the command line, the environment,
+    or by asking the user to type it (it won't be shown on screen).
+    """
+    if given:
+        return given
+    if os.environ.get(PASSWORD_ENV):
+        return os.environ[PASSWORD_ENV]
+    return getpass.getpass("Enter password: ")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Send a job to the image encryption daemon.")
+    parser.add_argument("op", choices=OPERATIONS + ("ping", "shutdown"))
+    parser.add_argument("path", nargs="?", help="Image to work on")
+    parser.add_argument("-o", "--output", help="Where to save the result")
+    parser.add_argument("-p", "--password", help=f"Password (or set {PASSWORD_ENV})")
+    parser.add_argument("--frame", type=int, help="Decrypt only this frame (0 = first)")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET, help="Daemon's Unix socket")
+    parser.add_argument("--http", type=int, metavar="PORT", help="Daemon's localhost HTTP port")
+    args = parser.parse_args(argv)
+
+    if args.op in OPERATIONS and not args.path:
+        parser.error(f"{args.op} needs a path")
+
+    try:
+        with DaemonClient(args.socket, args.http) as client:
+            if args.op == "ping":
+                print(f"✅ Daemon is up ({client.ping()['workers']} workers)")
+            elif args.op == "shutdown":
+                client.shutdown()
+                print("👋 Daemon is shutting down")
+            elif args.op == "probe":
+                info = client.probe(args.path, read_password(args.password))
+                print(f"{info['format']} {info['size'][0]}x{info['size'][1]} {info['mode']} "
+                      f"({info['frames']} frame(s))")
+            elif args.op == "decrypt":
+                print(client.decrypt(args.path, read_password(args.password), args.output, args.frame))
+            else:
+                print(client.encrypt(args.path, read_password(args.password), args.output))
+    except (OSError, ValueError, IndexError, RuntimeError) as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,207 @@
+"""
+===============================================
+COMPRESSION - MAKE THE DATA SMALLER *BEFORE* ENCRYPTING
+===============================================
+
+Encrypted data looks random, and random data can't be compressed.
+So if we want smaller files, we have to compress FIRST and encrypt after.
+
+This is only worth it for data that isn't compressed already:
+- raw pixels (the "raw" encoding profile)
+- BMP and uncompressed TIFF files (streamed as they are)
+PNG, JPEG, GIF and WebP are already compressed, so image_encryption.py
+skips them (see should_compress there).
+
+SPEED TRICK - BLOCKS:
+The data is cut into blocks (1 MB each by default) and every block is
+compressed on its own, in several threads at once (like the "pigz" tool).
+zlib and lzma let other threads run while they work, so 8 threads can
+really be up to 8x faster.
+
+THE FORMAT:
+    BLOCK_MAGIC | codec (1 byte) | block | block | ... | end marker
+
+Each block starts with two 4-byte numbers: its size before and after
+compression. Those sizes are the "index" - by hopping from size to size
+we find every block without decompressing anything, so decompression
+can run in parallel too. The end marker is a block with both sizes 0.
+"""
+
+import lzma        # Slow but very strong compression
+import os
+import struct      # For packing the block sizes into bytes
+import zlib        # Fast compression (the same one PNG uses)
+from concurrent.futures import ThreadPoolExecutor
+
+
+BLOCK_MAGIC = b"IMGZBLK1"
+DEFAULT_BLOCK_SIZE = 1024 * 1024
+
+# Codec name -> (id byte stored in the data, compress function, decompress function)
+CODECS = {
+    "zlib": (1, lambda data: zlib.compress(data, 6), zlib.decompress),
+    "lzma": (2, lambda data: lzma.compress(data, preset=1), lzma.decompress),
+}
+_CODECS_BY_ID = {codec_id: name for name, (codec_id, _, _) in CODECS.items()}
+
+_BLOCK_HEADER = struct.Struct(">II")  # Size before compression, size after
+
+
+def is_compressed(data: bytes) -> bool:
+    """Was this data made by compress_blocks()?"""
+    return data.startswith(BLOCK_MAGIC)
+
+
+def _threads(threads: int) -> int:
+    return threads or os.cpu_count() or 1
+
+
+def _codec_header(codec: str) -> bytes:
+    if codec not in CODECS:
+        raise ValueError(f"Unknown compression '{codec}'. Use: {list(CODECS)}")
+    return BLOCK_MAGIC + bytes([CODECS[codec][0]])
+
+
+def _frame(raw_length: int, compressed: bytes) -> bytes:
+    """A block = its two sizes, then the compressed bytes."""
+    return _BLOCK_HEADER.pack(raw_length, len(compressed)) + compressed
+
+
+def compress_blocks(data: bytes, codec: str = "zlib", block_size: int = DEFAULT_BLOCK_SIZE,
+                    threads: int = None) -> bytes:
+    """
+    Compress data in independent blocks, several blocks at a time.
+
+    Parameters:
+    - data: The bytes to compress
+    - codec: "zlib" (fast) or "lzma" (smaller, slower)
+    - block_size: Bytes per block
+    - threads: How many blocks to compress at once (default: one per CPU)
+    """
+    header = _codec_header(codec)
+    compress = CODECS[codec][1]
+    view = memoryview(data)
+    blocks = [view[start:start + block_size] for start in range(0, len(data), block_size)]
+
+    with ThreadPoolExecutor(max_workers=_threads(threads)) as pool:
+        # map() keeps the blocks in their original order
+        compressed = list(pool.map(compress, blocks))
+
+    parts = [header]
+    parts.extend(_frame(len(block), packed) for block, packed in zip(blocks, compressed))
+    parts.append(_BLOCK_HEADER.pack(0, 0))
+    return b"".join(parts)
+
+
+def block_index(data: bytes) -> list:
+    """
+    Find every block by hopping over the size headers.
+    Returns a list of (start, compressed length, raw length) - nothing is decompressed.
+    """
+    if not is_compressed(data):
+        raise ValueError("Not block-compressed data")
+    index = []
+    position = len(BLOCK_MAGIC) + 1
+    while True:
+        if position + _BLOCK_HEADER.size > len(data):
+            raise ValueError("Compressed data is cut short")
+        raw_length, length = _BLOCK_HEADER.unpack_from(data, position)
+        position += _BLOCK_HEADER.size
+        if raw_length == 0 and length == 0:
+            return index
+        index.append((position, length, raw_length))
+        position += length
+
+
+def decompress_blocks(data: bytes, threads: int = None) -> bytes:
+    """Undo compress_blocks(), decompressing several blocks at a time."""
+    decompress = _decompressor(data)
+    view = memoryview(data)
+    blocks = [view[start:start + length] for start, length, _ in block_index(data)]
+
+    with ThreadPoolExecutor(max_workers=_threads(threads)) as pool:
+        return b"".join(pool.map(decompress, blocks))
+
+
+def decompress_first_block(data: bytes) -> bytes:
+    """
+    Decompress only the first block - enough to read an image header.
+    `data` only needs to contain the first block, not the whole thing.
+    """
+    decompress = _decompressor(data)
+    start = len(BLOCK_MAGIC) + 1 + _BLOCK_HEADER.size
+    _, length = _BLOCK_HEADER.unpack_from(data, len(BLOCK_MAGIC) + 1)
+    return decompress(data[start:start + length])
+
+
+def first_block_end(data: bytes) -> int:
+    """Where the first block ends (so we know how much to read for a header)."""
+    _, length = _BLOCK_HEADER.unpack_from(data, len(BLOCK_MAGIC) + 1)
+    return len(BLOCK_MAGIC) + 1 + _BLOCK_HEADER.size + length
+
+
+def _decompressor(data: bytes):
+    """Pick the decompress function for this data's codec."""
+    codec = _CODECS_BY_ID.get(data[len(BLOCK_MAGIC)]) if len(data) > len(BLOCK_MAGIC) else None
+    if not is_compressed(data) or codec is None:
+        raise ValueError("Not block-compressed data")
+    decompress = CODECS[codec][2]
+
+    def checked(block):
+        # Report damaged blocks as ValueError, like every other bad-data error
+        try:
+            return decompress(block)
+        except (zlib.error, lzma.LZMAError) as e:
+            raise ValueError(f"Corrupted compressed block: {e}")
+    return checked
+
+
+# ========== STREAMING VERSIONS (for pipes, see encrypt_stream) ==========
+
+def iter_compress(chunks, codec: str = "zlib", threads: int = None):
+    """
+    Compress an iterator of chunks, yielding the compressed output piece by piece.
+    Only a few chunks are in flight at once, so memory stays bounded.
+    """
+    compress = CODECS[codec][1]
+    yield _codec_header(codec)
+
+    workers = _threads(threads)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = []
+        for chunk in chunks:
+            pending.append((len(chunk), pool.submit(compress, chunk)))
+            if len(pending) >= workers * 2:
+                raw_length, future = pending.pop(0)
+                yield _frame(raw_length, future.result())
+        for raw_length, future in pending:
+            yield _frame(raw_length, future.result())
+    yield _BLOCK_HEADER.pack(0, 0)
+
+
+def iter_decompress(reader, threads: int = None):
+    """
+    Read block-compressed data from a file-like reader and yield the
+    decompressed blocks in order, several decompressing at once.
+    """
+    header = reader.read(len(BLOCK_MAGIC) + 1)
+    decompress = _decompressor(header)
+
+    workers = _threads(threads)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = []
+        while True:
+            sizes = reader.read(_BLOCK_HEADER.size)
+            if len(sizes) < _BLOCK_HEADER.size:
+                raise ValueError("Compressed data is cut short")
+            raw_length, length = _BLOCK_HEADER.unpack(sizes)
+            if raw_length == 0 and length == 0:
+                break
+            block = reader.read(length)
+            if len(block) < length:
+                raise ValueError("Compressed data is cut short")
+            pending.append(pool.submit(decompress, block))
+            if len(pending) >= workers * 2:
+                yield pending.pop(0).result()
+        for future in pending:
+            yield future.result()
@@ -0,0 +1,482 @@
+#!/usr/bin/env python3
+"""
+===============================================
+ENCRYPTION DAEMON - A WARM, ALWAYS-READY SERVICE
+===============================================
+
+Every time you run a Python script, the computer has to:
+- Start the Python interpreter
+- Load PIL and all its image plugins
+- Create any helper processes
+
+For ONE image that's fine. For thousands of tiny images, that start-up
+cost is most of the time! A "daemon" is a program that starts once and
+then keeps running in the background, waiting for jobs.
+
+HOW IT WORKS:
+- The daemon starts a pool of worker processes ONCE
+- Each worker loads PIL's plugins up front (they stay "warm")
+- Clients send jobs (encrypt / decrypt / probe) over a Unix socket
+  (or localhost HTTP) as one line of JSON
+- A worker does the job and the daemon sends back one line of JSON
+
+Start it:
+    python3 daemon.py
+    python3 daemon.py --http 8765        # localhost HTTP instead
+
+The daemon reads and writes files as YOUR user, so only your user may
+send it jobs: the Unix socket is created readable by you alone, and
+the HTTP mode wants a secret token with every job. The daemon makes a
+new token at start and saves it where only you can read it (see
+client.token_path()) - client.py picks it up from there.
+
+Then talk to it with client.py:
+    python3 client.py encrypt photo.jpg
+
+Serving the same images over and over? Keep decrypted results in memory
+(and optionally a tmpfs folder) with --cache-mb (see cache.py):
+    python3 daemon.py --cache-mb 512 --cache-dir /dev/shm/image-cache
+"""
+
+import argparse    # For reading command-line options
+import hmac        # For comparing tokens safely
+import json        # Jobs and answers are sent as JSON text
+import os          # For file paths and CPU count
+import secrets     # For making the HTTP token
+import socket      # For checking if an old daemon is still alive
+import socketserver  # Ready-made socket servers
+import sys
+import threading   # For shutting down from inside a request
+import time        # For timing jobs
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from PIL import Image
+
+import metrics
+import tuning
+from admission import MemoryBudget, estimate_memory
+from client import DEFAULT_SOCKET, OPERATIONS, TOKEN_ENV, token_path
+from cache import DecryptCache
+from image_encryption import FRAME_FORMATS, ImageEncryption, atomic_output, decrypted_name, sniff_format
+
+
+# ========== CODE THAT RUNS INSIDE THE WORKER PROCESSES ==========
+
+# Each worker process keeps its own encryptor, created once at start-up
+_worker_encryptor = None
+
+
+def _warm_worker():
+    """
+    Runs once when a worker process starts.
+    Image.init() loads EVERY PIL image plugin now, so no job pays for it later.
+    """
+    global _worker_encryptor
+    Image.init()
+    _worker_encryptor = ImageEncryption(verbose=False)
+
+
+def _ping_worker() -> int:
+    """A tiny job used to make sure every worker process has started."""
+    time.sleep(0.05)  # Keep this worker busy so the next ping starts another
+    return os.getpid()
+
+
+def _run_job(op: str, path: str, password: str, output: str = None, frame: int = None) -> dict:
+    """
+    Do one job inside a worker process and describe the result as a dict.
+    """
+    start = time.perf_counter()
+
+    if op == "encrypt":
+        result = {"output": _worker_encryptor.encrypt_image(path, password, output)}
+    elif op == "decrypt":
+        result = {"output": _worker_encryptor.decrypt_image(path, password, output, frame)}
+    else:
+        info = _worker_encryptor.probe_image(path, password)
+        result = {"format": info["format"], "size": list(info["size"]), "mode": info["mode"],
+                  "frames": info["frames"]}
+
+    result["seconds"] = time.perf_counter() - start
+
+    # Send back the job's details - the metrics live in the main process
+    stats = _worker_encryptor.last_stats
+    result["stats"] = {"mode": stats["mode"], "bytes": stats["bytes"]}
+    return result
+
+
+# ========== THE DAEMON ITSELF ==========
+
+class EncryptionDaemon:
+    """
+    Owns the warm worker pool and turns JSON requests into jobs.
+    The socket and HTTP servers below both hand their requests to handle().
+    """
+
+    def __init__(self, workers: int = None, cache: DecryptCache = None, budget: MemoryBudget = None):
+        """
+        Parameters:
+        - workers: How many worker processes to keep warm (default: the calibrated number, or one per CPU)
+        - cache: Answer repeated decrypts from this cache (optional, see cache.py)
+        - budget: Only start jobs while their estimated memory fits (optional, see admission.py)
+        """
+        self.workers = workers or tuning.setting("workers") or os.cpu_count() or 1
+        self.pool = None
+        self.cache = cache
+        self.budget = budget
+
+        # Jobs sent to the pool that haven't finished yet
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        metrics.WORKERS.set(self.workers)
+
+    def start(self):
+        """Create the worker pool and wait until every worker is warm."""
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_warm_worker)
+
+        # Worker processes are only created when there's work for them,
+        # so we give each one a small job right now
+        pings = [self.pool.submit(_ping_worker) for _ in range(self.workers)]
+        for ping in pings:
+            ping.result()
+
+    def handle(self, request: dict) -> dict:
+        """
+        Run one request and build the answer.
+
+        Every answer has "ok". Failed answers also have "error" (the message)
+        and "kind" (the exception name, e.g. "ValueError" for a wrong password).
+        """
+        op = request.get("op")
+
+        if op == "ping":
+            answer = {"ok": True, "workers": self.workers, "pid": os.getpid()}
+            if self.cache is not None:
+                answer["cache"] = self.cache.stats()
+            if self.budget is not None:
+                answer["memory"] = self.budget.stats()
+            return answer
+
+        if op not in OPERATIONS:
+            return {"ok": False, "error": f"Unknown operation: {op}", "kind": "ValueError"}
+
+        for field in ("path", "password"):
+            if field not in request:
+                return {"ok": False, "error": f"Missing field: {field}", "kind": "ValueError"}
+
+        # The latency we count includes time spent waiting for a free worker
+        start = time.perf_counter()
+
+        cache_key = self._cache_key(request) if op == "decrypt" else None
+        if cache_key is not None:
+            data = self.cache.get(cache_key)
+            if data is not None:
+                return self._from_cache(request, data, start)
+
+        stats = {"mode": "unknown", "bytes": 0}
+        status = "error"
+        reserved = None
+        pool = None
+        self._track(+1)
+        try:
+            if self.budget is not None and op != "probe":
+                # Wait here (in this connection's thread) until the job fits in memory
+                reserved = self._estimate(op, request)
+                self.budget.acquire(reserved)
+            pool = self.pool
+            future = pool.submit(
+                _run_job, op, request["path"], request["password"], request.get("output"),
+                request.get("frame")
+            )
+            result = future.result()
+            stats = result.pop("stats")
+            status = "ok"
+            metrics.WORKER_BUSY_SECONDS.inc(result["seconds"])
+            if cache_key is not None:
+                # The output file holds exactly the bytes a later request wants
+                with open(result["output"], 'rb') as f:
+                    self.cache.put(cache_key, f.read())
+        except BrokenProcessPool:
+            # A worker died (killed for using too much memory, say) - and took the whole
+            # pool with it. Start a new one, or every job after this would fail too
+            self._replace_pool(pool)
+            return {"ok": False, "error": "A worker process died during this job - the workers were restarted",
+                    "kind": "RuntimeError"}
+        except Exception as e:
+            if isinstance(e, ValueError) and op != "encrypt":
+                status = "wrong_password"
+            return {"ok": False, "error": str(e), "kind": type(e).__name__}
+        finally:
+            if reserved is not None:
+                self.budget.release(reserved)
+            self._track(-1)
+            metrics.record_job(op, time.perf_counter() - start, stats["mode"], stats["bytes"], status)
+
+        result["ok"] = True
+        return result
+
+    def _replace_pool(self, broken):
+        """Swap a broken worker pool for a new one (once, however many jobs noticed)."""
+        with self._lock:
+            if broken is None or self.pool is not broken:
+                return  # Another thread replaced it already
+            self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_warm_worker)
+        broken.shutdown(wait=False)
+        print("⚠️  A worker process died - started new workers", file=sys.stderr)
+
+    def _estimate(self, op: str, request: dict) -> int:
+        """The job's estimated peak memory (0 if the file is missing - the worker reports that)."""
+        try:
+            return estimate_memory(request["path"], op, request["password"])
+        except OSError:
+            return 0
+
+    def _cache_key(self, request: dict):
+        """The cache key for a decrypt request, or None if it can't be cached."""
+        if self.cache is None or request.get("frame") is not None:
+            return None  # Single frames are rare - they always go to a worker
+        try:
+            return self.cache.key(request["path"], request["password"])
+        except OSError:
+            return None  # The worker will report the missing file
+
+    def _from_cache(self, request: dict, data: bytes, start: float) -> dict:
+        """Answer a decrypt from the cache: just write the bytes out, no worker needed."""
+        output = request.get("output")
+        if output is None:
+            # The name the worker would have picked (.gif etc. for animations)
+            base = os.path.splitext(decrypted_name(request["path"]))[0]
+            output = base + FRAME_FORMATS.get(sniff_format(data), ".png")
+        try:
+            with atomic_output(output) as f:
+                f.write(data)
+        except OSError as e:
+            metrics.record_job("decrypt", time.perf_counter() - start, status="error")
+            return {"ok": False, "error": str(e), "kind": type(e).__name__}
+        seconds = time.perf_counter() - start
+        metrics.record_job("decrypt", seconds, nbytes=len(data))
+        return {"ok": True, "output": output, "seconds": seconds, "cached": True}
+
+    def _track(self, change: int):
+        """
+        Keep the queue gauges up to date as jobs start (+1) and finish (-1).
+        With N workers, the first N jobs run and the rest wait in the queue.
+        """
+        with self._lock:
+            self._in_flight += change
+            metrics.WORKERS_BUSY.set(min(self._in_flight, self.workers))
+            metrics.QUEUE_DEPTH.set(max(0, self._in_flight - self.workers))
+
+    def close(self):
+        """Stop all the worker processes."""
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+
+def _answer(encryption_daemon: EncryptionDaemon, server, raw: bytes) -> dict:
+    """
+    Decode one raw JSON request, run it and return the answer.
+    Shared by the socket and the HTTP handler.
+    """
+    try:
+        request = json.loads(raw)
+    except ValueError:
+        return {"ok": False, "error": "Request is not valid JSON", "kind": "ValueError"}
+
+    if request.get("op") == "shutdown":
+        # shutdown() waits for the serving loop, so it must run in another thread
+        threading.Thread(target=server.shutdown, daemon=True).start()
+        return {"ok": True}
+
+    return encryption_daemon.handle(request)
+
+
+class _SocketHandler(socketserver.StreamRequestHandler):
+    """
+    Handles one client connection on the Unix socket.
+    A client can send many requests (one JSON per line) on the same connection.
+    """
+
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            response = _answer(self.server.encryption_daemon, self.server, line)
+            self.wfile.write((json.dumps(response) + "\n").encode())
+            self.wfile.flush()
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """A Unix socket server that gives every connection its own thread."""
+    daemon_threads = True
+
+
+class _HttpHandler(BaseHTTPRequestHandler):
+    """
+    The same jobs over localhost HTTP:
+        POST /job   with a JSON body  ->  JSON answer
+        GET /metrics                  ->  metrics in Prometheus text format
+    Jobs need the header "Authorization: Bearer <token>". The metrics
+    don't (they hold no paths or passwords), so scrapers work as before.
+    """
+
+    # Keep connections open between requests (much faster for many jobs)
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        if self.path != "/job":
+            self._send(404, {"ok": False, "error": "Use POST /job", "kind": "ValueError"})
+            return
+        # Any program on this computer can connect, so jobs must prove they know the token
+        given = self.headers.get("Authorization", "")
+        if not hmac.compare_digest(given.encode(), f"Bearer {self.server.token}".encode()):
+            self.close_connection = True  # The body wasn't read
+            self._send(401, {"ok": False, "error": "Missing or wrong token", "kind": "PermissionError"})
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        response = _answer(self.server.encryption_daemon, self.server, self.rfile.read(length))
+        self._send(200, response)
+
+    def do_GET(self):
+        if self.path != "/metrics":
+            self._send(404, {"ok": False, "error": "Use GET /metrics", "kind": "ValueError"})
+            return
+        data = metrics.REGISTRY.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send(self, status: int, body: dict):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        """Don't print a line for every single request."""
+
+
+def _remove_stale_socket(socket_path: str):
+    """
+    A daemon that crashed leaves its socket file behind.
+    Remove it - but only if no daemon is answering on it!
+    """
+    if not os.path.exists(socket_path):
+        return
+
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(socket_path)
+    except OSError:
+        os.remove(socket_path)  # Nobody is listening - it's safe to delete
+        return
+    finally:
+        probe.close()
+
+    raise RuntimeError(f"A daemon is already running on {socket_path}")
+
+
+def _save_token(token: str, path: str):
+    """Write the HTTP token to a file only our user can read (in a folder only we can open)."""
+    os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+    if os.path.exists(path):
+        os.remove(path)  # A new file, so nobody else can be holding it open
+    # The permissions are set as the file is created - there's no moment when others could read it
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "w") as f:
+        f.write(token + "\n")
+
+
+def serve(socket_path: str = DEFAULT_SOCKET, http_port: int = None, workers: int = None,
+          metrics_port: int = None, cache: DecryptCache = None, budget: MemoryBudget = None):
+    """
+    Start the daemon and serve jobs until a client sends "shutdown" (or Ctrl+C).
+
+    Parameters:
+    - socket_path: Unix socket to listen on (ignored when http_port is given)
+    - http_port: Listen on http://127.0.0.1:<port> instead of a Unix socket
+    - workers: Number of warm worker processes
+    - metrics_port: Also serve http://127.0.0.1:<port>/metrics
+    - cache: Answer repeated decrypts from this cache
+    - budget: Only start jobs while their estimated memory fits
+    """
+    encryption_daemon = EncryptionDaemon(workers, cache, budget)
+
+    token_file = None
+    if http_port is not None:
+        # 127.0.0.1 means only programs on THIS computer can connect - the token
+        # makes sure they're run by us (or someone we gave it to)
+        server = ThreadingHTTPServer(("127.0.0.1", http_port), _HttpHandler)
+        server.token = os.environ.get(TOKEN_ENV) or secrets.token_urlsafe(32)
+        token_file = token_path(http_port)
+        _save_token(server.token, token_file)
+        where = f"http://127.0.0.1:{http_port}/job (token in {token_file})"
+    else:
+        _remove_stale_socket(socket_path)
+        # Only our user may send jobs. With this umask the socket is created that
+        # way - a chmod() afterwards would leave a moment when anyone could connect
+        old_umask = os.umask(0o177)
+        try:
+            server = _UnixServer(socket_path, _SocketHandler)
+        finally:
+            os.umask(old_umask)
+        where = socket_path
+
+    server.encryption_daemon = encryption_daemon
+
+    print(f"🔥 Warming up {encryption_daemon.workers} worker(s)...")
+    encryption_daemon.start()
+    print(f"✅ Daemon ready on {where}")
+
+    metrics_server = None
+    if metrics_port is not None:
+        metrics_server = metrics.start_metrics_server(metrics_port)
+        print(f"📈 Metrics on http://127.0.0.1:{metrics_port}/metrics")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if metrics_server is not None:
+            metrics_server.shutdown()
+        encryption_daemon.close()
+        if http_port is None and os.path.exists(socket_path):
+            os.remove(socket_path)
+        if token_file is not None and os.path.exists(token_file):
+            os.remove(token_file)
+        print("👋 Daemon stopped")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the image encryption daemon.")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET, help="Unix socket path")
+    parser.add_argument("--http", type=int, metavar="PORT", help="Serve on localhost HTTP instead")
+    parser.add_argument("--workers", type=int, help="Number of warm worker processes")
+    parser.add_argument("--metrics-port", type=int, metavar="PORT",
+                        help="Serve Prometheus metrics on localhost")
+    parser.add_argument("--cache-mb", type=int, default=0,
+                        help="Keep up to this many MB of decrypted images in memory (0 = off)")
+    parser.add_argument("--cache-dir", help="Also keep them in this folder - use a tmpfs like /dev/shm")
+    parser.add_argument("--cache-disk-mb", type=int, default=1024, help="Size limit for --cache-dir")
+    parser.add_argument("--memory-budget", type=int, metavar="MB",
+                        help="Only start jobs while their estimated memory fits in this many MB")
+    args = parser.parse_args(argv)
+
+    cache = None
+    if args.cache_mb or args.cache_dir:
+        cache = DecryptCache(args.cache_mb * 1024 * 1024, args.cache_dir, args.cache_disk_mb * 1024 * 1024)
+    budget = MemoryBudget(args.memory_budget * 1024 * 1024) if args.memory_budget else None
+    serve(args.socket, args.http, args.workers, args.metrics_port, cache, budget)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+===============================================
+DATASET - FEED ENCRYPTED IMAGES STRAIGHT INTO TRAINING
+===============================================
+
+Machine learning training looks at thousands of images per minute. If
+the images are encrypted, decrypting them one decrypt_image() call at a
+time means the trainer waits on every single file - and decrypt_image()
+writes each picture to disk, which we don't even want.
+
+EncryptedDataset reads a folder, an archive (archive.py) or a catalog
+(catalog.py) of encrypted images and hands you the decrypted pictures,
+in memory only:
+
+    for img in EncryptedDataset("encrypted/", "secret", workers=8, prefetch=32):
+        train_on(img)
+
+- PREFETCH: worker threads (or processes) decrypt and decode the NEXT
+  images while you're busy with this one. prefetch says how many may be
+  ready and waiting - enough to hide a slow file, small enough that
+  memory stays bounded.
+- SHUFFLE BUFFER: training works better when images come in a random
+  order. With shuffle_buffer=1000, we keep 1000 decoded images and hand
+  out a random one each time (the same trick tf.data uses). A bigger
+  buffer = more random, but more memory.
+- as_array=True gives NumPy arrays (height x width x channels) instead
+  of PIL images - NumPy is only needed if you use it.
+
+Animated / multi-page images give their first frame (or pick one with frame=).
+
+Try it from the command line (prints a line per image and the speed):
+
+    python3 dataset.py encrypted/ -p secret --workers 8 --shuffle-buffer 256
+    python3 dataset.py photos.pack -p secret --processes 4
+"""
+
+import argparse
+import collections
+import io
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from PIL import Image
+
+from archive import PACK_MAGIC, PackArchive
+from catalog import Catalog
+from client import read_password
+from image_encryption import FRAMES_MAGIC, ImageEncryption, key_fingerprint, make_key, open_payload, xor_bytes
+
+
+ENCRYPTED_SUFFIXES = ("_encrypted.png", ".enc")
+_SQLITE_MAGIC = b"SQLite format 3\x00"
+
+_archives = {}  # Archives this worker has opened, by path (reused for every member)
+_worker_encryptor = None
+
+
+def _archive(path: str) -> PackArchive:
+    # Threads may race to open the same archive - that's harmless, one of them wins
+    if path not in _archives:
+        _archives[path] = PackArchive(path)
+    return _archives[path]
+
+
+def _init_worker(threads: int):
+    """Runs once when a worker process starts."""
+    global _worker_encryptor
+    Image.init()
+    _worker_encryptor = ImageEncryption(verbose=False, threads=threads)
+
+
+def _load(item: tuple, password: str, frame: int, as_array: bool, encryptor: ImageEncryption = None):
+    """
+    Decrypt and decode one image, all in memory.
+    item is (archive path or None, file path or member name).
+    """
+    encryptor = encryptor or _worker_encryptor
+    container, name = item
+    if container is None:
+        with open(name, 'rb') as f:
+            data = f.read()
+    else:
+        data = _archive(container).read(name)
+
+    key = make_key(password)
+    # Peek first: a frame pack only needs the bytes of the one frame asked for
+    if xor_bytes(data[:len(FRAMES_MAGIC)], key) == FRAMES_MAGIC:
+        img = encryptor.read_frame(io.BytesIO(data), password, frame)
+    elif frame:
+        raise IndexError(f"Frame {frame} doesn't exist ({name} has one frame)")
+    else:
+        try:
+            img = open_payload(xor_bytes(data, key), encryptor.threads)
+            img.load()  # Decode now, in the worker - not later in the trainer
+        except Exception:
+            raise ValueError("Decryption failed! Wrong password or corrupted file.")
+
+    if as_array:
+        import numpy  # Only needed for arrays
+        return numpy.asarray(img)
+    return img
+
+
+def _source_kind(path: str) -> str:
+    """'folder', 'archive' or 'catalog' - decided by looking, not by the file name."""
+    if os.path.isdir(path):
+        return "folder"
+    with open(path, 'rb') as f:
+        head = f.read(len(_SQLITE_MAGIC))
+    if head.startswith(PACK_MAGIC):
+        return "archive"
+    if head == _SQLITE_MAGIC:
+        return "catalog"
+    raise ValueError(f"{path} is not a folder, an archive or a catalog")
+
+
+class EncryptedDataset:
+    """
+    An iterable of decrypted images. Iterate over it as many times as you
+    like (once per training epoch); each time starts fresh.
+    """
+
+    def __init__(self, source: str, password: str, workers: int = 4, processes: bool = False,
+                 prefetch: int = 16, shuffle_buffer: int = 0, seed: int = None, as_array: bool = False,
+                 frame: int = 0, with_names: bool = False, skip_errors: bool = False):
+        """
+        Parameters:
+        - source: A folder (searched recursively), an archive or a catalog,
+                  or a list of encrypted file paths
+        - password: The password the images were encrypted with
+        - workers: How many images are decrypted at the same time
+        - processes: Use worker processes instead of threads (more CPU for
+                     decoding, but every image is copied back to us)
+        - prefetch: How many images may be decrypted ahead of you
+        - shuffle_buffer: Hand out images in random order from a buffer this big (0 = in order)
+        - seed: Makes the shuffled order repeatable
+        - as_array: Give NumPy arrays instead of PIL images
+        - frame: Which frame of animated / multi-page images
+        - with_names: Give (name, image) pairs, e.g. to find labels
+        - skip_errors: Leave out images that fail to decrypt, instead of stopping
+        """
+        if prefetch < 1 or workers < 1:
+            raise ValueError("prefetch and workers must be at least 1")
+        self.source = source
+        self.password = password
+        self.workers = workers
+        self.processes = processes
+        self.prefetch = prefetch
+        self.shuffle_buffer = shuffle_buffer
+        self.seed = seed
+        self.as_array = as_array
+        self.frame = frame
+        self.with_names = with_names
+        self.skip_errors = skip_errors
+        self.errors = []  # (name, error) for every skipped image
+        self.items = self._find_items(source)
+        self._epoch = 0
+
+    def _find_items(self, source) -> list:
+        """Every image as (archive path or None, file path or member name)."""
+        if not isinstance(source, str):
+            return [(None, path) for path in source]
+        kind = _source_kind(source)
+        if kind == "archive":
+            with PackArchive(source) as archive:
+                return [(source, name) for name in archive.names()]
+        if kind == "catalog":
+            with Catalog(source, hash_contents=False) as catalog:
+                # Rows from another password can't be decrypted anyway - skip them
+                rows = catalog.query("SELECT encrypted_path FROM assets WHERE key_fingerprint = ? "
+                                     "OR key_fingerprint IS NULL ORDER BY encrypted_path",
+                                     (key_fingerprint(make_key(self.password)),))
+            return [(None, row["encrypted_path"]) for row in rows]
+        return [(None, path) for path in _scan(source)]
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def _executor(self):
+        if self.processes:
+            return ProcessPoolExecutor(self.workers, initializer=_init_worker, initargs=(None,))
+        return ThreadPoolExecutor(self.workers, thread_name_prefix="dataset")
+
+    def _decoded(self, executor):
+        """Decrypted images in file order, with up to `prefetch` of them in flight."""
+        encryptor = None if self.processes else ImageEncryption(verbose=False)
+        items = iter(self.items)
+        waiting = collections.deque()
+
+        def submit_next():
+            item = next(items, None)
+            if item is not None:
+                waiting.append((item, executor.submit(_load, item, self.password, self.frame,
+                                                      self.as_array, encryptor)))
+
+        for _ in range(self.prefetch):
+            submit_next()
+        while waiting:
+            item, future = waiting.popleft()
+            submit_next()  # Keep the workers busy while this one is used
+            try:
+                yield item[1], future.result()
+            except (OSError, ValueError, IndexError) as e:
+                if not self.skip_errors:
+                    raise
+                self.errors.append((item[1], e))
+
+    def __iter__(self):
+        # A different shuffle every epoch, but the same series for the same seed
+        rng = random.Random(None if self.seed is None else self.seed + self._epoch)
+        self._epoch += 1
+        with self._executor() as executor:
+            results = self._decoded(executor)
+            if self.shuffle_buffer > 1:
+                results = _shuffled(results, self.shuffle_buffer, rng)
+            for name, img in results:
+                yield (name, img) if self.with_names else img
+
+
+def _shuffled(results, size: int, rng: random.Random):
+    """Fill a buffer, then hand out a random entry and put the next one in its place."""
+    buffer = []
+    for result in results:
+        if len(buffer) < size:
+            buffer.append(result)
+            continue
+        pick = rng.randrange(size)
+        yield buffer[pick]
+        buffer[pick] = result
+    rng.shuffle(buffer)
+    yield from buffer
+
+
+def _scan(folder: str) -> list:
+    """Encrypted files anywhere under folder, in a stable order."""
+    found = []
+    for entry in os.scandir(folder):
+        if entry.is_dir(follow_symlinks=False):
+            found.extend(_scan(entry.path))
+        elif entry.is_file() and entry.name.endswith(ENCRYPTED_SUFFIXES):
+            found.append(entry.path)
+    return sorted(found)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Read encrypted images as fast as training needs them.")
+    parser.add_argument("source", help="A folder, an archive or a catalog")
+    parser.add_argument("-p", "--password", help="Password (or set IMAGE_ENCRYPTION_PASSWORD)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4)
+    parser.add_argument("--processes", action="store_true", help="Use worker processes instead of threads")
+    parser.add_argument("--prefetch", type=int, default=32, help="Images decrypted ahead")
+    parser.add_argument("--shuffle-buffer", type=int, default=0, help="Random order from a buffer this big")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--quiet", action="store_true", help="Only print the summary")
+    args = parser.parse_args(argv)
+
+    try:
+        dataset = EncryptedDataset(args.source, read_password(args.password), args.workers, args.processes,
+                                   args.prefetch, args.shuffle_buffer, args.seed, with_names=True,
+                                   skip_errors=True)
+        start = time.perf_counter()
+        pixels = 0
+        for name, img in dataset:
+            pixels += img.width * img.height
+            if not args.quiet:
+                print(f"{name}  {img.width}x{img.height} {img.mode}")
+        elapsed = time.perf_counter() - start
+    except (OSError, ValueError) as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
+    for name, error in dataset.errors:
+        print(f"❌ {name}: {error}", file=sys.stderr)
+    count = len(dataset) - len(dataset.errors)
+    print(f"📊 {count} images in {elapsed:.2f}s = {count / max(elapsed, 1e-9):.1f} images/s "
+          f"({pixels / max(elapsed, 1e-9) / 1e6:.1f} Mpixel/s)")
+    return 1 if dataset.errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
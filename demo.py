@@ -20,41 +20,50 @@ from PIL import Image, ImageDraw
 import os
 
 
-def create_test_image():
+def create_test_image(filename="test_image.png", width=400, height=300, verbose=True):
     """
     Create a simple test image to encrypt.
     We'll make a colorful square with some text!
+    
+    The shapes are drawn for a 400x300 picture and stretched to fit,
+    so loadgen.py can ask for much bigger (or smaller) test images.
     """
-    print("\n" + "="*60)
-    print("STEP 1: Creating a test image")
-    print("="*60)
+    if verbose:
+        print("\n" + "="*60)
+        print("STEP 1: Creating a test image")
+        print("="*60)
     
-    # Create a new image: 400x300 pixels, light blue background
+    # Create a new image (400x300 pixels by default), light blue background
     # RGB means Red-Green-Blue color mode
-    img = Image.new('RGB', (400, 300), color='lightblue')
+    img = Image.new('RGB', (width, height), color='lightblue')
     
     # Create a drawing object so we can draw on the image
     draw = ImageDraw.Draw(img)
     
+    # Scale a point from the 400x300 drawing to the real image size
+    def at(x, y):
+        return (x * width // 400, y * height // 300)
+    line = max(1, 3 * width // 400)  # Outline width grows with the image
+    
     # Draw a red rectangle
     # Format: [x1, y1, x2, y2] where (x1,y1) is top-left, (x2,y2) is bottom-right
-    draw.rectangle([50, 50, 150, 150], fill='red', outline='darkred', width=3)
+    draw.rectangle([at(50, 50), at(150, 150)], fill='red', outline='darkred', width=line)
     
     # Draw a green circle (ellipse)
-    draw.ellipse([200, 50, 300, 150], fill='green', outline='darkgreen', width=3)
+    draw.ellipse([at(200, 50), at(300, 150)], fill='green', outline='darkgreen', width=line)
     
     # Draw a yellow triangle (polygon = many-sided shape)
     # We give it three points to make a triangle
-    triangle_points = [(75, 200), (125, 250), (25, 250)]
-    draw.polygon(triangle_points, fill='yellow', outline='orange', width=3)
+    triangle_points = [at(75, 200), at(125, 250), at(25, 250)]
+    draw.polygon(triangle_points, fill='yellow', outline='orange', width=line)
     
     # Save the image
-    filename = "test_image.png"
     img.save(filename)
     
-    print(f"✅ Created test image: {filename}")
-    print(f"   Size: 400x300 pixels")
-    print(f"   Contains: red square, green circle, yellow triangle")
+    if verbose:
+        print(f"✅ Created test image: {filename}")
+        print(f"   Size: {width}x{height} pixels")
+        print(f"   Contains: red square, green circle, yellow triangle")
     
     return filename
 
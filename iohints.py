@@ -0,0 +1,81 @@
+"""
+===============================================
+PAGE CACHE HINTS - BIG BATCHES THAT DON'T CROWD OUT EVERYONE ELSE
+===============================================
+
+The operating system keeps recently used file data in spare RAM (the
+"page cache"), so reading it again is instant. Normally that's great.
+But when we encrypt a huge archive, every file we read AND every file we
+write lands in the cache, and pushes out the data other programs on the
+same computer were using. They suddenly get slow.
+
+posix_fadvise() lets us give the OS two hints:
+- SEQUENTIAL: "I'll read this file from start to end" - the OS reads
+  ahead further, so big files stream at full disk speed
+- DONTNEED:   "I'm done with this file" - the OS can drop its pages
+  from the cache right away instead of pushing other data out
+
+Written pages can only be dropped once they're safely on disk, so with
+drop_cache on, each output file is synced first. That costs a little
+speed - which is why dropping is off unless you ask for it.
+
+Hints are only hints: on systems without posix_fadvise (Windows, macOS)
+or for things like pipes, they quietly do nothing.
+"""
+
+import os
+
+
+_CAN_ADVISE = hasattr(os, "posix_fadvise")
+
+
+def _advise(f, advice_name: str):
+    """Give one hint about a whole open file. Failures are ignored - it's just a hint."""
+    if not _CAN_ADVISE:
+        return
+    try:
+        os.posix_fadvise(f.fileno(), 0, 0, getattr(os, advice_name))
+    except (OSError, ValueError, AttributeError):
+        pass
+
+
+class IOHints:
+    """
+    How encrypt/decrypt should treat the page cache for one run.
+    Call reading() after opening a file to read, and done_reading() /
+    done_writing() when finished with it.
+    """
+
+    def __init__(self, sequential: bool = True, drop_cache: bool = False):
+        """
+        Parameters:
+        - sequential: Ask for aggressive read-ahead on files we read
+        - drop_cache: Drop each file's pages from the cache when we're done with it
+        """
+        self.sequential = sequential
+        self.drop_cache = drop_cache
+
+    def reading(self, f):
+        if self.sequential:
+            _advise(f, "POSIX_FADV_SEQUENTIAL")
+
+    def done_reading(self, f):
+        if self.drop_cache:
+            _advise(f, "POSIX_FADV_DONTNEED")
+
+    def done_writing(self, f):
+        if self.drop_cache:
+            # Pages still waiting to be written can't be dropped, so write them now
+            f.flush()
+            try:
+                os.fdatasync(f.fileno())
+            except (OSError, AttributeError):
+                return
+            _advise(f, "POSIX_FADV_DONTNEED")
+
+    def __repr__(self):
+        return f"IOHints(sequential={self.sequential}, drop_cache={self.drop_cache})"
+
+
+# Read-ahead on, dropping off: the right choice for normal use
+DEFAULT_HINTS = IOHints()
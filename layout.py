@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+===============================================
+SHARDED LAYOUT - OUTPUT FOLDERS THAT STAY FAST WITH MILLIONS OF FILES
+===============================================
+
+By default photo.jpg is encrypted to photo_encrypted.png right next to
+it. With millions of photos that has two problems:
+- One folder with millions of files is slow to list and to add to
+- photo.jpg and photo.png BOTH become photo_encrypted.png - one of them
+  overwrites the other!
+
+A SHARDED layout puts every encrypted file under a target folder instead,
+in sub-folders picked by a hash of the original file's full path:
+
+    /photos/2019/photo.jpg  ->  encrypted/5e/a1/photo-5ea1c09b77e24f1d83a0_encrypted.png
+    /photos/2019/photo.png  ->  encrypted/0c/37/photo-0c37d4e1b9a25f6e0142_encrypted.png
+
+- The hash is different for every path, so names never collide, and
+  batch workers running at the same time can never write the same file
+- 2 levels of 256 sub-folders = 65,536 folders, so each one stays small
+- The name still starts with "photo", so you can tell what it is
+
+REVERSE LOOKUP: a hash can't be turned back into a path, so every file
+we place is also written to an index (.layout_index.jsonl in the target
+folder). Ask it which original an encrypted file came from:
+
+    python3 pipeline.py encrypt /photos --output-dir encrypted/ --shard
+    python3 layout.py encrypted/ where /photos/2019/photo.jpg
+    python3 layout.py encrypted/ lookup encrypted/5e/a1/photo-5ea1c09b77e24f1d83a0_encrypted.png
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import threading
+
+
+INDEX_NAME = ".layout_index.jsonl"
+HASH_CHARS = 20  # 80 bits: no two paths will ever share a name in practice
+
+
+class ShardedLayout:
+    """Where encrypted files go under a target folder, and where they came from."""
+
+    def __init__(self, root: str, levels: int = 2):
+        """
+        Parameters:
+        - root: The target folder
+        - levels: How many levels of sub-folders (each level = 256 folders)
+        """
+        self.root = root
+        self.levels = levels
+        self._lock = threading.Lock()
+        self._index = None  # encrypted path (relative to root) -> original, loaded when needed
+
+    def digest(self, source: str) -> str:
+        """Hash of the original's full path (not its contents - we don't want to read it)."""
+        path = os.path.abspath(source).encode("utf-8", "surrogateescape")
+        return hashlib.sha256(path).hexdigest()[:HASH_CHARS]
+
+    def path_for(self, source: str, create: bool = True) -> str:
+        """The encrypted file's path for an original (its folders are created, unless create=False)."""
+        digest = self.digest(source)
+        stem = os.path.splitext(os.path.basename(source))[0]
+        folder = os.path.join(self.root, *(digest[2 * level:2 * level + 2] for level in range(self.levels)))
+        if create:
+            os.makedirs(folder, exist_ok=True)
+        return os.path.join(folder, f"{stem}-{digest}_encrypted.png")
+
+    # ========== THE REVERSE LOOKUP INDEX ==========
+
+    def remember(self, source: str, output: str):
+        """
+        Add one line to the index. The line goes to disk in a single
+        O_APPEND write, so several processes can add lines at once.
+        """
+        relative = os.path.relpath(output, self.root).replace(os.sep, "/")
+        line = (json.dumps({"output": relative, "source": os.path.abspath(source)}) + "\n").encode()
+        fd = os.open(os.path.join(self.root, INDEX_NAME), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+        with self._lock:
+            if self._index is not None:
+                self._index[relative] = os.path.abspath(source)
+
+    def recorder(self):
+        """An on_done callback for pipeline.py: remember every file that worked."""
+        def record(job):
+            if job.error is None:
+                self.remember(job.source, job.output)
+        return record
+
+    def _load(self) -> dict:
+        index = {}
+        path = os.path.join(self.root, INDEX_NAME)
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # A line cut short by a crash
+                    index[entry["output"]] = entry["source"]
+        return index
+
+    def lookup(self, output: str) -> str:
+        """The original path an encrypted file came from, or None if we don't know it."""
+        with self._lock:
+            if self._index is None:
+                self._index = self._load()
+            relative = os.path.relpath(output, self.root).replace(os.sep, "/")
+            return self._index.get(relative)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Find files in a sharded output folder.")
+    parser.add_argument("root", help="The target folder")
+    parser.add_argument("command", choices=("where", "lookup"),
+                        help="where: original -> encrypted file / lookup: encrypted file -> original")
+    parser.add_argument("paths", nargs="+")
+    parser.add_argument("--levels", type=int, default=2, help="Levels of sub-folders used")
+    args = parser.parse_args(argv)
+
+    layout = ShardedLayout(args.root, args.levels)
+    missing = 0
+    for path in args.paths:
+        if args.command == "where":
+            print(layout.path_for(path, create=False))
+            continue
+        source = layout.lookup(path)
+        if source is None:
+            print(f"❌ {path}: not in {os.path.join(args.root, INDEX_NAME)}", file=sys.stderr)
+            missing += 1
+        else:
+            print(source)
+    return 1 if missing else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""
+===============================================
+LOAD GENERATOR - HOW FAST IS IT UNDER REAL LOAD?
+===============================================
+
+Timing ONE encryption tells you very little about a busy service.
+This tool replays a whole "trace" (a list of jobs) at a chosen rate
+and measures how long every job took from the moment it SHOULD have
+started. Then it reports:
+
+- p50 / p95 / p99 latency: half / 95% / 99% of jobs were faster than this
+- throughput: jobs and megabytes per second
+- error rate: jobs that failed when they shouldn't have
+
+A TRACE is a JSON-lines file, one job per line:
+    {"op": "encrypt", "width": 1920, "height": 1080}
+    {"op": "decrypt", "width": 400, "height": 300, "wrong_password": true}
+    {"op": "decrypt", "path": "photos/cat_encrypted.png", "at": 1.5}
+
+- "width"/"height" make a synthetic picture (see demo.create_test_image)
+- "path" uses a real file instead (for decrypt it must be encrypted
+  with --password)
+- "at" is when to send the job, in seconds from the start (optional)
+
+Examples:
+    python3 loadgen.py --synthetic 500 --rate 50
+    python3 loadgen.py --synthetic 500 --save-trace mix.jsonl
+    python3 loadgen.py --trace mix.jsonl --target service --rate 200
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from client import DaemonClient, DEFAULT_SOCKET
+from demo import create_test_image
+from image_encryption import ImageEncryption
+
+
+# Picture sizes used by --synthetic when --sizes isn't given
+DEFAULT_SIZES = ((400, 300), (1280, 720), (1920, 1080))
+
+
+def synthetic_trace(count: int, sizes=DEFAULT_SIZES, decrypt_ratio: float = 0.5,
+                    wrong_password_rate: float = 0.05, seed: int = None) -> list:
+    """
+    Make up a trace: a random mix of sizes, encrypts and decrypts,
+    with some decrypts using the wrong password on purpose.
+    """
+    rng = random.Random(seed)
+    trace = []
+    for _ in range(count):
+        width, height = rng.choice(sizes)
+        job = {"op": "decrypt" if rng.random() < decrypt_ratio else "encrypt",
+               "width": width, "height": height}
+        if job["op"] == "decrypt" and rng.random() < wrong_password_rate:
+            job["wrong_password"] = True
+        trace.append(job)
+    return trace
+
+
+def load_trace(path: str) -> list:
+    """Read a JSON-lines trace file."""
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def save_trace(trace: list, path: str):
+    with open(path, "w") as f:
+        for job in trace:
+            f.write(json.dumps(job) + "\n")
+
+
+def percentile(values: list, pct: float) -> float:
+    """
+    The value that pct% of the (sorted) values are at or below.
+    Example: percentile([1, 2, 3, 4], 50) == 2
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+class LoadGenerator:
+    """
+    Prepares the input files for a trace and fires the jobs at a target:
+    - "library": ImageEncryption in this process
+    - "service": a running daemon.py (through client.py)
+    """
+
+    def __init__(self, trace: list, password: str, target: str = "library",
+                 concurrency: int = 8, socket_path: str = DEFAULT_SOCKET, http_port: int = None):
+        self.trace = trace
+        self.password = password
+        self.target = target
+        self.concurrency = concurrency
+        self.socket_path = socket_path
+        self.http_port = http_port
+        self.workdir = tempfile.mkdtemp(prefix="loadgen-")
+        self._inputs = {}  # (op, width, height) -> prepared input file
+        self._local = threading.local()  # One encryptor/client per thread
+
+    def prepare(self):
+        """
+        Make every synthetic picture the trace needs (once per size),
+        plus an encrypted copy of it for the decrypt jobs.
+        """
+        encryptor = ImageEncryption(verbose=False)
+        for job in self.trace:
+            if "path" in job:
+                continue
+            size = (job["width"], job["height"])
+            if ("encrypt",) + size in self._inputs:
+                continue
+            plain = os.path.join(self.workdir, f"synthetic_{size[0]}x{size[1]}.png")
+            create_test_image(plain, size[0], size[1], verbose=False)
+            self._inputs[("encrypt",) + size] = plain
+            self._inputs[("decrypt",) + size] = encryptor.encrypt_image(plain, self.password)
+
+    def _input_for(self, job: dict) -> str:
+        if "path" in job:
+            return job["path"]
+        return self._inputs[(job["op"], job["width"], job["height"])]
+
+    def _run_one(self, job: dict) -> int:
+        """Run a single job; returns the bytes read. Errors are raised."""
+        path = self._input_for(job)
+        password = "not-the-password" if job.get("wrong_password") else self.password
+
+        # Each thread writes its own output file so threads never collide
+        suffix = "_encrypted.png" if job["op"] == "encrypt" else "_decrypted.png"
+        output = os.path.join(self.workdir, f"out_{threading.get_ident()}{suffix}")
+
+        if self.target == "service":
+            if not hasattr(self._local, "client"):
+                self._local.client = DaemonClient(self.socket_path, self.http_port)
+            job_fn = getattr(self._local.client, job["op"])
+        else:
+            if not hasattr(self._local, "encryptor"):
+                self._local.encryptor = ImageEncryption(verbose=False)
+            job_fn = getattr(self._local.encryptor, job["op"] + "_image")
+
+        job_fn(path, password, output)
+        return os.path.getsize(path)
+
+    def run(self, rate: float = 0) -> dict:
+        """
+        Send every job in the trace and collect the results.
+
+        Parameters:
+        - rate: Jobs per second (0 = as fast as possible). Jobs with an "at"
+                field are sent at that time instead.
+
+        Latency is measured from when a job was SCHEDULED, not when a thread
+        picked it up - otherwise a backed-up service would look fast.
+        """
+        results = []
+        lock = threading.Lock()
+
+        def timed(job, scheduled):
+            outcome, nbytes = "ok", 0
+            try:
+                nbytes = self._run_one(job)
+                if job.get("wrong_password"):
+                    outcome = "error"  # A wrong password must NOT decrypt!
+            except ValueError:
+                outcome = "rejected" if job.get("wrong_password") else "error"
+            except Exception:
+                outcome = "error"
+            with lock:
+                results.append({"op": job["op"], "outcome": outcome, "bytes": nbytes,
+                                "latency": time.perf_counter() - scheduled})
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            for i, job in enumerate(self.trace):
+                if "at" in job:
+                    scheduled = start + job["at"]
+                elif rate:
+                    scheduled = start + i / rate
+                else:
+                    scheduled = time.perf_counter()
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                pool.submit(timed, job, scheduled)
+        elapsed = time.perf_counter() - start
+
+        return summarize(results, elapsed)
+
+    def close(self):
+        """Delete all the temporary files."""
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+def summarize(results: list, elapsed: float) -> dict:
+    """Turn the per-job results into the numbers we report."""
+    def stats(rows):
+        latencies = [row["latency"] for row in rows]
+        return {
+            "jobs": len(rows),
+            "errors": sum(row["outcome"] == "error" for row in rows),
+            "rejected": sum(row["outcome"] == "rejected" for row in rows),
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p95_ms": percentile(latencies, 95) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000,
+        }
+
+    summary = {"elapsed_s": elapsed, "overall": stats(results), "by_op": {}}
+    for op in sorted({row["op"] for row in results}):
+        summary["by_op"][op] = stats([row for row in results if row["op"] == op])
+
+    total_bytes = sum(row["bytes"] for row in results)
+    summary["jobs_per_s"] = len(results) / elapsed if elapsed else 0.0
+    summary["mb_per_s"] = total_bytes / elapsed / 1e6 if elapsed else 0.0
+    summary["error_rate"] = summary["overall"]["errors"] / len(results) if results else 0.0
+    return summary
+
+
+def print_report(summary: dict):
+    print("\n" + "="*60)
+    print("📊 LOAD TEST RESULTS")
+    print("="*60)
+    print(f"{'':10} {'jobs':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    rows = [("all", summary["overall"])] + list(summary["by_op"].items())
+    for name, row in rows:
+        print(f"{name:10} {row['jobs']:>7} {row['p50_ms']:>9.1f} {row['p95_ms']:>9.1f} "
+              f"{row['p99_ms']:>9.1f} {row['errors']:>7}")
+    print("-"*60)
+    print(f"Throughput: {summary['jobs_per_s']:.1f} jobs/s, {summary['mb_per_s']:.2f} MB/s "
+          f"over {summary['elapsed_s']:.1f}s")
+    print(f"Error rate: {summary['error_rate']:.2%} "
+          f"(wrong passwords rejected as expected: {summary['overall']['rejected']})")
+
+
+def _parse_sizes(text: str) -> tuple:
+    """'400x300,1920x1080' -> ((400, 300), (1920, 1080))"""
+    return tuple(tuple(int(n) for n in size.split("x")) for size in text.split(","))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay a job trace and measure latency.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--trace", help="JSON-lines trace file to replay")
+    source.add_argument("--synthetic", type=int, metavar="N", help="Make up a trace of N jobs")
+    parser.add_argument("--sizes", type=_parse_sizes, default=DEFAULT_SIZES,
+                        help="Synthetic sizes, e.g. 400x300,1920x1080")
+    parser.add_argument("--decrypt-ratio", type=float, default=0.5)
+    parser.add_argument("--wrong-password-rate", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, help="Make the synthetic trace repeatable")
+    parser.add_argument("--save-trace", help="Write the synthetic trace here and stop")
+    parser.add_argument("--target", choices=("library", "service"), default="library")
+    parser.add_argument("--rate", type=float, default=0, help="Jobs per second (0 = flat out)")
+    parser.add_argument("--concurrency", type=int, default=8, help="Jobs in flight at once")
+    parser.add_argument("--password", default="loadgen-password")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET, help="Daemon's Unix socket")
+    parser.add_argument("--http", type=int, metavar="PORT", help="Daemon's localhost HTTP port")
+    parser.add_argument("--json", help="Also save the results as JSON here")
+    args = parser.parse_args(argv)
+
+    if args.trace:
+        trace = load_trace(args.trace)
+    else:
+        trace = synthetic_trace(args.synthetic, args.sizes, args.decrypt_ratio,
+                                args.wrong_password_rate, args.seed)
+    if args.save_trace:
+        save_trace(trace, args.save_trace)
+        print(f"💾 Saved {len(trace)} jobs to {args.save_trace}")
+        return 0
+
+    generator = LoadGenerator(trace, args.password, args.target, args.concurrency,
+                              args.socket, args.http)
+    try:
+        print(f"🛠️  Preparing inputs for {len(trace)} jobs...")
+        generator.prepare()
+        print(f"🚀 Replaying against the {args.target} at "
+              f"{f'{args.rate:g} jobs/s' if args.rate else 'full speed'}...")
+        summary = generator.run(args.rate)
+    finally:
+        generator.close()
+
+    print_report(summary)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -13,6 +13,14 @@ HOW TO USE:
 4. Enter a password
 5. Done!
 
+COMMAND MODE (for scripts and shell pipelines):
+    python3 main.py encrypt photo.jpg -o photo_encrypted.png
+    python3 main.py decrypt photo_encrypted.png -o photo.png
+    curl -s https://example.com/cat.jpg | python3 main.py encrypt - > cat.enc
+    python3 main.py decrypt - < cat.enc > cat.jpg
+Use "-" for standard input / output. The password comes from -p, the
+IMAGE_ENCRYPTION_PASSWORD environment variable, or is asked for.
+
 This is a LEARNING project - great for understanding:
 - How to get user input
 - How files work
@@ -20,8 +28,14 @@ This is a LEARNING project - great for understanding:
 """
 
 # Import our encryption class
-from image_encryption import ImageEncryption
+from image_encryption import ImageEncryption, ENCODING_PROFILES, DEFAULT_PROFILE, atomic_output
+from client import read_password  # Password from -p, environment, or prompt
+from iohints import IOHints  # Page cache hints (--drop-cache)
+from catalog import Catalog  # SQLite catalog of encrypted images (--catalog)
+import argparse  # For reading command-line options in command mode
+import contextlib  # For closing the files we open in stream mode
 import os  # For checking if files exist
+import sys  # For standard input/output (the "-" file)
 
 
 def print_header():
@@ -237,10 +251,88 @@ def main():
         print("\n")
 
 
+def run_command(argv):
+    """
+    COMMAND MODE
+    Do one encrypt/decrypt without any menus - handy for scripts.
+    
+    If the input or output is "-" (or --stream is given), the data is
+    streamed through in chunks, so even huge files use very little memory
+    and no temporary files are needed.
+    
+    Returns:
+    - 0 if it worked, 1 if it failed (the shell's "exit code")
+    """
+    parser = argparse.ArgumentParser(description="Encrypt or decrypt one image.")
+    parser.add_argument("op", choices=("encrypt", "decrypt"))
+    parser.add_argument("input", help='Image file, or "-" for standard input')
+    parser.add_argument("-o", "--output", help='Where to save it, or "-" for standard output')
+    parser.add_argument("-p", "--password", help="Password (or set IMAGE_ENCRYPTION_PASSWORD)")
+    parser.add_argument("--convert", metavar="MODE",
+                        help="Convert to this color mode before encrypting (e.g. RGB)")
+    parser.add_argument("--profile", choices=list(ENCODING_PROFILES), default=DEFAULT_PROFILE,
+                        help="How to encode the image (speed vs. size)")
+    parser.add_argument("--compress", choices=("zlib", "lzma"),
+                        help="Compress before encrypting (helps raw pixels, BMP, TIFF)")
+    parser.add_argument("--frame", type=int,
+                        help="Decrypt only this frame of an animated / multi-page image")
+    parser.add_argument("--drop-cache", action="store_true",
+                        help="Drop the files from the OS page cache when done (for big batches)")
+    parser.add_argument("--stream", action="store_true",
+                        help="Encrypt the file's bytes as they are, chunk by chunk")
+    parser.add_argument("--catalog", metavar="FILE",
+                        help="Write the image's details into this SQLite catalog (see catalog.py)")
+    args = parser.parse_args(argv)
+    
+    stream = args.stream or args.input == "-" or args.output == "-"
+    hints = IOHints(drop_cache=args.drop_cache)
+    password = read_password(args.password)
+    
+    try:
+        if not stream:
+            with contextlib.ExitStack() as resources:
+                catalog = resources.enter_context(Catalog(args.catalog)) if args.catalog else None
+                encryptor = ImageEncryption(profile=args.profile, compression=args.compress, hints=hints,
+                                            catalog=catalog)
+                if args.op == "encrypt":
+                    encryptor.encrypt_image(args.input, password, args.output, args.convert)
+                else:
+                    encryptor.decrypt_image(args.input, password, args.output, args.frame)
+            return 0
+        
+        # In stream mode standard output carries the data, so we stay quiet
+        output = args.output or "-"
+        if output == "-" and sys.stdout.isatty():
+            print("❌ Refusing to write binary data to the terminal. Use -o or a pipe.",
+                  file=sys.stderr)
+            return 1
+        
+        # ExitStack closes whichever files we opened (but not stdin/stdout)
+        with contextlib.ExitStack() as files:
+            source = sys.stdin.buffer if args.input == "-" else files.enter_context(open(args.input, "rb"))
+            # An output file only appears once it's complete (see atomic_output)
+            destination = sys.stdout.buffer if output == "-" else files.enter_context(atomic_output(output))
+            encryptor = ImageEncryption(verbose=False, compression=args.compress)
+            job = encryptor.encrypt_stream if args.op == "encrypt" else encryptor.decrypt_stream
+            hints.reading(source)  # Hints quietly do nothing for pipes
+            job(source, destination, password)
+            hints.done_reading(source)
+            hints.done_writing(destination)
+        return 0
+    
+    except (OSError, ValueError, IndexError) as e:
+        print(f"❌ ERROR: {e}", file=sys.stderr)
+        return 1
+
+
 # This is a Python convention:
 # Code here only runs if you execute this file directly
 # (not if you import it as a module)
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        # Command-line arguments were given - run in command mode
+        sys.exit(run_command(sys.argv[1:]))
+    
     # Start the program!
     main()
 
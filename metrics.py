@@ -0,0 +1,259 @@
+"""
+===============================================
+METRICS - NUMBERS THAT TELL YOU HOW THE SERVICE IS DOING
+===============================================
+
+When the tool runs as a service (see daemon.py) you can't watch it print
+messages. Instead it keeps COUNTERS: how many jobs ran, how many bytes,
+how long they took, how many wrong passwords...
+
+These numbers are shown in the "Prometheus text format", a very simple
+format that monitoring tools understand:
+
+    # HELP image_encryption_jobs_total Jobs finished
+    # TYPE image_encryption_jobs_total counter
+    image_encryption_jobs_total{op="encrypt",mode="RGB",status="ok"} 42
+
+THREE KINDS OF METRIC:
+- Counter:   only goes up (jobs done, bytes processed)
+- Gauge:     goes up and down (jobs waiting in the queue)
+- Histogram: counts values in "buckets" (how many jobs took < 5ms, < 10ms...)
+
+Rates (jobs per second, bytes per second) are worked out by the monitoring
+tool from how fast the counters grow.
+
+See them in your browser:
+    python3 daemon.py --metrics-port 9100
+    open http://127.0.0.1:9100/metrics
+"""
+
+import threading   # Many threads update the same numbers, so we need a lock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Histogram buckets in seconds: 1ms ... 10s
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    """Build the {name="value",...} part of a metric line."""
+    parts = []
+    for name, value in zip(names, values):
+        # Backslashes, quotes and newlines must be escaped in label values
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{name}="{value}"')
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_number(value: float) -> str:
+    """Whole numbers print without a trailing .0 (42 instead of 42.0)."""
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class _Metric:
+    """
+    The parts every metric shares: a name, a help text, label names,
+    and a lock so that threads don't trip over each other.
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        """Turn label keyword arguments into a tuple in the declared order."""
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def render(self) -> list:
+        """Return the text lines for this metric."""
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            lines.extend(self._samples())
+        return lines
+
+
+class Counter(_Metric):
+    """A number that only ever goes up."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        super().__init__(name, help_text, labels)
+        self._values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _samples(self) -> list:
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_number(value)}"
+                for key, value in sorted(self._values.items())]
+
+
+class Gauge(Counter):
+    """A number that can go up AND down."""
+
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    """
+    Counts how many values fell into each bucket.
+    Example: with buckets (0.01, 0.1), a job taking 0.05s is counted in
+    the "<= 0.1" bucket (and in "+Inf", which counts everything).
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def _samples(self) -> list:
+        lines = []
+        for key, series in sorted(self._series.items()):
+            for bound, count in zip(self.buckets, series):
+                le = _format_labels(self.labels, key, f'le="{_format_number(bound)}"')
+                lines.append(f"{self.name}_bucket{le} {count}")
+            inf = _format_labels(self.labels, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{inf} {series[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_number(series[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {series[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    """A collection of metrics that can be rendered all at once."""
+
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name: str, help_text: str, labels: tuple = ()) -> Counter:
+        return self._add(Counter(name, help_text, labels))
+
+    def gauge(self, name: str, help_text: str, labels: tuple = ()) -> Gauge:
+        return self._add(Gauge(name, help_text, labels))
+
+    def histogram(self, name: str, help_text: str, labels: tuple = (),
+                  buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help_text, labels, buckets))
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """The whole registry in Prometheus text format."""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# ========== THE METRICS THIS PROJECT KEEPS ==========
+
+REGISTRY = MetricsRegistry()
+
+JOBS = REGISTRY.counter(
+    "image_encryption_jobs_total", "Jobs finished, by operation, image mode and outcome",
+    ("op", "mode", "status"))
+BYTES = REGISTRY.counter(
+    "image_encryption_bytes_total", "Bytes run through the XOR cipher", ("op",))
+LATENCY = REGISTRY.histogram(
+    "image_encryption_job_seconds", "Time taken per job", ("op", "mode"))
+WRONG_PASSWORDS = REGISTRY.counter(
+    "image_encryption_wrong_password_total", "Decrypt/probe jobs that failed the image check", ("op",))
+QUEUE_DEPTH = REGISTRY.gauge(
+    "image_encryption_queue_depth", "Jobs waiting for a free worker")
+WORKERS = REGISTRY.gauge(
+    "image_encryption_workers", "Worker processes in the pool")
+WORKERS_BUSY = REGISTRY.gauge(
+    "image_encryption_workers_busy", "Workers currently running a job")
+WORKER_BUSY_SECONDS = REGISTRY.counter(
+    "image_encryption_worker_busy_seconds_total",
+    "Time workers spent on jobs (divide its rate by workers for utilization)")
+CACHE_LOOKUPS = REGISTRY.counter(
+    "image_encryption_cache_lookups_total", "Cache lookups by cache and result (hit/miss)",
+    ("cache", "result"))
+MEMORY_RESERVED = REGISTRY.gauge(
+    "image_encryption_memory_reserved_bytes", "Estimated peak memory of the jobs admitted right now")
+
+
+def record_job(op: str, seconds: float, mode: str = "unknown", nbytes: int = 0, status: str = "ok"):
+    """
+    Count one finished job. Called by the encrypt/decrypt/probe paths.
+
+    Parameters:
+    - op: "encrypt", "decrypt" or "probe"
+    - seconds: How long the job took
+    - mode: The image's color mode ("RGB", "L", ...)
+    - nbytes: Bytes that went through the cipher
+    - status: "ok", "wrong_password" or "error"
+    """
+    JOBS.inc(op=op, mode=mode, status=status)
+    LATENCY.observe(seconds, op=op, mode=mode)
+    if nbytes:
+        BYTES.inc(nbytes, op=op)
+    if status == "wrong_password":
+        WRONG_PASSWORDS.inc(op=op)
+
+
+# ========== THE /metrics WEB PAGE ==========
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    """Answers GET /metrics with the registry's text."""
+
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404, "Try /metrics")
+            return
+        body = self.server.registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        """Monitoring tools ask every few seconds - don't print each one."""
+
+
+def start_metrics_server(port: int, host: str = "127.0.0.1", registry: MetricsRegistry = REGISTRY):
+    """
+    Serve http://<host>:<port>/metrics from a background thread.
+    Returns the server (call .shutdown() on it to stop).
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.registry = registry
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,589 @@
+#!/usr/bin/env python3
+"""
+===============================================
+PIPELINE - KEEP THE DISK AND THE CPU BUSY AT THE SAME TIME
+===============================================
+
+Encrypting a file takes four steps:
+    read -> codec (decode + encode the image) -> cipher (XOR) -> write
+
+Doing all four for one file before starting the next means the disk
+sits idle while the CPU works, and the CPU sits idle while the disk
+reads. On a network drive, where every read takes a while to come
+back, that waiting adds up fast.
+
+A PIPELINE runs every step at once, like a factory line:
+
+    [read x4] -> queue -> [codec x8] -> queue -> [cipher x1] -> queue -> [write x4]
+
+- Every stage has its own threads ("x4" = four threads)
+- Between two stages is a QUEUE with a size limit. If a later stage
+  falls behind, the queue fills up and the earlier stage waits, so
+  memory never grows out of control.
+- The whole batch runs about as fast as its SLOWEST stage, not the sum
+  of all four. The report at the end tells you which stage that was,
+  so you know which thread count to raise.
+
+Threads work well here: reads and writes spend their time waiting on
+the disk, and PIL and zlib let other threads run while they crunch.
+
+Examples:
+    python3 pipeline.py encrypt photos/ --output-dir encrypted/
+    python3 pipeline.py decrypt encrypted/*.png -p secret --read-threads 16
+"""
+
+import argparse
+import io
+import json
+import os
+import queue       # Thread-safe queues with a size limit
+import sys
+import threading
+import time
+
+from PIL import Image
+
+import metrics
+import tuning
+from admission import MemoryBudget, estimate_memory
+from arena import DEFAULT_ARENA, ViewFile
+from catalog import Catalog
+from iohints import IOHints
+from layout import ShardedLayout
+from client import read_password
+from image_encryption import (DEFAULT_PROFILE, ENCODING_PROFILES, FRAMES_MAGIC,
+                              ImageEncryption, atomic_output, decrypted_name, encrypted_name,
+                              make_key, open_payload, save_image, xor_bytes, xor_into)
+
+
+STAGES = ("read", "codec", "cipher", "write")
+
+# Threads per stage when none are given. Only the codec stage is CPU heavy
+# (calibrate.py finds how many codec threads are best on this computer).
+DEFAULT_THREADS = {"read": 4, "codec": tuning.setting("codec_threads", os.cpu_count() or 1),
+                   "cipher": 1, "write": 4}
+
+# How many jobs can wait between two stages
+DEFAULT_QUEUE_SIZE = 8
+
+_DONE = object()  # Put in a queue to say "no more jobs are coming"
+
+
+class Job:
+    """One file travelling down the pipeline."""
+
+    def __init__(self, number: int, source: str, output: str):
+        self.number = number      # Position in the batch (results come back in this order)
+        self.source = source
+        self.output = output
+        self.data = None          # The bytes being passed from stage to stage
+        self.mode = "unknown"     # The image's color mode, for the metrics
+        self.size = None          # (width, height) and original format, for the catalog
+        self.format = None
+        self.nbytes = 0           # Bytes that went through the cipher
+        self.error = None         # The exception, if a stage failed
+        self.finished = False     # True when a stage already did ALL the work itself
+        self.started = None
+        self.seconds = 0.0
+        self.segment = None         # Shared memory holding the job's bytes (see shm_pool.py)
+        self.result_segment = None  # Extra shared memory for a result that didn't fit
+        self.length = 0             # How many bytes of the segment are in use
+        self.buffer = None          # Read / cipher buffer borrowed from the arena (see arena.py)
+        self.memory = 0             # Estimated peak memory, when a budget is used (see admission.py)
+
+
+class Pipeline:
+    """
+    Runs jobs through a list of stages, all stages at the same time.
+
+    Each stage is (name, function, threads): function(job) does that
+    stage's work, usually by replacing job.data. If it raises, the error
+    is kept in job.error and the job skips the remaining stages.
+    """
+
+    def __init__(self, stages: list, queue_size: int = DEFAULT_QUEUE_SIZE, on_done=None):
+        """
+        Parameters:
+        - stages: List of (name, function, threads)
+        - queue_size: How many jobs may wait in front of each stage
+        - on_done: Called as on_done(job) as each job leaves the last stage
+                   (if it raises, the error is kept in job.error)
+        """
+        self.stages = stages
+        self.queue_size = queue_size
+        self.on_done = on_done
+        self.stats = {name: {"threads": threads, "jobs": 0, "busy_s": 0.0}
+                      for name, _, threads in stages}
+        self.elapsed = 0.0
+        self._lock = threading.Lock()
+
+    def run(self, jobs) -> list:
+        """Push every job through all the stages. Returns the jobs in their original order."""
+        # One bounded queue in front of each stage, plus one for the results
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages] + [queue.Queue()]
+        remaining = [threads for _, _, threads in self.stages]
+
+        start = time.perf_counter()
+        for index, (name, _, threads) in enumerate(self.stages):
+            for _ in range(threads):
+                threading.Thread(target=self._work, args=(index, queues, remaining),
+                                 name=f"pipeline-{name}", daemon=True).start()
+
+        # Feeding blocks whenever the first stage is full - that's the point
+        for job in jobs:
+            queues[0].put(job)
+        for _ in range(self.stages[0][2]):
+            queues[0].put(_DONE)
+
+        done = []
+        while True:
+            job = queues[-1].get()
+            if job is _DONE:
+                break
+            done.append(job)
+
+        self.elapsed = time.perf_counter() - start
+        return sorted(done, key=lambda job: job.number)
+
+    def _work(self, index: int, queues: list, remaining: list):
+        """The loop every stage thread runs: take a job, work on it, pass it on."""
+        name, function, _ = self.stages[index]
+        inbox, outbox = queues[index], queues[index + 1]
+        last_stage = index == len(self.stages) - 1
+
+        while True:
+            job = inbox.get()
+            if job is _DONE:
+                break
+            if job.error is None and not job.finished:
+                began = time.perf_counter()
+                if job.started is None:
+                    job.started = began
+                try:
+                    function(job)
+                except Exception as e:
+                    job.error = e
+                    job.data = None
+                with self._lock:
+                    self.stats[name]["jobs"] += 1
+                    self.stats[name]["busy_s"] += time.perf_counter() - began
+            if last_stage:
+                job.seconds = time.perf_counter() - (job.started or time.perf_counter())
+                if self.on_done is not None:
+                    try:
+                        self.on_done(job)
+                    except Exception as e:
+                        # The job still has to be passed on, or run() would wait for it forever
+                        job.error = job.error or e
+            outbox.put(job)
+
+        # The last thread of a stage to stop tells the next stage to stop
+        with self._lock:
+            remaining[index] -= 1
+            last_thread = remaining[index] == 0
+        if last_thread:
+            following = 1 if last_stage else self.stages[index + 1][2]
+            for _ in range(following):
+                outbox.put(_DONE)
+
+    def bottleneck(self) -> str:
+        """The stage that was busiest per thread - the one slowing the batch down."""
+        return max(self.stats, key=lambda name: self.stats[name]["busy_s"] / self.stats[name]["threads"])
+
+
+# ========== THE ENCRYPT AND DECRYPT PIPELINES ==========
+
+def _record(op: str):
+    """An on_done callback that counts each finished job in metrics.py."""
+    def record(job):
+        if job.finished:
+            return  # encrypt_image()/decrypt_image() counted it already
+        if job.error is None:
+            status = "ok"
+        elif isinstance(job.error, ValueError) and op == "decrypt":
+            status = "wrong_password"
+        else:
+            status = "error"
+        metrics.record_job(op, job.seconds, job.mode, job.nbytes, status)
+    return record
+
+
+def _writer(hints):
+    def write(job):
+        with atomic_output(job.output) as f:
+            f.write(job.data)
+            hints.done_writing(f)
+        job.data = None  # Let the memory go right away
+    return write
+
+
+def _reader(hints):
+    def read(job):
+        # Read into a reusable buffer instead of a brand new bytes object
+        job.data = job.buffer = DEFAULT_ARENA.read_file(job.source, hints)
+    return read
+
+
+def _give_back(job):
+    """Return the job's buffer to the arena, once nothing needs it."""
+    if job.buffer is not None:
+        DEFAULT_ARENA.give_back(job.buffer)
+        job.buffer = None
+
+
+def _encrypt_whole(encryptor: ImageEncryption, job: Job, password: str, convert_mode: str,
+                   profile: str):
+    """Multi-frame images are written frame by frame, so encrypt_image() does them in one go."""
+    job.finished, job.data = True, None
+    encryptor.encrypt_image(job.source, password, job.output, convert_mode, profile)
+
+
+def _decrypt_whole(encryptor: ImageEncryption, job: Job, password: str, profile: str):
+    """Frame packs are read frame by frame, so decrypt_image() does them in one go."""
+    job.finished, job.data = True, None
+    # Animations come back in their own format (.gif, .tiff...) - without an
+    # extension, decrypt_image() adds the one that goes with the frame index it reads
+    job.output = encryptor.decrypt_image(job.source, password, os.path.splitext(job.output)[0],
+                                         profile=profile)
+
+
+def _when_done(op: str, engine, on_done):
+    """The on_done callback: count the job, free its shared memory, then call the caller's."""
+    record = _record(op)
+
+    def done(job):
+        record(job)
+        _give_back(job)  # In case a stage failed before it could
+        if engine is not None:
+            engine.finish(job)
+        if on_done is not None:
+            on_done(job)
+    return done
+
+
+def encrypt_pipeline(encryptor: ImageEncryption, password: str, threads: dict = None,
+                     queue_size: int = DEFAULT_QUEUE_SIZE, convert_mode: str = None,
+                     profile: str = None, on_done=None, engine=None) -> Pipeline:
+    """
+    Build a pipeline that does what encrypt_image() does, stage by stage.
+    
+    With an engine (a shm_pool.ProcessEngine), encoding and XOR run in worker
+    processes instead, as one "codec" stage with a thread per process.
+    """
+    threads = dict(DEFAULT_THREADS, **(threads or {}))
+    key = make_key(password)
+    done = _when_done("encrypt", engine, on_done)
+
+    if engine is not None:
+        def work(job):
+            if not engine.encrypt(job):
+                _encrypt_whole(encryptor, job, password, convert_mode, profile)
+
+        return Pipeline([("read", engine.read, threads["read"]), ("codec", work, engine.processes),
+                         ("write", engine.write, threads["write"])], queue_size, done)
+
+    def codec(job):
+        with Image.open(ViewFile(job.data)) as img:
+            job.mode, job.size, job.format = img.mode, img.size, img.format
+            if getattr(img, "n_frames", 1) > 1:
+                _give_back(job)
+                _encrypt_whole(encryptor, job, password, convert_mode, profile)
+                return
+            payload = encryptor.encode_payload(img, convert_mode, profile)
+        _give_back(job)
+        job.data = payload
+        job.nbytes = len(payload)
+
+    def cipher(job):
+        # Scramble into a reusable buffer too - written out, it goes back to the arena
+        job.buffer = DEFAULT_ARENA.borrow(len(job.data))
+        job.data = xor_into(job.data, key, job.buffer)
+
+    return Pipeline([("read", _reader(encryptor.hints), threads["read"]), ("codec", codec, threads["codec"]),
+                     ("cipher", cipher, threads["cipher"]), ("write", _writer(encryptor.hints), threads["write"])],
+                    queue_size, done)
+
+
+def decrypt_pipeline(encryptor: ImageEncryption, password: str, threads: dict = None,
+                     queue_size: int = DEFAULT_QUEUE_SIZE, profile: str = None,
+                     on_done=None, engine=None) -> Pipeline:
+    """
+    Build a pipeline that does what decrypt_image() does, stage by stage.
+    Here the cipher comes BEFORE the codec: first unscramble, then decode.
+    
+    With an engine (a shm_pool.ProcessEngine), XOR and decoding run in worker
+    processes instead, as one "codec" stage with a thread per process.
+    """
+    threads = dict(DEFAULT_THREADS, **(threads or {}))
+    profile = profile or encryptor.profile
+    key = make_key(password)
+    done = _when_done("decrypt", engine, on_done)
+
+    if engine is not None:
+        def work(job):
+            if not engine.decrypt(job):
+                _decrypt_whole(encryptor, job, password, profile)
+
+        return Pipeline([("read", engine.read, threads["read"]), ("codec", work, engine.processes),
+                         ("write", engine.write, threads["write"])], queue_size, done)
+
+    def cipher(job):
+        job.nbytes = len(job.data)
+        frames = xor_bytes(job.data[:len(FRAMES_MAGIC)], key) == FRAMES_MAGIC
+        plain = None if frames else xor_bytes(job.data, key)
+        _give_back(job)
+        if frames:
+            _decrypt_whole(encryptor, job, password, profile)
+            return
+        job.data = plain
+
+    def codec(job):
+        try:
+            img = open_payload(job.data, encryptor.threads)
+            img.load()
+        except Exception:
+            raise ValueError("❌ Decryption failed! Wrong password or corrupted file.")
+        job.mode, job.size = img.mode, img.size
+        buffer = io.BytesIO()
+        save_image(img, buffer, profile)
+        job.data = buffer.getvalue()
+
+    return Pipeline([("read", _reader(encryptor.hints), threads["read"]), ("cipher", cipher, threads["cipher"]),
+                     ("codec", codec, threads["codec"]), ("write", _writer(encryptor.hints), threads["write"])],
+                    queue_size, done)
+
+
+class Journal:
+    """
+    A log of finished files, so an interrupted batch can carry on where it
+    stopped instead of starting over. One JSON line per file:
+        {"op": "encrypt", "source": "/photos/cat.jpg", "output": "...", "ok": true}
+    Each line is flushed as soon as it's written, so a crash loses at most
+    the file that was being worked on. Run the batch again with the same
+    journal and every file that already worked is skipped.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.done = {}  # (op, absolute source path) -> output, for files that worked
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        if entry.get("ok"):
+                            self.done[(entry["op"], entry["source"])] = entry["output"]
+                    except (ValueError, KeyError, TypeError, AttributeError):
+                        continue  # A line cut short by a crash (or not one of ours)
+        self._file = open(path, 'a')
+        if self._file.tell() and not _ends_with_newline(path):
+            self._file.write("\n")  # Don't glue new lines onto a cut-off one
+        self._lock = threading.Lock()
+
+    def is_done(self, op: str, source: str) -> bool:
+        """Did this file already work in an earlier run (and is its output still there)?"""
+        output = self.done.get((op, os.path.abspath(source)))
+        return output is not None and os.path.exists(output)
+
+    def recorder(self, op: str):
+        """An on_done callback that writes each finished job to the journal."""
+        def record(job):
+            entry = {"op": op, "source": os.path.abspath(job.source),
+                     "output": os.path.abspath(job.output), "ok": job.error is None}
+            if job.error is not None:
+                entry["error"] = str(job.error)
+            with self._lock:
+                self._file.write(json.dumps(entry) + "\n")
+                self._file.flush()
+        return record
+
+    def close(self):
+        self._file.close()
+
+
+def _ends_with_newline(path: str) -> bool:
+    with open(path, 'rb') as f:
+        f.seek(-1, 2)
+        return f.read(1) == b"\n"
+
+
+def make_jobs(op: str, paths: list, output_dir: str = None, profile: str = DEFAULT_PROFILE,
+              layout=None) -> list:
+    """
+    One Job per input file, with the same output names encrypt/decrypt_image() would pick.
+    layout: a layout.ShardedLayout that places encrypted files instead (optional)
+    """
+    jobs = []
+    for number, path in enumerate(paths):
+        output = encrypted_name(path) if op == "encrypt" else decrypted_name(path, profile)
+        if layout is not None and op == "encrypt":
+            output = layout.path_for(path)
+        elif output_dir:
+            output = os.path.join(output_dir, os.path.basename(output))
+        jobs.append(Job(number, path, output))
+    return jobs
+
+
+def expand_inputs(paths: list, extensions: list = None) -> list:
+    """Replace each folder in paths with the files inside it (optionally only these extensions)."""
+    files = []
+    for path in paths:
+        if not os.path.isdir(path):
+            files.append(path)
+            continue
+        for entry in sorted(os.scandir(path), key=lambda entry: entry.name):
+            if entry.is_file() and (extensions is None or entry.name.lower().endswith(tuple(extensions))):
+                files.append(entry.path)
+    return files
+
+
+def print_report(pipeline: Pipeline, jobs: list):
+    ok = [job for job in jobs if job.error is None]
+    total_bytes = sum(job.nbytes for job in ok)
+    elapsed = pipeline.elapsed or 1e-9
+    print(f"\n✅ {len(ok)}/{len(jobs)} files in {pipeline.elapsed:.2f}s "
+          f"({len(ok) / elapsed:.1f} files/s, {total_bytes / elapsed / 1e6:.2f} MB/s)")
+    print(f"{'stage':8} {'threads':>8} {'jobs':>7} {'busy s':>9} {'use':>6}")
+    slowest = pipeline.bottleneck()
+    for name, stage in pipeline.stats.items():
+        use = stage["busy_s"] / (stage["threads"] * elapsed)
+        marker = "  <- slowest" if name == slowest else ""
+        print(f"{name:8} {stage['threads']:>8} {stage['jobs']:>7} {stage['busy_s']:>9.2f} {use:>6.0%}{marker}")
+    buffers = DEFAULT_ARENA.stats()
+    if buffers["borrowed"]:
+        print(f"Arena buffers: {buffers['borrowed']} borrowed, {buffers['reused']} reused, "
+              f"{buffers['allocated']} allocated, high-water {buffers['high_water_bytes'] / 1e6:.1f} MB")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Encrypt or decrypt many images with overlapping stages.")
+    parser.add_argument("op", choices=("encrypt", "decrypt"))
+    parser.add_argument("paths", nargs="+", help="Files, or folders of files")
+    parser.add_argument("-p", "--password", help="Password (or set IMAGE_ENCRYPTION_PASSWORD)")
+    parser.add_argument("--output-dir", help="Put the results here instead of next to the inputs")
+    parser.add_argument("--profile", choices=list(ENCODING_PROFILES), default=DEFAULT_PROFILE)
+    parser.add_argument("--compress", choices=("zlib", "lzma"), help="Compress before encrypting")
+    parser.add_argument("--convert", metavar="MODE", help="Convert to this color mode before encrypting")
+    for stage in STAGES:
+        parser.add_argument(f"--{stage}-threads", type=int, default=DEFAULT_THREADS[stage],
+                            metavar="N", help=f"Threads for the {stage} stage")
+    parser.add_argument("--queue-size", type=int, default=DEFAULT_QUEUE_SIZE,
+                        help="Jobs that may wait between two stages")
+    parser.add_argument("--drop-cache", action="store_true",
+                        help="Drop each file from the page cache when done (spares other programs)")
+    parser.add_argument("--no-readahead", action="store_true",
+                        help="Don't ask the OS to read ahead (e.g. for random-access storage)")
+    parser.add_argument("--journal", metavar="FILE",
+                        help="Log finished files here; run again with it to resume an interrupted batch")
+    parser.add_argument("--processes", type=int, metavar="N",
+                        help="Encode/decode in N worker processes, sharing memory with them")
+    parser.add_argument("--segment-mb", type=int, default=16,
+                        help="Size of each pooled shared memory segment (with --processes)")
+    parser.add_argument("--catalog", metavar="FILE",
+                        help="Write each file's details into this SQLite catalog (see catalog.py)")
+    parser.add_argument("--shard", action="store_true",
+                        help="Encrypt into hashed sub-folders of --output-dir (see layout.py)")
+    parser.add_argument("--memory-budget", type=int, metavar="MB",
+                        help="Only start files while their estimated memory fits in this many MB")
+    parser.add_argument("--backfill", type=int, default=64,
+                        help="Small files that may go ahead of one waiting for memory")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Only predict the time, memory and output size (see plan.py)")
+    args = parser.parse_args(argv)
+
+    if args.shard and (args.op != "encrypt" or not args.output_dir):
+        parser.error("--shard works with encrypt and --output-dir")
+
+    if args.dry_run:
+        import plan  # Only needed for a dry run
+        password = read_password(args.password) if args.op == "decrypt" else None
+        plan.print_plan(plan.plan(args.paths, args.op, args.processes or args.codec_threads, args.profile,
+                                  args.compress, password, processes=bool(args.processes),
+                                  memory_budget=args.memory_budget * 1024 * 1024 if args.memory_budget else None))
+        return 0
+
+    hints = IOHints(sequential=not args.no_readahead, drop_cache=args.drop_cache)
+    catalog = None
+    if args.catalog:
+        catalog = Catalog(args.catalog)
+    encryptor = ImageEncryption(verbose=False, profile=args.profile, compression=args.compress,
+                                hints=hints, catalog=catalog)
+    extensions = encryptor.supported_formats if args.op == "encrypt" else None
+    paths = expand_inputs(args.paths, extensions)
+    if not paths:
+        parser.error("No input files found")
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    password = read_password(args.password)
+    threads = {stage: getattr(args, f"{stage}_threads") for stage in STAGES}
+    layout = ShardedLayout(args.output_dir) if args.shard else None
+    jobs = make_jobs(args.op, paths, args.output_dir, args.profile, layout)
+    journal = None
+    callbacks = [layout.recorder()] if layout is not None else []
+    if catalog is not None:
+        callbacks.append(catalog.recorder(args.op, password, args.profile, args.compress))
+    if args.journal:
+        journal = Journal(args.journal)
+        callbacks.append(journal.recorder(args.op))
+        todo = [job for job in jobs if not journal.is_done(args.op, job.source)]
+        if len(todo) < len(jobs):
+            print(f"⏩ Skipping {len(jobs) - len(todo)} files already done (from {args.journal})")
+        jobs = todo
+
+    budget = None
+    if args.memory_budget:
+        budget = MemoryBudget(args.memory_budget * 1024 * 1024, args.backfill)
+        callbacks.append(lambda job: budget.release(job.memory))
+
+        def estimate(job):
+            try:
+                job.memory = estimate_memory(job.source, args.op, password)
+            except OSError:
+                pass  # Missing file: the read stage will report it
+            return job.memory
+
+    def on_done(job):
+        # Every callback runs even if one fails - the budget release (last) most of all
+        for callback in callbacks:
+            try:
+                callback(job)
+            except Exception as e:
+                job.error = job.error or e  # The ones after it (the journal) see it failed
+
+    engine = None
+    if args.processes:
+        from shm_pool import ProcessEngine  # Shared memory needs Python 3.8+
+        engine = ProcessEngine(encryptor, password, args.processes, args.segment_mb * 1024 * 1024,
+                               convert_mode=args.convert)
+    if args.op == "encrypt":
+        pipeline = encrypt_pipeline(encryptor, password, threads, args.queue_size, args.convert,
+                                    on_done=on_done, engine=engine)
+    else:
+        pipeline = decrypt_pipeline(encryptor, password, threads, args.queue_size,
+                                    on_done=on_done, engine=engine)
+
+    print(f"🚀 {args.op.capitalize()}ing {len(jobs)} files...")
+    try:
+        jobs = pipeline.run(jobs if budget is None else budget.schedule(jobs, estimate))
+    finally:
+        if engine is not None:
+            engine.close()
+        if journal is not None:
+            journal.close()
+        if catalog is not None:
+            catalog.close()
+
+    for job in jobs:
+        if job.error is not None:
+            print(f"❌ {job.source}: {job.error}", file=sys.stderr)
+    print_report(pipeline, jobs)
+    if budget is not None:
+        stats = budget.stats()
+        print(f"🧮 Memory budget {stats['budget'] / 2**20:.0f} MB: estimated peak {stats['peak'] / 2**20:.0f} MB, "
+              f"{stats['backfilled']} files backfilled")
+    return 0 if all(job.error is None for job in jobs) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""
+===============================================
+PLAN - HOW LONG WILL IT TAKE? (A DRY RUN)
+===============================================
+
+Before encrypting 3 terabytes of photos you want to know: will it take
+an hour or a week? Is there enough disk space for the output? Enough
+memory for 16 workers?
+
+plan.py answers WITHOUT encrypting anything:
+
+1. SCAN: walk the folders with os.scandir (fast - one system call per
+   folder, not per file) and read the first 16 bytes of every file.
+   Those "magic bytes" say what each file really is - a photo.jpg that
+   is really a PNG is counted as PNG, and notes.txt is left out.
+2. SAMPLE: open the headers of a few files of each format to learn how
+   many pixels there are per byte of file (and how much memory a job
+   needs - see admission.py).
+3. PREDICT with the per-format model from calibrate.py (how many
+   milliseconds per megapixel each format takes on THIS computer, and
+   how big the output gets), scaled by how well the workers speed
+   things up here, and limited by the measured disk speed.
+
+    python3 plan.py encrypt /photos --workers 16
+    python3 plan.py decrypt /encrypted -p secret --profile fastest
+    python3 pipeline.py encrypt /photos --dry-run     # the same, for pipeline.py's settings
+
+No calibration saved? A quick model is measured on the spot (a few
+seconds). The prediction is an estimate: real photos differ from the
+test photo, and other programs share the computer. Expect it to be
+within a factor of about 1.5, not to the second.
+"""
+
+import argparse
+import json
+import os
+import sys
+
+from PIL import Image
+
+import compression
+import tuning
+from admission import estimate_memory
+from calibrate import measure_formats, model_key
+from client import read_password
+from image_encryption import (DEFAULT_PROFILE, ENCODING_PROFILES, FRAMES_MAGIC, RAW_MAGIC, ImageEncryption,
+                              make_key, sniff_format, xor_bytes)
+
+
+DEFAULT_SAMPLE = 50  # Headers opened per format
+MAGIC_BYTES = 16     # Enough for every signature we know
+
+
+# ========== 1. SCAN ==========
+
+def _walk(path: str):
+    """Every file under path (or path itself), as (path, size) - with os.scandir."""
+    if not os.path.isdir(path):
+        yield path, os.path.getsize(path)
+        return
+    folders = [path]
+    while folders:
+        with os.scandir(folders.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    folders.append(entry.path)
+                elif entry.is_file():
+                    yield entry.path, entry.stat().st_size
+
+
+def classify(head: bytes, op: str, key: bytes = None) -> str:
+    """
+    What a file is, from its first bytes: "JPEG", "PNG"... for images to
+    encrypt. For decrypt, the decrypted payload's kind: "PNG", "WEBP",
+    "RAW", "FRAMES" or "COMPRESSED". None = not something we'd touch.
+    """
+    if op == "encrypt":
+        return sniff_format(head)
+    plain = xor_bytes(head, key)
+    if plain.startswith(FRAMES_MAGIC):
+        return "FRAMES"
+    if plain.startswith(RAW_MAGIC):
+        return "RAW"
+    if compression.is_compressed(plain):
+        return "COMPRESSED"
+    return sniff_format(plain)  # None: not encrypted with this password
+
+
+def scan(paths: list, op: str, password: str = None) -> tuple:
+    """Returns ({kind: [(path, size), ...]}, number of files left out, their bytes)."""
+    key = make_key(password) if op == "decrypt" else None
+    kinds, skipped, skipped_bytes = {}, 0, 0
+    for top in paths:
+        for path, size in _walk(top):
+            try:
+                with open(path, 'rb') as f:
+                    kind = classify(f.read(MAGIC_BYTES), op, key)
+            except OSError:
+                kind = None
+            if kind is None:
+                skipped += 1
+                skipped_bytes += size
+            else:
+                kinds.setdefault(kind, []).append((path, size))
+    return kinds, skipped, skipped_bytes
+
+
+# ========== 2. SAMPLE ==========
+
+def _pixels(path: str, op: str, password: str, encryptor: ImageEncryption) -> int:
+    """Pixels in a file (all frames), from its header."""
+    if op == "encrypt":
+        with Image.open(path) as img:
+            width, height = img.size
+            frames = getattr(img, "n_frames", 1) if img.format in ("GIF", "TIFF", "PNG", "WEBP") else 1
+    else:
+        # _probe(), not probe_image(): a dry run shouldn't show up as probes in the metrics
+        info, _ = encryptor._probe(path, password)
+        (width, height), frames = info["size"], info["frames"]
+    return width * height * frames
+
+
+def sample(files: list, op: str, password: str, count: int) -> dict:
+    """Open `count` headers spread evenly over files. Returns bytes, pixels and memory estimates."""
+    encryptor = ImageEncryption(verbose=False)
+    step = max(1, len(files) // max(1, count))
+    result = {"bytes": 0, "pixels": 0, "memory": []}
+    for path, size in files[::step][:count]:
+        try:
+            pixels = _pixels(path, op, password, encryptor)
+            memory = estimate_memory(path, op, password)
+        except Exception:
+            continue  # Unreadable header - the batch will report it
+        result["bytes"] += size
+        result["pixels"] += pixels
+        result["memory"].append(memory)
+    return result
+
+
+# ========== 3. PREDICT ==========
+
+def load_model(profile: str, compression_name: str = None) -> tuple:
+    """(per-format model, where it came from) - the saved calibration, or one measured now."""
+    saved = tuning.measurements().get("models", {}).get(model_key(profile, compression_name))
+    if saved:
+        return saved, "calibrate.py"
+    return measure_formats(profile, compression_name, repeat=1), "measured just now"
+
+
+def speedup(workers: int, processes: bool = False) -> float:
+    """How many times faster `workers` workers are than one, here (measured, if calibrated)."""
+    measured = tuning.measurements().get("process_images_s" if processes else "thread_images_s")
+    if measured:
+        speeds = {int(count): speed for count, speed in measured.items()}
+        usable = [count for count in speeds if count <= workers]
+        if usable and 1 in speeds:
+            return speeds[max(usable)] / speeds[1]
+    return float(min(workers, tuning.usable_cpus()))
+
+
+def _average(model: dict, field: str) -> float:
+    return sum(row[field] for row in model.values()) / len(model)
+
+
+def plan(paths: list, op: str = "encrypt", workers: int = None, profile: str = DEFAULT_PROFILE,
+         compression_name: str = None, password: str = None, stream: bool = False,
+         sample_size: int = DEFAULT_SAMPLE, processes: bool = False, memory_budget: int = None) -> dict:
+    """
+    Predict a batch without running it. Returns a dict with a row per
+    kind of file and the totals: seconds, peak_memory, output_bytes.
+    """
+    if op == "decrypt" and password is None:
+        raise ValueError("Planning a decrypt needs the password (to tell what the files hold)")
+    workers = workers or tuning.setting("codec_threads") or tuning.usable_cpus()
+    kinds, skipped, skipped_bytes = scan(paths, op, password)
+    model, model_source = load_model(profile, compression_name)
+    measured = tuning.measurements()
+    stream_rate = max(measured.get("stream_mb_s", {"": 0}).values()) * 1e6  # 0 = disk not measured
+
+    rows, memory = [], []
+    for kind, files in sorted(kinds.items(), key=lambda item: -sum(size for _, size in item[1])):
+        size = sum(file_size for _, file_size in files)
+        row = {"kind": kind, "files": len(files), "bytes": size}
+        if stream:
+            # The bytes go through as they are: no pixels, output = input
+            row.update(pixels=None, output_bytes=size, cpu_seconds=size / (stream_rate or 200e6))
+            rows.append(row)
+            continue
+        found = sample(files, op, password, sample_size)
+        memory.extend(found["memory"])
+        entry = model.get(kind)
+        if found["bytes"]:
+            pixels = size * found["pixels"] / found["bytes"]
+        else:
+            per_mpix = entry["source_bytes_per_mpix"] if entry and op == "encrypt" else \
+                _average(model, "bytes_per_mpix")
+            pixels = size / per_mpix * 1e6
+        megapixels = pixels / 1e6
+        if op == "encrypt":
+            entry = entry or model["PNG"]
+            seconds_per_mpix = entry["encrypt_s_per_mpix"]
+            # A small file for its pixels (a plain graphic) stays small when re-encoded, so
+            # the output is scaled from the input size, not from the test photo's pixels
+            output = size * entry["bytes_per_mpix"] / entry["source_bytes_per_mpix"]
+        else:
+            # The payload is decoded whatever the original was - the formats' average is close
+            seconds_per_mpix = _average(model, "decrypt_s_per_mpix")
+            # We can't tell the original format without decoding - the payload's size is the best guess
+            output = size
+        row.update(pixels=int(pixels), output_bytes=int(output), cpu_seconds=megapixels * seconds_per_mpix)
+        rows.append(row)
+
+    input_bytes = sum(row["bytes"] for row in rows)
+    output_bytes = sum(row["output_bytes"] for row in rows)
+    cpu_seconds = sum(row["cpu_seconds"] for row in rows)
+    gain = speedup(workers, processes)
+    # The disk test read and wrote the same amount, so its rate covers both
+    disk_seconds = (input_bytes + output_bytes) / (2 * stream_rate) if stream_rate else 0.0
+
+    if stream:
+        peak = workers * 3 * tuning.setting("stream_chunk", 1024 * 1024)
+    else:
+        # Worst case: the biggest jobs all running at once
+        peak = sum(sorted(memory, reverse=True)[:workers])
+        if memory_budget:
+            peak = min(peak, max(memory_budget, max(memory, default=0)))
+
+    return {"op": op, "workers": workers, "profile": profile, "compression": compression_name,
+            "stream": stream, "rows": rows, "skipped_files": skipped, "skipped_bytes": skipped_bytes,
+            "input_bytes": input_bytes, "output_bytes": output_bytes, "cpu_seconds": cpu_seconds,
+            "speedup": gain, "disk_seconds": disk_seconds,
+            "seconds": max(cpu_seconds / gain, disk_seconds), "peak_memory": peak,
+            "model": model_source, "disk_measured": bool(stream_rate)}
+
+
+def _duration(seconds: float) -> str:
+    if seconds < 120:
+        return f"{seconds:.0f}s"
+    minutes = seconds / 60
+    if minutes < 120:
+        return f"{minutes:.0f} min"
+    return f"{minutes // 60:.0f}h {minutes % 60:02.0f}m"
+
+
+def _size(nbytes: float) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if nbytes < 1024:
+            return f"{nbytes:.1f} {unit}"
+        nbytes /= 1024
+    return f"{nbytes:.1f} TB"
+
+
+def print_plan(result: dict):
+    print(f"📋 Plan: {result['op']} with {result['workers']} workers, profile {result['profile']}"
+          f"{', ' + result['compression'] if result['compression'] else ''}"
+          f"{', streaming' if result['stream'] else ''} (model: {result['model']})")
+    print(f"{'kind':12} {'files':>9} {'input':>11} {'Mpixels':>10} {'output':>11} {'CPU time':>10}")
+    print("-" * 68)
+    for row in result["rows"]:
+        pixels = "-" if row["pixels"] is None else f"{row['pixels'] / 1e6:,.0f}"
+        print(f"{row['kind']:12} {row['files']:>9,} {_size(row['bytes']):>11} {pixels:>10} "
+              f"{_size(row['output_bytes']):>11} {_duration(row['cpu_seconds']):>10}")
+    if result["skipped_files"]:
+        print(f"{'(skipped)':12} {result['skipped_files']:>9,} {_size(result['skipped_bytes']):>11}"
+              f"   not images{' (or another password)' if result['op'] == 'decrypt' else ''}")
+    print()
+    bound = "disk" if result["disk_seconds"] > result["cpu_seconds"] / result["speedup"] else "CPU"
+    print(f"⏱️  Wall time:    ~{_duration(result['seconds'])} ({bound}-bound, "
+          f"workers give {result['speedup']:.1f}x)")
+    print(f"💾 Output:       ~{_size(result['output_bytes'])}")
+    print(f"🧠 Peak memory:  ~{_size(result['peak_memory'])}")
+    if not result["disk_measured"]:
+        print("   (disk speed not calibrated - run calibrate.py --dir <your disk> for the disk limit)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Predict a batch's time, memory and output size (dry run).")
+    parser.add_argument("op", choices=("encrypt", "decrypt"))
+    parser.add_argument("paths", nargs="+", help="Files, or folders (searched recursively)")
+    parser.add_argument("-p", "--password", help="decrypt: the password (or IMAGE_ENCRYPTION_PASSWORD)")
+    parser.add_argument("--workers", type=int, help="Workers you'll run with (default: the calibrated number)")
+    parser.add_argument("--processes", action="store_true", help="The workers are processes, not threads")
+    parser.add_argument("--profile", choices=list(ENCODING_PROFILES), default=DEFAULT_PROFILE)
+    parser.add_argument("--compress", choices=("zlib", "lzma"), help="Compress before encrypting")
+    parser.add_argument("--stream", action="store_true", help="Plan encrypt_stream (bytes as they are)")
+    parser.add_argument("--sample", type=int, default=DEFAULT_SAMPLE, help="Headers to open per format")
+    parser.add_argument("--memory-budget", type=int, metavar="MB", help="The budget you'll run with")
+    parser.add_argument("--json", action="store_true", help="Print the plan as JSON")
+    args = parser.parse_args(argv)
+
+    try:
+        password = read_password(args.password) if args.op == "decrypt" else None
+        result = plan(args.paths, args.op, args.workers, args.profile, args.compress, password, args.stream,
+                      args.sample, args.processes,
+                      args.memory_budget * 1024 * 1024 if args.memory_budget else None)
+    except (OSError, ValueError) as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print_plan(result)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
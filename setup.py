@@ -10,6 +10,7 @@ It will:
 1. Check if you have Python 3.7 or newer
 2. Install required libraries (PIL/Pillow for images)
 3. Test that everything works
+4. Measure the fastest settings for this computer (see calibrate.py)
 
 Just run: python3 setup.py
 """
@@ -161,10 +162,27 @@ def test_encryption():
         decrypted = encryptor.decrypt_image(encrypted, 'test123')
         print(f"✅ Decryption works! Created: {decrypted}")
         
+        # Animations and multi-page images: every frame has to come back, in order
+        made = ['_test_tiny.png', encrypted, decrypted]
+        pages = [Image.new('RGB', (10, 10), color=color) for color in ('red', 'green', 'blue')]
+        for extension in ('.gif', '.tiff', '.png'):  # .png = an animated PNG (APNG)
+            source = f'_test_pages_{extension[1:]}{extension}'  # Each gets its own _encrypted.png
+            pages[0].save(source, save_all=True, append_images=pages[1:], duration=100)
+            encrypted_pages = encryptor.encrypt_image(source, 'test123')
+            decrypted_pages = encryptor.decrypt_image(encrypted_pages, 'test123')
+            made += [source, encrypted_pages, decrypted_pages]
+            with Image.open(decrypted_pages) as img:
+                colors = []
+                for page in range(getattr(img, 'n_frames', 1)):
+                    img.seek(page)
+                    colors.append(img.convert('RGB').getpixel((0, 0)))
+            if colors != [(255, 0, 0), (0, 128, 0), (0, 0, 255)]:
+                raise ValueError(f"the {extension} frames came back wrong: {colors}")
+            print(f"✅ Multi-frame {extension} works! Created: {decrypted_pages}")
+
         # Clean up test files
-        os.remove('_test_tiny.png')
-        os.remove(encrypted)
-        os.remove(decrypted)
+        for f in made:
+            os.remove(f)
         print("✅ Cleaned up test files")
         
         print("\n🎉 All tests passed! Everything works!")
@@ -174,13 +192,32 @@ def test_encryption():
         print(f"❌ Test failed: {e}")
         
         # Try to clean up if test files exist
-        for f in ['_test_tiny.png', '_test_tiny_encrypted.png', '_test_tiny_decrypted.png']:
-            if os.path.exists(f):
+        for f in os.listdir('.'):
+            if f.startswith(('_test_tiny', '_test_pages')):
                 os.remove(f)
         
         return False
 
 
+def tune_for_this_computer():
+    """
+    Find the fastest settings for THIS computer (a quick calibrate.py run).
+    This step is optional - if it fails, the built-in defaults still work.
+    """
+    print("\n" + "="*60)
+    print("STEP 5: Tuning for this computer")
+    print("="*60)
+    
+    try:
+        from calibrate import calibrate
+        calibrate(quick=True)
+        print("✅ Tuned! (Run python3 calibrate.py any time to measure again)")
+    except Exception as e:
+        print(f"⚠️  Couldn't tune ({e}) - the built-in defaults will be used")
+    
+    return True
+
+
 def main():
     """
     Main setup function.
@@ -214,6 +251,9 @@ def main():
         print("\n❌ Setup failed: Encryption not working")
         return False
     
+    # Step 5: Measure the fastest settings (never fails the setup)
+    tune_for_this_computer()
+    
     # All done!
     print("\n" + "="*60)
     print("🎉 SETUP COMPLETE! 🎉")
@@ -0,0 +1,270 @@
+"""
+===============================================
+SHARED MEMORY - HAND IMAGES TO WORKER PROCESSES WITHOUT COPYING
+===============================================
+
+Python threads can't all crunch pixels at the same time, so for the
+heaviest work we use worker PROCESSES. But processes don't share memory:
+normally every image is "pickled" (turned into a message), sent down a
+pipe to the worker, and the result is pickled back. For big images that
+copying can take longer than the encryption itself!
+
+SHARED MEMORY is a block of RAM that several processes can see at once.
+So instead of sending the image, we:
+1. Read the file straight INTO a shared block ("segment")
+2. Send the worker only the segment's NAME and the data length (a few bytes)
+3. The worker encodes + XORs the image and writes the result back into
+   the same segment
+4. We write the result from the segment straight to the output file
+
+Creating segments is slow-ish, so a SegmentPool makes a few at the start
+and reuses them for every file. A file too big for a pooled segment gets
+a one-off segment of its own.
+
+Used by pipeline.py when you pass --processes N. Needs Python 3.8+.
+"""
+
+import io
+import os
+import queue       # The pool's free segments wait in a queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+from PIL import Image
+
+from arena import ViewFile
+from image_encryption import (FRAMES_MAGIC, ImageEncryption, atomic_output, make_key, open_payload,
+                              save_image, xor_bytes, xor_into)
+
+
+DEFAULT_SEGMENT_SIZE = 16 * 1024 * 1024  # Bigger files get a one-off segment
+
+
+class SegmentPool:
+    """
+    A fixed set of shared memory segments that get reused over and over.
+    acquire() waits when every segment is in use, which also stops the
+    file readers from racing too far ahead of the workers.
+    """
+
+    def __init__(self, count: int, size: int = DEFAULT_SEGMENT_SIZE):
+        self.size = size
+        self._segments = {}
+        self._free = queue.Queue()
+        for _ in range(count):
+            segment = shared_memory.SharedMemory(create=True, size=size)
+            self._segments[segment.name] = segment
+            self._free.put(segment)
+        self.stats = {"pooled": 0, "one_off": 0}
+        self._lock = threading.Lock()
+
+    def acquire(self, nbytes: int):
+        """Borrow a segment that can hold nbytes. Give it back with release()."""
+        with self._lock:
+            self.stats["one_off" if nbytes > self.size else "pooled"] += 1
+        if nbytes > self.size:
+            return shared_memory.SharedMemory(create=True, size=nbytes)
+        return self._free.get()
+
+    def is_pooled(self, segment) -> bool:
+        return segment.name in self._segments
+
+    def release(self, segment):
+        """Give a segment back (one-off segments are deleted instead)."""
+        if self.is_pooled(segment):
+            self._free.put(segment)
+        else:
+            _discard(segment)
+
+    def close(self):
+        """Delete every pooled segment. Nothing may use them afterwards."""
+        for segment in self._segments.values():
+            _discard(segment)
+        self._segments.clear()
+
+
+def _discard(segment):
+    """Close our view of a segment and delete it from the system."""
+    segment.close()
+    segment.unlink()
+
+
+# ========== CODE THAT RUNS INSIDE THE WORKER PROCESSES ==========
+
+_worker_encryptor = None
+_attached = {}  # Pooled segments this worker has already opened, by name
+
+
+def _init_worker(profile: str, compression: str, threads: int):
+    """Runs once when a worker process starts (like daemon.py's _warm_worker)."""
+    global _worker_encryptor
+    Image.init()
+    _worker_encryptor = ImageEncryption(verbose=False, profile=profile, compression=compression,
+                                        threads=threads)
+
+
+def _open(name: str):
+    """Open a segment someone else created."""
+    try:
+        # Python 3.13+: don't let this process's cleanup delete the parent's segment
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+
+def _attach(name: str, pooled: bool):
+    """Pooled segments stay open in the worker, since they come back again and again."""
+    if not pooled:
+        return _open(name)
+    if name not in _attached:
+        _attached[name] = _open(name)
+    return _attached[name]
+
+
+def _put_result(segment, data: bytes) -> dict:
+    """
+    Write a result into the job's segment. If it doesn't fit (a small JPEG
+    can become a much bigger PNG), make a new segment just for the result.
+    """
+    if len(data) <= segment.size:
+        segment.buf[:len(data)] = data
+        return {"length": len(data), "segment": None}
+    overflow = shared_memory.SharedMemory(create=True, size=len(data))
+    overflow.buf[:len(data)] = data
+    overflow.close()  # The parent deletes it once it's written out
+    return {"length": len(data), "segment": overflow.name}
+
+
+def _encrypt_segment(name: str, pooled: bool, length: int, key: bytes, convert_mode: str,
+                     profile: str) -> dict:
+    """Decode the image in the segment, encode + XOR it, and put it back."""
+    segment = _attach(name, pooled)
+    try:
+        # Read the segment in place (io.BytesIO would copy it first)
+        with ViewFile(segment.buf[:length]) as f, Image.open(f) as img:
+            if getattr(img, "n_frames", 1) > 1:
+                return {"frames": True}  # The parent hands these to encrypt_image()
+            details = {"mode": img.mode, "size": img.size, "format": img.format}
+            payload = _worker_encryptor.encode_payload(img, convert_mode, profile)
+        if len(payload) <= segment.size:
+            # Scramble straight into the segment - no extra copy of the payload
+            xor_into(payload, key, segment.buf)
+            result = {"length": len(payload), "segment": None}
+        else:
+            result = _put_result(segment, xor_bytes(payload, key))
+        result.update(details, nbytes=len(payload))
+        return result
+    finally:
+        if not pooled:
+            segment.close()
+
+
+def _decrypt_segment(name: str, pooled: bool, length: int, key: bytes, profile: str) -> dict:
+    """XOR the segment's bytes, check they're an image, and put the saved image back."""
+    segment = _attach(name, pooled)
+    try:
+        if xor_bytes(bytes(segment.buf[:len(FRAMES_MAGIC)]), key) == FRAMES_MAGIC:
+            return {"frames": True}  # The parent hands these to decrypt_image()
+        try:
+            img = open_payload(xor_bytes(segment.buf[:length], key), _worker_encryptor.threads)
+            img.load()
+        except Exception:
+            raise ValueError("❌ Decryption failed! Wrong password or corrupted file.")
+        buffer = io.BytesIO()
+        save_image(img, buffer, profile)
+        result = _put_result(segment, buffer.getbuffer())
+        result.update(mode=img.mode, size=img.size, nbytes=length)
+        return result
+    finally:
+        if not pooled:
+            segment.close()
+
+
+# ========== THE PARENT'S SIDE ==========
+
+class ProcessEngine:
+    """
+    Pipeline stages (read / work / write) that run the image work in
+    worker processes and pass the bytes through shared memory.
+    """
+
+    def __init__(self, encryptor: ImageEncryption, password: str, processes: int = None,
+                 segment_size: int = DEFAULT_SEGMENT_SIZE, segments: int = None,
+                 convert_mode: str = None, profile: str = None):
+        """
+        Parameters:
+        - encryptor: Its profile/compression settings are copied into the workers
+        - processes: Worker processes (default: one per CPU)
+        - segment_size: Bytes per pooled segment
+        - segments: Pooled segments (default: enough to keep every worker busy)
+        """
+        self.key = make_key(password)
+        self.hints = encryptor.hints
+        self.processes = processes or os.cpu_count() or 1
+        self.convert_mode = convert_mode
+        self.profile = profile or encryptor.profile
+        self.segments = SegmentPool(segments or self.processes * 3, segment_size)
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.processes, initializer=_init_worker,
+            initargs=(encryptor.profile, encryptor.compression, encryptor.threads))
+
+    def read(self, job):
+        """Read the input file straight into a shared segment."""
+        size = os.path.getsize(job.source)
+        job.segment = self.segments.acquire(size)
+        view = job.segment.buf
+        got = 0
+        with open(job.source, 'rb', buffering=0) as f:
+            self.hints.reading(f)
+            while got < size:
+                count = f.readinto(view[got:size])
+                if not count:
+                    break
+                got += count
+            self.hints.done_reading(f)
+        job.length = got
+
+    def _submit(self, job, function, *args) -> bool:
+        """
+        Send a job's segment NAME to a worker and wait for its answer.
+        Returns False for multi-frame images, which the caller must handle itself.
+        """
+        pooled = self.segments.is_pooled(job.segment)
+        result = self.executor.submit(function, job.segment.name, pooled, job.length,
+                                      self.key, *args).result()
+        if result.get("frames"):
+            return False
+        if result["segment"] is not None:
+            job.result_segment = shared_memory.SharedMemory(name=result["segment"])
+        job.length, job.mode, job.nbytes = result["length"], result["mode"], result["nbytes"]
+        job.size, job.format = result["size"], result.get("format")
+        return True
+
+    def encrypt(self, job) -> bool:
+        """Encode + XOR the job's image in a worker. False = it has several frames."""
+        return self._submit(job, _encrypt_segment, self.convert_mode, self.profile)
+
+    def decrypt(self, job) -> bool:
+        """XOR + check + save the job's image in a worker. False = it's a frame pack."""
+        return self._submit(job, _decrypt_segment, self.profile)
+
+    def write(self, job):
+        """Write the result from shared memory straight to the output file."""
+        segment = job.result_segment or job.segment
+        with atomic_output(job.output) as f:
+            f.write(segment.buf[:job.length])
+            self.hints.done_writing(f)
+
+    def finish(self, job):
+        """Give the job's segments back - called for EVERY job, even failed ones."""
+        if job.result_segment is not None:
+            _discard(job.result_segment)
+            job.result_segment = None
+        if job.segment is not None:
+            self.segments.release(job.segment)
+            job.segment = None
+
+    def close(self):
+        self.executor.shutdown()
+        self.segments.close()
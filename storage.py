@@ -0,0 +1,734 @@
+#!/usr/bin/env python3
+"""
+===============================================
+STORAGE BACKENDS - ENCRYPT STRAIGHT TO AND FROM OBJECT STORAGE
+===============================================
+
+encrypt_image() reads and writes files on THIS computer. But big image
+collections often live in an "object store" like Amazon S3 or MinIO:
+a web service where you GET and PUT whole files ("objects") by name.
+
+Downloading everything to disk first, encrypting, and uploading again
+doubles the disk use and the time. A STORAGE BACKEND lets us read from
+and write to either place with the same few calls:
+
+    LocalBackend(root)         - files in a folder
+    S3Backend(endpoint, bucket) - objects in an S3-compatible store
+
+Tricks that make the object store fast:
+- RANGED GETs: ask for just bytes 0-65535 of an object. Probing an
+  image's size downloads 64 KB, not the whole 40 MB photo.
+- MULTIPART PUTs: big uploads go up in 8 MB parts, so we never hold
+  more than one part in memory, however big the file is.
+- POOLED CONNECTIONS: opening an HTTP connection costs a few round
+  trips. We keep a few open and reuse them for request after request.
+
+Locations are written as URLs; anything else is a local path:
+
+    s3://photos/2019/cat.jpg     (endpoint from IMAGE_ENCRYPTION_S3_ENDPOINT,
+                                   keys from AWS_ACCESS_KEY_ID / AWS_SECRET_ACCESS_KEY)
+
+Try it without a real object store - this file includes a tiny
+stand-in server that keeps objects in a local folder:
+
+    python3 storage.py serve --root /tmp/objects --port 9000 &
+    export IMAGE_ENCRYPTION_S3_ENDPOINT=http://127.0.0.1:9000
+    python3 storage.py encrypt cat.jpg s3://photos/cat_encrypted.png -p secret
+    python3 storage.py probe s3://photos/cat_encrypted.png -p secret
+    python3 storage.py decrypt s3://photos/cat_encrypted.png cat.png -p secret
+    python3 storage.py encrypt big.tiff s3://photos/big.enc --stream -p secret   # constant memory
+"""
+
+import argparse
+import contextlib
+import datetime
+import hashlib
+import hmac
+import http.client
+import io
+import os
+import queue
+import shutil
+import sys
+import tempfile
+import threading
+import urllib.parse
+import uuid
+import xml.etree.ElementTree as ElementTree  # S3 answers in XML
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from PIL import Image
+
+from client import read_password
+from image_encryption import (FRAMES_MAGIC, PROBE_BYTES, ImageEncryption, atomic_output, make_key,
+                              open_payload, save_image, xor_bytes)
+
+
+ENDPOINT_ENV = "IMAGE_ENCRYPTION_S3_ENDPOINT"
+DEFAULT_ENDPOINT = "http://127.0.0.1:9000"
+DEFAULT_PART_SIZE = 8 * 1024 * 1024  # S3 wants parts of at least 5 MB (except the last)
+DEFAULT_POOL_SIZE = 8
+
+
+# ========== LOCAL FILES ==========
+
+class LocalBackend:
+    """Objects are files under a root folder (the root can be "" for plain paths)."""
+
+    def __init__(self, root: str = ""):
+        self.root = root
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.root, name) if self.root else name
+
+    def size(self, name: str) -> int:
+        return os.path.getsize(self._path(name))
+
+    def exists(self, name: str) -> bool:
+        return os.path.isfile(self._path(name))
+
+    def read_range(self, name: str, offset: int, length: int) -> bytes:
+        with open(self._path(name), 'rb') as f:
+            f.seek(offset)
+            return f.read(length)
+
+    def open_read(self, name: str):
+        """A binary file to read the whole object from, start to end."""
+        return open(self._path(name), 'rb')
+
+    @contextlib.contextmanager
+    def open_write(self, name: str):
+        """A binary file to write to. The object only appears if the with-block succeeds."""
+        path = self._path(name)
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        with atomic_output(path) as f:
+            yield f
+
+    def list(self, prefix: str = "") -> list:
+        """Names under root that start with prefix."""
+        top = self._path("") or "."
+        names = []
+        for folder, _, files in os.walk(top):
+            for filename in files:
+                name = os.path.relpath(os.path.join(folder, filename), top).replace(os.sep, "/")
+                if name.startswith(prefix):
+                    names.append(name)
+        return sorted(names)
+
+
+# ========== AN S3-COMPATIBLE OBJECT STORE ==========
+
+class StorageError(OSError):
+    """The object store said no (the HTTP status is in .status)."""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(f"HTTP {status}: {message}")
+        self.status = status
+
+
+class _ConnectionPool:
+    """
+    A few HTTP connections that are kept open and reused.
+    get() waits when all of them are busy.
+    """
+
+    def __init__(self, endpoint: str, size: int = DEFAULT_POOL_SIZE, timeout: float = 60):
+        parts = urllib.parse.urlsplit(endpoint)
+        self.host = parts.netloc
+        self._make = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+        self._host, self._port = parts.hostname, parts.port
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()  # The most recently used connection is the most likely alive
+        self._slots = threading.Semaphore(size)
+        self.stats = {"opened": 0, "reused": 0}
+
+    def get(self):
+        self._slots.acquire()
+        try:
+            connection = self._idle.get_nowait()
+            self.stats["reused"] += 1
+        except queue.Empty:
+            connection = self._make(self._host, self._port, timeout=self.timeout)
+            self.stats["opened"] += 1
+        return connection
+
+    def put(self, connection, reusable: bool = True):
+        """Hand a connection back. Broken ones (reusable=False) are closed instead."""
+        if reusable:
+            self._idle.put(connection)
+        else:
+            connection.close()
+        self._slots.release()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class _Response(io.RawIOBase):
+    """
+    An HTTP response body you read like a file. The connection goes back
+    to the pool once the body is read to the end (or closed).
+    """
+
+    def __init__(self, pool: _ConnectionPool, connection, response):
+        self._pool, self._connection, self._response = pool, connection, response
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer) -> int:
+        count = self._response.readinto(buffer)
+        if not count:
+            self._release()
+        return count
+
+    def _release(self):
+        if self._connection is not None:
+            finished = self._response.isclosed() or not self._response.length
+            self._pool.put(self._connection, reusable=finished and not self._response.will_close)
+            self._connection = None
+
+    def close(self):
+        self._release()
+        super().close()
+
+
+def _sign(method: str, host: str, path: str, query: dict, headers: dict, access_key: str,
+          secret_key: str, region: str):
+    """
+    AWS "Signature Version 4": prove we know the secret key without sending it.
+    Adds the Authorization header to headers. The body isn't hashed
+    (UNSIGNED-PAYLOAD), so big uploads don't have to be read twice.
+    """
+    now = datetime.datetime.now(datetime.timezone.utc)
+    stamp, day = now.strftime("%Y%m%dT%H%M%SZ"), now.strftime("%Y%m%d")
+    headers.update({"host": host, "x-amz-date": stamp, "x-amz-content-sha256": "UNSIGNED-PAYLOAD"})
+
+    signed = sorted(name.lower() for name in headers)
+    lowered = {name.lower(): str(value).strip() for name, value in headers.items()}
+    canonical_query = "&".join(f"{urllib.parse.quote(key, safe='-_.~')}={urllib.parse.quote(value, safe='-_.~')}"
+                               for key, value in sorted(query.items()))
+    canonical = "\n".join([method, path, canonical_query,
+                           "".join(f"{name}:{lowered[name]}\n" for name in signed),
+                           ";".join(signed), "UNSIGNED-PAYLOAD"])
+    scope = f"{day}/{region}/s3/aws4_request"
+    to_sign = "\n".join(["AWS4-HMAC-SHA256", stamp, scope, hashlib.sha256(canonical.encode()).hexdigest()])
+
+    signing_key = ("AWS4" + secret_key).encode()
+    for part in (day, region, "s3", "aws4_request"):
+        signing_key = hmac.new(signing_key, part.encode(), hashlib.sha256).digest()
+    signature = hmac.new(signing_key, to_sign.encode(), hashlib.sha256).hexdigest()
+    headers["Authorization"] = (f"AWS4-HMAC-SHA256 Credential={access_key}/{scope}, "
+                                f"SignedHeaders={';'.join(signed)}, Signature={signature}")
+
+
+def _xml_values(body: bytes, tag: str) -> list:
+    """Every <tag> text in an S3 XML answer (namespaces ignored)."""
+    root = ElementTree.fromstring(body)
+    return [element.text or "" for element in root.iter() if element.tag.split("}")[-1] == tag]
+
+
+class S3Backend:
+    """
+    Objects in one bucket of an S3-compatible store (AWS S3, MinIO, Ceph,
+    or the stand-in server below). Safe to share between threads.
+    """
+
+    def __init__(self, endpoint: str, bucket: str, access_key: str = None, secret_key: str = None,
+                 region: str = "us-east-1", pool_size: int = DEFAULT_POOL_SIZE,
+                 part_size: int = DEFAULT_PART_SIZE):
+        """
+        Parameters:
+        - endpoint: e.g. "http://127.0.0.1:9000" or "https://s3.eu-west-1.amazonaws.com"
+        - bucket: The bucket holding the objects
+        - access_key / secret_key: Credentials (leave out for the stand-in server)
+        - pool_size: HTTP connections kept open
+        - part_size: Bytes per part of a multipart upload
+        """
+        self.endpoint = endpoint
+        self.bucket = bucket
+        self.access_key, self.secret_key, self.region = access_key, secret_key, region
+        self.part_size = part_size
+        self.pool = _ConnectionPool(endpoint, pool_size)
+
+    @classmethod
+    def from_env(cls, bucket: str):
+        """Settings from IMAGE_ENCRYPTION_S3_ENDPOINT and the usual AWS_* variables."""
+        return cls(os.environ.get(ENDPOINT_ENV, DEFAULT_ENDPOINT), bucket,
+                   os.environ.get("AWS_ACCESS_KEY_ID"), os.environ.get("AWS_SECRET_ACCESS_KEY"),
+                   os.environ.get("AWS_REGION", "us-east-1"))
+
+    def _request(self, method: str, name: str = "", query: dict = None, body: bytes = None,
+                 headers: dict = None, stream: bool = False, expect: tuple = (200,)):
+        """
+        Send one request on a pooled connection.
+        Returns (status, headers, body) - or a _Response to read from if stream=True.
+        """
+        query = query or {}
+        path = "/" + urllib.parse.quote(f"{self.bucket}/{name}" if name else self.bucket, safe="/-_.~")
+        target = path + ("?" + urllib.parse.urlencode(sorted(query.items()), quote_via=urllib.parse.quote)
+                         if query else "")
+        # A connection the server closed while it sat in the pool fails at
+        # once - then we simply try again on a fresh one
+        for attempt in range(2):
+            headers_now = dict(headers or {})
+            if self.access_key:
+                _sign(method, self.pool.host, path, query, headers_now, self.access_key,
+                      self.secret_key, self.region)
+            connection = self.pool.get()
+            try:
+                connection.request(method, target, body=body, headers=headers_now)
+                response = connection.getresponse()
+            except (OSError, http.client.HTTPException) as e:
+                # Every failure gives the pool slot back - or the pool would run dry
+                self.pool.put(connection, reusable=False)
+                if attempt or not isinstance(e, (ConnectionError, http.client.HTTPException)):
+                    raise  # A timeout or an unknown host won't get better by asking again
+                continue
+            if stream and response.status in expect:
+                return _Response(self.pool, connection, response)
+            try:
+                data = response.read()
+            except BaseException:
+                self.pool.put(connection, reusable=False)
+                raise
+            self.pool.put(connection, reusable=not response.will_close)
+            if response.status not in expect:
+                if response.status == 404:
+                    raise FileNotFoundError(f"No such object: s3://{self.bucket}/{name}")
+                raise StorageError(response.status, data[:300].decode("utf-8", "replace"))
+            return response.status, response.headers, data
+
+    def size(self, name: str) -> int:
+        _, headers, _ = self._request("HEAD", name)
+        return int(headers["Content-Length"])
+
+    def exists(self, name: str) -> bool:
+        try:
+            self.size(name)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def read_range(self, name: str, offset: int, length: int) -> bytes:
+        """A RANGED GET: only these bytes are downloaded."""
+        if length <= 0:
+            return b""
+        _, _, data = self._request("GET", name, headers={"Range": f"bytes={offset}-{offset + length - 1}"},
+                                   expect=(200, 206, 416))
+        return data
+
+    def open_read(self, name: str):
+        """The whole object as a stream - it's read as it downloads, never all at once."""
+        return io.BufferedReader(self._request("GET", name, stream=True), buffer_size=1024 * 1024)
+
+    @contextlib.contextmanager
+    def open_write(self, name: str):
+        """
+        A binary file to write to. Small objects go up in one PUT; bigger
+        ones in parts of part_size. Nothing appears unless the with-block succeeds.
+        """
+        writer = _MultipartWriter(self, name)
+        try:
+            yield writer
+        except BaseException:
+            writer.abort()
+            raise
+        writer.finish()
+
+    def list(self, prefix: str = "") -> list:
+        names, token = [], None
+        while True:
+            query = {"list-type": "2", "prefix": prefix}
+            if token:
+                query["continuation-token"] = token
+            _, _, body = self._request("GET", query=query)
+            names.extend(_xml_values(body, "Key"))
+            tokens = _xml_values(body, "NextContinuationToken")
+            if not tokens or _xml_values(body, "IsTruncated") != ["true"]:
+                return names
+            token = tokens[0]
+
+    def close(self):
+        self.pool.close()
+
+
+class _MultipartWriter(io.RawIOBase):
+    """Collects written bytes and uploads them a part at a time."""
+
+    def __init__(self, backend: S3Backend, name: str):
+        self.backend, self.name = backend, name
+        self._buffer = bytearray()
+        self._upload_id = None
+        self._parts = []  # (part number, ETag)
+
+    def writable(self):
+        return True
+
+    def write(self, data) -> int:
+        self._buffer += data
+        while len(self._buffer) >= self.backend.part_size:
+            self._upload_part(bytes(self._buffer[:self.backend.part_size]))
+            del self._buffer[:self.backend.part_size]
+        return len(data)
+
+    def _upload_part(self, data: bytes):
+        if self._upload_id is None:
+            _, _, body = self.backend._request("POST", self.name, {"uploads": ""})
+            self._upload_id = _xml_values(body, "UploadId")[0]
+        number = len(self._parts) + 1
+        _, headers, _ = self.backend._request("PUT", self.name, {"partNumber": str(number),
+                                                                  "uploadId": self._upload_id}, data)
+        self._parts.append((number, headers["ETag"]))
+
+    def finish(self):
+        if self._upload_id is None:
+            self.backend._request("PUT", self.name, body=bytes(self._buffer))  # Small: one PUT
+            return
+        if self._buffer:
+            self._upload_part(bytes(self._buffer))
+            self._buffer.clear()
+        parts = "".join(f"<Part><PartNumber>{number}</PartNumber><ETag>{etag}</ETag></Part>"
+                        for number, etag in self._parts)
+        self.backend._request("POST", self.name, {"uploadId": self._upload_id},
+                              f"<CompleteMultipartUpload>{parts}</CompleteMultipartUpload>".encode())
+
+    def abort(self):
+        """Throw away the parts uploaded so far."""
+        if self._upload_id is not None:
+            try:
+                self.backend._request("DELETE", self.name, {"uploadId": self._upload_id}, expect=(200, 204))
+            except OSError:
+                pass  # The store cleans up old uploads itself eventually
+
+
+class RangeFile(io.RawIOBase):
+    """
+    A seekable, read-only "file" over any backend object, fetched with
+    ranged reads as it's read. Wrap it in io.BufferedReader, or give it to
+    probe_image(), which then downloads only the bytes it really needs.
+    """
+
+    def __init__(self, backend, name: str):
+        self.backend, self.name = backend, name
+        self.length = backend.size(name)
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer) -> int:
+        count = max(0, min(len(buffer), self.length - self.position))
+        if count:
+            data = self.backend.read_range(self.name, self.position, count)
+            count = len(data)
+            buffer[:count] = data
+            self.position += count
+        return count
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        base = {0: 0, 1: self.position, 2: self.length}[whence]
+        self.position = max(0, base + offset)
+        return self.position
+
+    def tell(self) -> int:
+        return self.position
+
+
+# ========== LOCATIONS ==========
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def open_location(location: str) -> tuple:
+    """
+    "s3://bucket/key" -> (S3Backend for bucket, "key"); anything else -> (LocalBackend(), path).
+    S3 backends are shared, so their connection pools are reused.
+    """
+    if not location.startswith("s3://"):
+        return LocalBackend(), location
+    bucket, _, name = location[len("s3://"):].partition("/")
+    with _backends_lock:
+        if bucket not in _backends:
+            _backends[bucket] = S3Backend.from_env(bucket)
+        return _backends[bucket], name
+
+
+def encrypt_object(encryptor: ImageEncryption, source: str, destination: str, password: str,
+                   stream: bool = False) -> int:
+    """
+    Encrypt from one location to another (either can be s3://...).
+
+    - Normal mode works like encrypt_image(): the picture is decoded and
+      re-encoded, so it needs the whole image in memory.
+    - stream=True works like encrypt_stream(): the bytes are encrypted as
+      they are, a chunk at a time, so memory stays small for any size.
+    Returns the number of bytes encrypted.
+    """
+    source_backend, source_name = open_location(source)
+    target_backend, target_name = open_location(destination)
+    with source_backend.open_read(source_name) as reader, target_backend.open_write(target_name) as writer:
+        if stream:
+            return encryptor.encrypt_stream(reader, writer, password)
+        data = reader.read()
+        with Image.open(io.BytesIO(data)) as img:
+            if getattr(img, "n_frames", 1) == 1:
+                encrypted = xor_bytes(encryptor.encode_payload(img), make_key(password))
+                writer.write(encrypted)
+                return len(encrypted)
+        # Animations are written frame by frame by encrypt_image(), which needs files
+        return _through_files(encryptor.encrypt_image, data, writer, password, ".gif")
+
+
+def decrypt_object(encryptor: ImageEncryption, source: str, destination: str, password: str,
+                   stream: bool = False) -> int:
+    """The opposite of encrypt_object(). Returns the number of bytes written."""
+    source_backend, source_name = open_location(source)
+    target_backend, target_name = open_location(destination)
+    with source_backend.open_read(source_name) as reader, target_backend.open_write(target_name) as writer:
+        if stream:
+            return encryptor.decrypt_stream(reader, writer, password)
+        data = reader.read()
+        decrypted = xor_bytes(data, make_key(password))
+        if decrypted.startswith(FRAMES_MAGIC):
+            return _through_files(encryptor.decrypt_image, data, writer, password, ".png")
+        try:
+            img = open_payload(decrypted, encryptor.threads)
+        except Exception:
+            raise ValueError("❌ Decryption failed! Wrong password or corrupted file.")
+        buffer = io.BytesIO()
+        save_image(img, buffer, encryptor.profile)
+        writer.write(buffer.getbuffer())
+        return buffer.tell()
+
+
+def _through_files(method, data: bytes, writer, password: str, extension: str) -> int:
+    """Run encrypt_image()/decrypt_image() on temp files, for the multi-frame cases."""
+    with tempfile.TemporaryDirectory() as folder:
+        source = os.path.join(folder, "input" + extension)
+        with open(source, 'wb') as f:
+            f.write(data)
+        with open(method(source, password, os.path.join(folder, "output")), 'rb') as f:
+            shutil.copyfileobj(f, writer)
+            return f.tell()
+
+
+def probe_object(encryptor: ImageEncryption, location: str, password: str) -> dict:
+    """probe_image() for any location: only the header bytes are downloaded."""
+    backend, name = open_location(location)
+    with io.BufferedReader(RangeFile(backend, name), buffer_size=PROBE_BYTES) as f:
+        return encryptor.probe_image(f, password)
+
+
+# ========== THE STAND-IN SERVER ==========
+# Just enough of the S3 protocol for this tool, with objects kept as
+# files under a folder. For trying things out and testing - there are no
+# passwords or permissions here, so only ever listen on 127.0.0.1!
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, so pooled connections get reused
+
+    def _split(self) -> tuple:
+        parts = urllib.parse.urlsplit(self.path)
+        bucket, _, name = urllib.parse.unquote(parts.path).lstrip("/").partition("/")
+        query = dict(urllib.parse.parse_qsl(parts.query, keep_blank_values=True))
+        if ".." in name.split("/") or ".." == bucket:
+            raise ValueError("bad name")
+        return bucket, name, query
+
+    def _file(self, bucket: str, name: str) -> str:
+        return os.path.join(self.server.root, bucket, *name.split("/"))
+
+    def _upload(self, query: dict, part: str = None) -> str:
+        """The folder of a multipart upload (or one part's file in it) - never outside it."""
+        upload_id = query.get("uploadId", "")
+        # We hand out hex ids and parts are numbered - anything else could be a path like ../..
+        if not upload_id.isalnum() or (part is not None and not part.isdigit()):
+            raise ValueError("bad upload id or part number")
+        folder = os.path.join(self.server.root, ".uploads", upload_id)
+        return folder if part is None else os.path.join(folder, part)
+
+    def _route(self, method):
+        """Run one do_...() with the request's bucket, name and query - a bad request gets a 400."""
+        try:
+            bucket, name, query = self._split()
+            method(bucket, name, query)
+        except ValueError:
+            self.close_connection = True  # The body may not have been read
+            self._send(400, b"<Error><Code>InvalidArgument</Code></Error>")
+
+    def _send(self, status: int, body: bytes = b"", headers: dict = None):
+        self.send_response(status)
+        for header, value in (headers or {}).items():
+            self.send_header(header, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def do_HEAD(self):
+        self._route(self._head)
+
+    def do_GET(self):
+        self._route(self._get)
+
+    def do_PUT(self):
+        self._route(self._put)
+
+    def do_POST(self):
+        self._route(self._post)
+
+    def do_DELETE(self):
+        self._route(self._delete)
+
+    def _head(self, bucket: str, name: str, query: dict):
+        path = self._file(bucket, name)
+        if not os.path.isfile(path):
+            return self._send(404)
+        self.send_response(200)
+        self.send_header("Content-Length", str(os.path.getsize(path)))
+        self.end_headers()
+
+    def _get(self, bucket: str, name: str, query: dict):
+        if not name:
+            prefix = query.get("prefix", "")
+            names = LocalBackend(os.path.join(self.server.root, bucket)).list(prefix)
+            keys = "".join(f"<Contents><Key>{_escape(key)}</Key></Contents>" for key in names)
+            return self._send(200, f"<ListBucketResult><IsTruncated>false</IsTruncated>{keys}"
+                                   f"</ListBucketResult>".encode())
+        path = self._file(bucket, name)
+        if not os.path.isfile(path):
+            return self._send(404, b"<Error><Code>NoSuchKey</Code></Error>")
+        size = os.path.getsize(path)
+        with open(path, 'rb') as f:
+            wanted = self.headers.get("Range")
+            if not wanted:
+                return self._send(200, f.read())
+            start, _, end = wanted.replace("bytes=", "").partition("-")
+            if start == "":
+                start, end = max(0, size - int(end)), size - 1
+            else:
+                start, end = int(start), min(int(end) if end else size - 1, size - 1)
+            if start >= size:
+                return self._send(416, headers={"Content-Range": f"bytes */{size}"})
+            f.seek(start)
+            self._send(206, f.read(end - start + 1), {"Content-Range": f"bytes {start}-{end}/{size}"})
+
+    def _put(self, bucket: str, name: str, query: dict):
+        if "uploadId" in query:
+            target = self._upload(query, query.get("partNumber", ""))
+            if not os.path.isdir(os.path.dirname(target)):
+                self.close_connection = True
+                return self._send(404, b"<Error><Code>NoSuchUpload</Code></Error>")
+        else:
+            target = self._file(bucket, name)
+        data = self._body()
+        etag = '"' + hashlib.md5(data).hexdigest() + '"'
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with atomic_output(target) as f:
+            f.write(data)
+        self._send(200, headers={"ETag": etag})
+
+    def _post(self, bucket: str, name: str, query: dict):
+        body = self._body()
+        if "uploads" in query:
+            upload_id = uuid.uuid4().hex
+            os.makedirs(os.path.join(self.server.root, ".uploads", upload_id))
+            return self._send(200, f"<InitiateMultipartUploadResult><UploadId>{upload_id}</UploadId>"
+                                   f"</InitiateMultipartUploadResult>".encode())
+        folder = self._upload(query)
+        if not os.path.isdir(folder):
+            return self._send(404, b"<Error><Code>NoSuchUpload</Code></Error>")
+        parts = [self._upload(query, number) for number in _xml_values(body, "PartNumber")]
+        target = self._file(bucket, name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with atomic_output(target) as out:
+            for path in parts:
+                with open(path, 'rb') as part:
+                    shutil.copyfileobj(part, out)
+        shutil.rmtree(folder)
+        self._send(200, b"<CompleteMultipartUploadResult/>")
+
+    def _delete(self, bucket: str, name: str, query: dict):
+        if "uploadId" in query:
+            shutil.rmtree(self._upload(query), ignore_errors=True)
+        elif os.path.isfile(self._file(bucket, name)):
+            os.remove(self._file(bucket, name))
+        self._send(204)
+
+    def log_message(self, format, *args):
+        """Don't print a line for every single request."""
+
+
+def _escape(text: str) -> str:
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def stand_in_server(root: str, port: int = 0) -> ThreadingHTTPServer:
+    """
+    Start the stand-in object store on 127.0.0.1 in a background thread.
+    port=0 picks a free port (see server.server_address). Stop it with shutdown().
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), _StandInHandler)
+    server.root = root
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Encrypt to and from object storage.")
+    parser.add_argument("command", choices=("encrypt", "decrypt", "probe", "serve"))
+    parser.add_argument("locations", nargs="*", help="Source and destination (s3://bucket/key or a path)")
+    parser.add_argument("-p", "--password", help="Password (or set IMAGE_ENCRYPTION_PASSWORD)")
+    parser.add_argument("--stream", action="store_true",
+                        help="Encrypt the bytes as they are, chunk by chunk (constant memory)")
+    parser.add_argument("--root", default="objects", help="serve: folder for the objects")
+    parser.add_argument("--port", type=int, default=9000, help="serve: port on 127.0.0.1")
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        os.makedirs(args.root, exist_ok=True)
+        server = stand_in_server(args.root, args.port)
+        print(f"🪣 Stand-in object store on http://127.0.0.1:{server.server_address[1]} ({args.root})")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            server.shutdown()
+        return 0
+
+    wanted = 1 if args.command == "probe" else 2
+    if len(args.locations) != wanted:
+        parser.error(f"{args.command} needs {wanted} location(s)")
+    encryptor = ImageEncryption(verbose=False)
+    try:
+        password = read_password(args.password)
+        if args.command == "probe":
+            info = probe_object(encryptor, args.locations[0], password)
+            print(f"🔎 {info['format']} {info['size'][0]}x{info['size'][1]} {info['mode']}, "
+                  f"{info['frames']} frame(s)")
+        else:
+            job = encrypt_object if args.command == "encrypt" else decrypt_object
+            count = job(encryptor, args.locations[0], args.locations[1], password, args.stream)
+            print(f"✅ {args.command.capitalize()}ed {count:,} bytes -> {args.locations[1]}")
+    except (OSError, ValueError) as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
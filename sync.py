@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+===============================================
+SYNC - ONLY ENCRYPT WHAT CHANGED
+===============================================
+
+Encrypting a whole folder every night redoes every file, even if only
+three of them changed. sync.py works like the "rsync" tool instead: it
+remembers what it did last time in a MANIFEST and only does the new work.
+
+    python3 sync.py photos/ encrypted/ -p secret
+    python3 sync.py photos/ encrypted/ -p secret --delete   # also remove outputs of deleted photos
+
+THE MANIFEST (encrypted/.image_encryption_manifest.json) remembers, for
+every photo: its size, its modification time, a hash of its contents,
+and the size + time of the encrypted file we made from it.
+
+HOW A FILE IS CHECKED (cheapest test first):
+1. Same size and modification time as last time, and the encrypted
+   file is untouched? -> unchanged, nothing to do (no reading at all!)
+2. Otherwise hash the contents. Same hash? -> only the time changed
+   (someone "touched" it): update the manifest, nothing to encrypt
+3. Otherwise -> changed: encrypt it again
+Photos in the manifest that are gone from the folder were DELETED.
+
+If the password, profile or compression changes, everything is
+encrypted again - the old files wouldn't match the new settings.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from client import read_password
+from image_encryption import (DEFAULT_PROFILE, ENCODING_PROFILES, ImageEncryption, atomic_output,
+                              encrypted_name, file_hash, key_fingerprint, make_key)
+from pipeline import Job, encrypt_pipeline
+
+
+MANIFEST_NAME = ".image_encryption_manifest.json"
+
+
+def scan(root: str, extensions: list, skip: str = None) -> dict:
+    """
+    Find every image under root (in sub-folders too).
+    Returns {relative path: os.stat result}. Paths always use "/".
+    """
+    found = {}
+    folders = [root]
+    while folders:
+        folder = folders.pop()
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if skip is None or os.path.abspath(entry.path) != skip:
+                        folders.append(entry.path)
+                elif entry.is_file() and entry.name.lower().endswith(tuple(extensions)):
+                    relative = os.path.relpath(entry.path, root).replace(os.sep, "/")
+                    found[relative] = entry.stat()
+    return found
+
+
+def load_manifest(dest_root: str) -> dict:
+    path = os.path.join(dest_root, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {"settings": None, "files": {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_manifest(dest_root: str, manifest: dict):
+    """Written atomically, so a crash never leaves half a manifest."""
+    with atomic_output(os.path.join(dest_root, MANIFEST_NAME)) as f:
+        f.write(json.dumps(manifest, indent=1, sort_keys=True).encode())
+
+
+def _output_intact(dest_root: str, entry: dict) -> bool:
+    """Is the encrypted file still exactly the one we wrote?"""
+    try:
+        st = os.stat(os.path.join(dest_root, entry["output"]))
+    except OSError:
+        return False
+    return st.st_size == entry["output_size"] and st.st_mtime_ns == entry["output_mtime_ns"]
+
+
+def plan_sync(source_root: str, dest_root: str, manifest: dict, settings: dict,
+              extensions: list, hash_threads: int = 8) -> dict:
+    """
+    Compare the folder with the manifest.
+    Returns lists of relative paths: new, changed, touched, unchanged, deleted,
+    plus "stats" (the stat result of every file found) and "hashes".
+    """
+    files = scan(source_root, extensions, skip=os.path.abspath(dest_root))
+    old = manifest["files"] if manifest.get("settings") == settings else {}
+
+    plan = {"new": [], "changed": [], "touched": [], "unchanged": [], "deleted": [],
+            "stats": files, "hashes": {}}
+    suspects = []  # Files whose size/time changed - only these get hashed
+    for relative, st in sorted(files.items()):
+        entry = old.get(relative)
+        if entry is None:
+            plan["new"].append(relative)
+        elif (entry["size"] == st.st_size and entry["mtime_ns"] == st.st_mtime_ns
+              and _output_intact(dest_root, entry)):
+            plan["unchanged"].append(relative)
+        else:
+            suspects.append(relative)
+
+    # Hash new and suspect files, several at once (hashlib runs in parallel)
+    to_hash = plan["new"] + suspects
+    with ThreadPoolExecutor(max_workers=hash_threads) as pool:
+        hashes = pool.map(lambda rel: file_hash(os.path.join(source_root, rel)), to_hash)
+        plan["hashes"] = dict(zip(to_hash, hashes))
+
+    for relative in suspects:
+        entry = old[relative]
+        if plan["hashes"][relative] == entry["sha256"] and _output_intact(dest_root, entry):
+            plan["touched"].append(relative)
+        else:
+            plan["changed"].append(relative)
+
+    plan["deleted"] = sorted(set(manifest["files"]) - set(files))
+    return plan
+
+
+def sync(source_root: str, dest_root: str, password: str, encryptor: ImageEncryption = None,
+         delete: bool = False, dry_run: bool = False, threads: dict = None) -> dict:
+    """
+    Bring dest_root up to date with source_root. Returns the plan plus
+    "failed" (relative path -> error) and "seconds".
+    """
+    start = time.perf_counter()
+    encryptor = encryptor or ImageEncryption(verbose=False)
+    settings = {"key": key_fingerprint(make_key(password)), "profile": encryptor.profile,
+                "compression": encryptor.compression}
+    manifest = load_manifest(dest_root)
+    plan = plan_sync(source_root, dest_root, manifest, settings, encryptor.supported_formats)
+    plan["failed"] = {}
+    if dry_run:
+        plan["seconds"] = time.perf_counter() - start
+        return plan
+
+    files = manifest["files"] if manifest.get("settings") == settings else {}
+    stats = plan["stats"]
+
+    def remember(relative, output_relative):
+        """Write a file's fingerprints into the manifest."""
+        st, out = stats[relative], os.stat(os.path.join(dest_root, output_relative))
+        files[relative] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns,
+                           "sha256": plan["hashes"].get(relative, files.get(relative, {}).get("sha256")),
+                           "output": output_relative, "output_size": out.st_size,
+                           "output_mtime_ns": out.st_mtime_ns}
+
+    # Touched files: same contents, new time - just update the manifest
+    for relative in plan["touched"]:
+        remember(relative, files[relative]["output"])
+
+    # New and changed files go through the pipeline. Outputs already taken
+    # by up-to-date files are off limits too.
+    jobs = []
+    outputs = {files[relative]["output"]: relative for relative in plan["unchanged"] + plan["touched"]}
+    for relative in plan["new"] + plan["changed"]:
+        output_relative = encrypted_name(relative)
+        if output_relative in outputs:
+            # e.g. photo.jpg and photo.png both want photo_encrypted.png
+            plan["failed"][relative] = f"same output as {outputs[output_relative]}: {output_relative}"
+            continue
+        outputs[output_relative] = relative
+        output = os.path.join(dest_root, output_relative)
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+        job = Job(len(jobs), os.path.join(source_root, relative), output)
+        job.relative, job.output_relative = relative, output_relative
+        jobs.append(job)
+
+    if jobs:
+        pipeline = encrypt_pipeline(encryptor, password, threads)
+        for job in pipeline.run(jobs):
+            if job.error is None:
+                remember(job.relative, job.output_relative)
+            else:
+                plan["failed"][job.relative] = str(job.error)
+                files.pop(job.relative, None)
+        plan["pipeline"] = pipeline
+
+    # Deleted photos: remove their encrypted files too, if asked
+    for relative in plan["deleted"]:
+        if delete:
+            entry = files.pop(relative, None) or manifest["files"][relative]
+            output = os.path.join(dest_root, entry["output"])
+            if os.path.exists(output):
+                os.remove(output)
+
+    save_manifest(dest_root, {"settings": settings, "files": files})
+    plan["seconds"] = time.perf_counter() - start
+    return plan
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Encrypt only the images that changed since last time.")
+    parser.add_argument("source", help="Folder of images")
+    parser.add_argument("dest", help="Folder for the encrypted copies (and the manifest)")
+    parser.add_argument("-p", "--password", help="Password (or set IMAGE_ENCRYPTION_PASSWORD)")
+    parser.add_argument("--profile", choices=list(ENCODING_PROFILES), default=DEFAULT_PROFILE)
+    parser.add_argument("--compress", choices=("zlib", "lzma"), help="Compress before encrypting")
+    parser.add_argument("--delete", action="store_true",
+                        help="Remove encrypted copies of images deleted from the source")
+    parser.add_argument("--dry-run", action="store_true", help="Only show what would happen")
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.source):
+        parser.error(f"Not a folder: {args.source}")
+    os.makedirs(args.dest, exist_ok=True)
+
+    encryptor = ImageEncryption(verbose=False, profile=args.profile, compression=args.compress)
+    plan = sync(args.source, args.dest, read_password(args.password), encryptor,
+                args.delete, args.dry_run)
+
+    if args.dry_run:
+        for kind in ("new", "changed", "deleted"):
+            for relative in plan[kind]:
+                print(f"{kind:8} {relative}")
+    for relative, error in plan["failed"].items():
+        print(f"❌ {relative}: {error}", file=sys.stderr)
+    deleted = "removed" if args.delete else "deleted at source (use --delete to remove)"
+    print(f"{'🔎 Would sync' if args.dry_run else '✅ Synced'} in {plan['seconds']:.2f}s: "
+          f"{len(plan['new'])} new, {len(plan['changed'])} changed, {len(plan['touched'])} touched, "
+          f"{len(plan['unchanged'])} unchanged, {len(plan['deleted'])} {deleted}")
+    return 1 if plan["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
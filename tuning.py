@@ -0,0 +1,99 @@
+"""
+===============================================
+TUNING - THE SETTINGS THAT ARE FASTEST ON THIS COMPUTER
+===============================================
+
+How big a chunk to read at a time, how many threads to use, and which
+way to do the XOR each have a different best value on a laptop, a
+64-core server and a small container. calibrate.py measures them on
+THIS computer and saves the winners in a small JSON "tuning profile":
+
+    ~/.config/image-encryption/tuning.json    (or $IMAGE_ENCRYPTION_TUNING)
+
+image_encryption.py, pipeline.py and daemon.py read it when they start
+and use its values as their defaults. Anything you pass yourself (like
+--codec-threads 4) still wins. No profile? The built-in defaults are used.
+
+A profile made on a different computer (a different number of CPUs) is
+ignored, so a copied home folder or a resized container can't slow
+things down with the wrong numbers. Run calibrate.py again there.
+"""
+
+import json
+import os
+import platform
+
+
+PROFILE_ENV = "IMAGE_ENCRYPTION_TUNING"
+
+_loaded = None  # The settings, once read
+
+
+def usable_cpus() -> int:
+    """CPUs this program may actually use (a container may get fewer than the computer has)."""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def host() -> dict:
+    """What a profile was measured on - it only applies to the same kind of host."""
+    return {"cpus": usable_cpus(), "machine": platform.machine(), "system": platform.system()}
+
+
+def profile_path() -> str:
+    if os.environ.get(PROFILE_ENV):
+        return os.environ[PROFILE_ENV]
+    config = os.environ.get("XDG_CONFIG_HOME") or os.path.join(os.path.expanduser("~"), ".config")
+    return os.path.join(config, "image-encryption", "tuning.json")
+
+
+def read_profile(path: str = None) -> dict:
+    """The whole saved profile (measurements included), or None if there isn't a readable one."""
+    try:
+        with open(path or profile_path()) as f:
+            profile = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return profile if isinstance(profile, dict) else None
+
+
+def load() -> dict:
+    """The tuned settings for this host ({} if there are none, or they're for another host)."""
+    global _loaded
+    if _loaded is None:
+        profile = read_profile()
+        if profile is None or profile.get("host") != host():
+            _loaded = {}
+        else:
+            _loaded = profile.get("settings", {})
+    return _loaded
+
+
+def measurements() -> dict:
+    """The raw numbers calibrate.py measured on this host ({} if none)."""
+    profile = read_profile()
+    if profile is None or profile.get("host") != host():
+        return {}
+    return profile.get("measurements", {})
+
+
+def setting(name: str, default=None):
+    """One tuned setting, or default if it hasn't been calibrated."""
+    return load().get(name, default)
+
+
+def save(settings: dict, measurements: dict = None, path: str = None) -> str:
+    """Write a profile for this host. Returns where it was saved."""
+    global _loaded
+    path = path or profile_path()
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    profile = {"host": host(), "settings": settings, "measurements": measurements or {}}
+    temp = f"{path}.part"
+    with open(temp, "w") as f:
+        json.dump(profile, f, indent=2)
+    os.replace(temp, path)
+    _loaded = None  # Read it again next time
+    return path
@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+"""
+===============================================
+WATCH - ENCRYPT IMAGES THE MOMENT THEY ARRIVE
+===============================================
+
+Say a camera or an upload server drops images into a "spool" folder.
+Running the encryptor from cron every 5 minutes means an image can sit
+there, unencrypted, for up to 5 minutes - and cron starts the whole
+program again even when there's nothing to do.
+
+WATCH MODE keeps running and reacts within a second:
+
+    python3 watch.py spool/ --output-dir encrypted/ -p secret --delete
+
+- On Linux, INOTIFY makes the kernel tell us when a file appears or
+  changes. Until then we sleep - no CPU used at all.
+- Elsewhere (or with --poll) we look at the folder every --interval
+  seconds instead. Still cheap, just a little slower to notice.
+- DEBOUNCE: an image is usually written bit by bit. Encrypting it
+  halfway would give a broken result! So a file only counts as finished
+  once its size and modification time haven't changed for --settle
+  seconds, and it starts with an image's magic bytes.
+- Finished files go to a pool of worker threads, so a burst of 100
+  images is encrypted several at a time.
+- Afterwards the original can be left alone, deleted (--delete) or
+  moved to another folder (--move-to done/). If encrypting fails, the
+  original is always left where it is.
+
+Files already in the folder when watching starts are encrypted too.
+Only the folder itself is watched, not folders inside it.
+"""
+
+import argparse
+import ctypes
+import ctypes.util
+import os
+import select
+import shutil
+import stat
+import struct
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from catalog import Catalog
+from client import read_password
+from image_encryption import (DEFAULT_PROFILE, ENCODING_PROFILES, ImageEncryption, encrypted_name,
+                              sniff_format)
+
+
+DEFAULT_SETTLE = 0.5    # Seconds a file must stay unchanged before we touch it
+DEFAULT_INTERVAL = 1.0  # Seconds between looks at the folder when polling
+
+# inotify event types (see "man 7 inotify")
+_IN_MODIFY = 0x002
+_IN_ATTRIB = 0x004
+_IN_CLOSE_WRITE = 0x008
+_IN_MOVED_TO = 0x080
+_IN_CREATE = 0x100
+_IN_Q_OVERFLOW = 0x4000
+_IN_NONBLOCK = os.O_NONBLOCK
+_IN_CLOEXEC = 0o2000000
+_EVENT = struct.Struct("iIII")  # watch, mask, cookie, name length (the name follows)
+
+
+class _Inotify:
+    """The Linux kernel's file change notifications, through ctypes."""
+
+    def __init__(self, folder: str):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or None, use_errno=True)
+        self.fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = _IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE
+        if libc.inotify_add_watch(self.fd, os.fsencode(folder), mask) < 0:
+            error = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(error, f"Can't watch {folder}")
+
+    def wait(self, timeout: float):
+        """
+        Sleep until something happens (or timeout seconds; None = forever).
+        Returns the names of the files that changed - or None if the
+        kernel's queue overflowed and we missed some.
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        names = set()
+        if not ready:
+            return names
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return names
+        position = 0
+        while position < len(data):
+            _, mask, _, length = _EVENT.unpack_from(data, position)
+            name = data[position + _EVENT.size:position + _EVENT.size + length].rstrip(b"\0")
+            position += _EVENT.size + length
+            if mask & _IN_Q_OVERFLOW:
+                return None
+            if name:
+                names.add(os.fsdecode(name))
+        return names
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Watcher:
+    """Watches one folder and encrypts every finished image that shows up in it."""
+
+    def __init__(self, folder: str, password: str, output_dir: str = None, encryptor: ImageEncryption = None,
+                 workers: int = 4, settle: float = DEFAULT_SETTLE, interval: float = DEFAULT_INTERVAL,
+                 delete: bool = False, move_to: str = None, poll: bool = False):
+        """
+        Parameters:
+        - folder: The spool folder to watch
+        - password: Password to encrypt with
+        - output_dir: Where encrypted files go (default: next to the
+                      originals - _encrypted.png files are never picked up)
+        - workers: How many images are encrypted at the same time
+        - settle: Seconds a file must stay unchanged before it counts as finished
+        - interval: Seconds between looks at the folder when polling
+        - delete / move_to: What to do with an original once it's encrypted
+        - poll: Don't use inotify, even where it's available
+        """
+        if delete and move_to:
+            raise ValueError("Pick --delete or --move-to, not both")
+        self.folder = folder
+        self.password = password
+        self.output_dir = output_dir
+        self.encryptor = encryptor or ImageEncryption(verbose=False)
+        self.settle = settle
+        self.interval = interval
+        self.delete = delete
+        self.move_to = move_to
+        self.poll = poll
+        self.pool = ThreadPoolExecutor(workers, thread_name_prefix="watch")
+        self._pending = {}    # name -> (size, mtime, when it last changed)
+        self._busy = set()    # Names being encrypted right now
+        self._done = {}       # Names we've finished with (or given up on) -> (size, mtime)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self.stats = {"encrypted": 0, "failed": 0, "skipped": 0}
+
+    # ========== NOTICING FILES ==========
+
+    def _wanted(self, name: str) -> bool:
+        """Skip hidden and temporary files, and our own output."""
+        return not (name.startswith(".") or name.endswith((".part", ".tmp", "_encrypted.png")))
+
+    def _look(self, names=None):
+        """
+        Check names (default: everything in the folder) and note when each one last changed.
+        """
+        if names is None:
+            names = [entry.name for entry in os.scandir(self.folder) if entry.is_file()]
+            with self._lock:
+                for gone in set(self._done) - set(names):
+                    del self._done[gone]  # Don't remember deleted files forever
+        now = time.monotonic()
+        for name in names:
+            if not self._wanted(name):
+                continue
+            try:
+                st = os.stat(os.path.join(self.folder, name))
+            except FileNotFoundError:
+                self._pending.pop(name, None)  # Gone again (renamed or deleted)
+                with self._lock:
+                    self._done.pop(name, None)
+                continue
+            if not stat.S_ISREG(st.st_mode):
+                continue  # A sub-folder (or a pipe...) - only files are encrypted
+            seen = (st.st_size, st.st_mtime_ns)
+            with self._lock:
+                # Being encrypted, or finished and not changed since
+                if name in self._busy or self._done.get(name) == seen:
+                    continue
+            old = self._pending.get(name)
+            if old is None or old[:2] != seen:
+                self._pending[name] = seen + (now,)
+
+    def _dispatch(self) -> float:
+        """
+        Hand every settled file to the workers.
+        Returns how long until the next pending file might settle (None = nothing pending).
+        """
+        now = time.monotonic()
+        wait = None
+        for name, (size, mtime, changed) in list(self._pending.items()):
+            path = os.path.join(self.folder, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                del self._pending[name]
+                continue
+            if not stat.S_ISREG(st.st_mode):
+                del self._pending[name]  # It became a folder (or a pipe...) under the same name
+                continue
+            if (st.st_size, st.st_mtime_ns) != (size, mtime):
+                self._pending[name] = (st.st_size, st.st_mtime_ns, now)  # Still being written
+                changed = now
+            left = changed + self.settle - now
+            if left > 0:
+                wait = left if wait is None else min(wait, left)
+                continue
+            del self._pending[name]
+            try:
+                with open(path, 'rb') as f:
+                    image_format = sniff_format(f.read(16))
+            except FileNotFoundError:
+                continue  # Deleted (or renamed) just now
+            except OSError as e:
+                print(f"⏭️  {name}: can't read it ({e}), leaving it alone", file=sys.stderr)
+                self.stats["skipped"] += 1
+                with self._lock:
+                    self._done[name] = (st.st_size, st.st_mtime_ns)
+                continue
+            if image_format is None:
+                if st.st_size:
+                    print(f"⏭️  {name}: not an image, leaving it alone")
+                    self.stats["skipped"] += 1
+                    with self._lock:
+                        self._done[name] = (st.st_size, st.st_mtime_ns)
+                continue  # Empty files are often about to be written - wait for more
+            with self._lock:
+                self._busy.add(name)
+            self.pool.submit(self._encrypt, name, (st.st_size, st.st_mtime_ns))
+        return wait
+
+    # ========== ENCRYPTING ==========
+
+    def _encrypt(self, name: str, seen: tuple):
+        source = os.path.join(self.folder, name)
+        output = encrypted_name(source)
+        if self.output_dir:
+            output = os.path.join(self.output_dir, os.path.basename(output))
+        start = time.perf_counter()
+        removed = False  # The original left the folder - nothing left to remember
+        try:
+            self.encryptor.encrypt_image(source, self.password, output)
+            if self.delete:
+                os.remove(source)
+                removed = True
+            elif self.move_to:
+                shutil.move(source, os.path.join(self.move_to, name))
+                removed = True
+        except Exception as e:
+            print(f"❌ {name}: {e}", file=sys.stderr)
+            self.stats["failed"] += 1
+        else:
+            print(f"🔒 {name} -> {output} ({(time.perf_counter() - start) * 1000:.0f} ms)")
+            self.stats["encrypted"] += 1
+        finally:
+            with self._lock:
+                self._busy.discard(name)
+                if removed:
+                    # No event tells us it's gone (we removed it), so forget it here -
+                    # or a long-running watcher would remember every file it ever saw
+                    self._done.pop(name, None)
+                else:
+                    self._done[name] = seen
+
+    # ========== THE MAIN LOOP ==========
+
+    def run(self):
+        """Watch until stop() (or Ctrl+C)."""
+        for folder in (self.output_dir, self.move_to):
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+        notifier = None
+        if not self.poll:
+            try:
+                notifier = _Inotify(self.folder)
+            except (OSError, AttributeError):
+                pass  # Not Linux (or no inotify left) - poll instead
+        print(f"👀 Watching {self.folder} ({'inotify' if notifier else f'polling every {self.interval}s'})")
+
+        self._look()  # Files that were there before we started
+        try:
+            while not self._stop.is_set():
+                wait = self._dispatch()
+                if notifier is None:
+                    self._stop.wait(self.interval if wait is None else min(wait, self.interval))
+                    self._look()
+                    continue
+                # Nothing pending? Sleep until the kernel wakes us (checking for stop now and then)
+                names = notifier.wait(1.0 if wait is None else wait)
+                self._look(names)  # None = events were lost, so look at everything
+        finally:
+            if notifier is not None:
+                notifier.close()
+            self.pool.shutdown(wait=True)
+
+    def stop(self):
+        self._stop.set()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Encrypt images as soon as they land in a folder.")
+    parser.add_argument("folder", help="The spool folder to watch")
+    parser.add_argument("-p", "--password", help="Password (or set IMAGE_ENCRYPTION_PASSWORD)")
+    parser.add_argument("--output-dir", help="Put encrypted files here instead of next to the originals")
+    parser.add_argument("--workers", type=int, default=4, help="Images encrypted at the same time")
+    parser.add_argument("--settle", type=float, default=DEFAULT_SETTLE,
+                        help="Seconds a file must stay unchanged before it's encrypted")
+    parser.add_argument("--poll", action="store_true", help="Look every --interval seconds instead of inotify")
+    parser.add_argument("--interval", type=float, default=DEFAULT_INTERVAL)
+    originals = parser.add_mutually_exclusive_group()
+    originals.add_argument("--delete", action="store_true", help="Delete originals once encrypted")
+    originals.add_argument("--move-to", metavar="FOLDER", help="Move originals here once encrypted")
+    parser.add_argument("--profile", choices=list(ENCODING_PROFILES), default=DEFAULT_PROFILE)
+    parser.add_argument("--compress", choices=("zlib", "lzma"), help="Compress before encrypting")
+    parser.add_argument("--catalog", metavar="FILE", help="Record every encrypted image in this catalog")
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.folder):
+        parser.error(f"{args.folder} is not a folder")
+    password = read_password(args.password)
+    catalog = Catalog(args.catalog) if args.catalog else None
+    encryptor = ImageEncryption(verbose=False, profile=args.profile, compression=args.compress,
+                                catalog=catalog)
+    watcher = Watcher(args.folder, password, args.output_dir, encryptor, args.workers, args.settle,
+                      args.interval, args.delete, args.move_to, args.poll)
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if catalog is not None:
+            catalog.close()
+    stats = watcher.stats
+    print(f"\n📊 {stats['encrypted']} encrypted, {stats['failed']} failed, {stats['skipped']} skipped")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())